@@ -27,6 +27,8 @@ class ConsoleMessageEvent(MessageEvent):
 
 class ConsoleContext(AdapterContext[ConsoleMessageEvent]):
     """控制台上下文"""
+    __slots__ = ()
+
     async def send(
         self,
         message: Message,
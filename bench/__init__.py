@@ -0,0 +1,14 @@
+"""
+基准测试
+
+覆盖：
+- event: emit 吞吐量与处理器数量、继承深度和一次性处理器的关系
+- predicate: match 在 OneBot 事件结构上的速度
+- utils: sorted_merge / sorted_append 的规模变化，AttrDict 的构造开销
+- adapter: 经过合成 Adapter 的端到端吞吐量和延迟分位数
+
+结果连同环境信息(Python 版本、平台、CPU 数、git 提交)保存为 JSON，
+compare 对比两次结果并标记超过阈值的退化
+
+添加基准测试：在模块中用 runner.benchmark 注册，并在 __main__ 中导入该模块
+"""
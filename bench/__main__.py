@@ -0,0 +1,56 @@
+"""
+用法：
+    python -m bench run [-o 结果.json] [-k 名称前缀 ...] [--scale 0.2]
+    python -m bench compare 旧.json 新.json [--threshold 0.1] [--absolute 0]
+    python -m bench list
+
+compare 在有结果退化超过阈值时以状态码 1 退出
+"""
+
+import sys
+import argparse
+from time import strftime
+
+from . import runner
+from . import event, predicate, utils, adapter  # 注册基准测试
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='运行基准测试并保存结果')
+    run.add_argument('-o', '--output', default=None, help='结果路径，默认为 bench/results/<时间>.json')
+    run.add_argument('-k', '--only', nargs='*', default=None, help='只运行名称以这些前缀开头的测试')
+    run.add_argument('--scale', type=float, default=1.0, help='迭代次数的倍数，调小可以快速运行')
+
+    compare = commands.add_parser('compare', help='对比两次运行的结果')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1, help='变差超过这个比例时视为退化')
+    compare.add_argument('--absolute', type=float, default=0.0, help='旧值为 0 时，变差超过这个数值视为退化')
+
+    commands.add_parser('list', help='列出所有基准测试')
+
+    args = parser.parse_args(argv)
+    if args.command == 'list':
+        print('\n'.join(runner.BENCHMARKS))
+        return 0
+    if args.command == 'run':
+        data = runner.run(args.only, args.scale)
+        output = args.output or f"bench/results/{strftime('%Y%m%d-%H%M%S')}.json"
+        runner.save(data, output)
+        print(f'结果已保存到 {output}')
+        return 0
+
+    rows = runner.compare(runner.load(args.old), runner.load(args.new), args.threshold, args.absolute)
+    print(runner.format_compare(rows))
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f'\n{len(regressions)} 项退化超过 {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+端到端：消息经过 Adapter 的队列、分发、emit、处理器和回复发送的吞吐量和延迟
+"""
+
+import asyncio
+from time import perf_counter
+
+from core.event import Context, on, remove_handlers
+from core.message import MessageEvent, GroupMessageEvent
+from core.adapter import Adapter, AdapterContext
+from .runner import benchmark, result, percentile
+
+
+class BenchContext(AdapterContext):
+    __slots__ = ()
+
+
+class BenchAdapter(Adapter):
+    """从内存中产生消息，记录每条消息从接收到回复发出的时间"""
+    def __init__(self, count: int, interval: float = 0):
+        super().__init__()
+        self.count = count
+        self.interval = interval
+        self.next_id = 0
+        self.received: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.done = asyncio.get_running_loop().create_future()
+
+    @staticmethod
+    def get_context_type():
+        return BenchContext
+
+    async def recv(self):
+        if self.next_id >= self.count:
+            # 不再有消息，等待结束
+            await asyncio.Future()
+        if self.interval:
+            await asyncio.sleep(self.interval)
+        message_id = self.next_id
+        self.next_id += 1
+        self.received[message_id] = perf_counter()
+        return BenchContext(self.from_platform_event(message_id))
+
+    async def send(self, context: Context):
+        now = perf_counter()
+        message_id = int(context.event.message)
+        self.latencies.append(now - self.received.pop(message_id))
+        if len(self.latencies) == self.count:
+            self.done.set_result(now)
+
+    def from_platform_event(self, message_id: int):
+        return GroupMessageEvent(
+            time=0, self_id=10001, message_type='group', sub_type='normal', message_id=message_id,
+            user_id=555, message=[{'type': 'text', 'data': {'text': '/echo'}}], raw_message='/echo',
+            font=0, sender={'user_id': 555, 'nickname': 'Steve'}, group_id=987654,
+        )
+
+    def to_platform_event(self, event):
+        return event
+
+
+async def _run(count: int, interval: float, handlers: int) -> tuple[float, list[float]]:
+    # 模拟插件：若干个不回复的处理器，最后一个回复
+    for _ in range(handlers - 1):
+        on(MessageEvent)(lambda ctx: None)
+    on(MessageEvent)(lambda ctx: str(ctx.event.message_id))
+    adapter = BenchAdapter(count, interval)
+    start = perf_counter()
+    task = asyncio.create_task(adapter.start())
+    try:
+        end = await asyncio.wait_for(adapter.done, 60)
+    finally:
+        adapter.running = False
+        task.cancel()
+        remove_handlers(lambda handler: handler.event_type is MessageEvent or handler.func == adapter._send)
+    return count / (end - start), adapter.latencies
+
+
+@benchmark('adapter')
+def adapter_pipeline(scale: float):
+    count = max(100, int(5000 * scale))
+    for handlers in (1, 10):
+        throughput, latencies = asyncio.run(_run(count, 0, handlers))
+        yield result(f'handlers={handlers}/throughput', throughput, 'msg/s')
+        # 满载时的延迟包含排队时间
+        yield result(f'handlers={handlers}/saturated_p50', percentile(latencies, 50), 's', False)
+
+        # 稀疏到达时的延迟
+        _, latencies = asyncio.run(_run(max(50, count // 10), 0.001, handlers))
+        for p in (50, 95, 99):
+            yield result(f'handlers={handlers}/latency_p{p}', percentile(latencies, p), 's', False)
@@ -0,0 +1,130 @@
+"""
+事件系统：emit 吞吐量与处理器数量、继承深度和一次性处理器的关系，每次 emit 的内存分配
+"""
+
+import asyncio
+import tracemalloc
+
+from core.event import Event, Context, on, emit, remove_handlers
+from core.adapter import AdapterContext
+from .runner import benchmark, result, async_per_op
+
+
+def _chain(depth: int) -> list[type[Event]]:
+    """创建 depth 层继承的事件类"""
+    classes = []
+    base = Event
+    for i in range(depth):
+        base = type(f'BenchEvent{i}', (base,), {})
+        classes.append(base)
+    return classes
+
+def _cleanup(classes: list[type[Event]]):
+    classes = set(classes)
+    remove_handlers(lambda handler: handler.event_type in classes)
+
+
+@benchmark('emit/handlers')
+def emit_handlers(scale: float):
+    for count in (0, 1, 10, 100):
+        classes = _chain(1)
+        cls = classes[0]
+        for _ in range(count):
+            on(cls)(lambda ctx: None)
+        number = max(10, int(20000 * scale / max(count, 1) ** 0.5))
+        seconds = asyncio.run(async_per_op(lambda: emit(cls()), number))
+        _cleanup(classes)
+        yield result(f'count={count}', 1 / seconds, 'emit/s')
+
+@benchmark('emit/async_handlers')
+def emit_async_handlers(scale: float):
+    async def handler(ctx):
+        return None
+    for count in (1, 10):
+        classes = _chain(1)
+        cls = classes[0]
+        for _ in range(count):
+            on(cls)(handler)
+        seconds = asyncio.run(async_per_op(lambda: emit(cls()), int(10000 * scale)))
+        _cleanup(classes)
+        yield result(f'count={count}', 1 / seconds, 'emit/s')
+
+@benchmark('emit/depth')
+def emit_depth(scale: float):
+    """每一层继承上有一个处理器，触发最底层的事件"""
+    for depth in (1, 4, 16):
+        classes = _chain(depth)
+        for cls in classes:
+            on(cls)(lambda ctx: None)
+        leaf = classes[-1]
+        seconds = asyncio.run(async_per_op(lambda: emit(leaf()), int(10000 * scale)))
+        _cleanup(classes)
+        yield result(f'depth={depth}', 1 / seconds, 'emit/s')
+
+@benchmark('emit/once_churn')
+def emit_once_churn(scale: float):
+    """每次触发前注册一个一次性处理器，模拟 AdapterContext.recv 的用法"""
+    for background in (0, 50):
+        classes = _chain(1)
+        cls = classes[0]
+        for _ in range(background):
+            on(cls)(lambda ctx: None)
+
+        async def once():
+            on(cls).once()(lambda ctx: None)
+            await emit(cls())
+
+        seconds = asyncio.run(async_per_op(once, int(10000 * scale)))
+        _cleanup(classes)
+        yield result(f'background={background}', 1 / seconds, 'emit/s')
+
+@benchmark('emit/alloc')
+def emit_alloc(scale: float):
+    """
+    tracemalloc 统计的每次 emit 的内存分配：
+    peak 为 emit 期间临时分配的峰值字节数，retained 为 emit 结束后仍未释放的字节数
+    事件和上下文在计时外创建，只统计事件系统本身
+    """
+    number = max(100, int(5000 * scale))
+    for context_type in (Context, AdapterContext):
+        for count in (1, 10):
+            classes = _chain(2)
+            for cls in classes:
+                for _ in range(count):
+                    on(cls)(lambda ctx: None)
+            leaf = classes[-1]
+
+            async def measure():
+                contexts = [context_type(leaf()) for _ in range(number)]
+                for _ in range(10):
+                    await emit(context_type(leaf()))
+                peak = 0
+                tracemalloc.start()
+                try:
+                    start = tracemalloc.get_traced_memory()[0]
+                    for context in contexts:
+                        current = tracemalloc.get_traced_memory()[0]
+                        tracemalloc.reset_peak()
+                        await emit(context)
+                        peak += tracemalloc.get_traced_memory()[1] - current
+                    retained = tracemalloc.get_traced_memory()[0] - start
+                finally:
+                    tracemalloc.stop()
+                return peak / number, retained / number
+
+            peak, retained = asyncio.run(measure())
+            _cleanup(classes)
+            name = f'{context_type.__name__},handlers={count * 2}'
+            yield result(f'{name}/peak', peak, 'B', False)
+            yield result(f'{name}/retained', retained, 'B', False)
+
+        # 上下文对象本身的大小
+        tracemalloc.start()
+        try:
+            event = Event()
+            current = tracemalloc.get_traced_memory()[0]
+            contexts = [context_type(event) for _ in range(1000)]
+            size = (tracemalloc.get_traced_memory()[0] - current) / len(contexts)
+        finally:
+            tracemalloc.stop()
+        yield result(f'{context_type.__name__}/size', size, 'B', False)
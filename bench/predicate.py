@@ -0,0 +1,47 @@
+"""
+谓词：match 在常见 OneBot 事件结构上的速度
+"""
+
+from core.predicate import match, Or
+from .runner import benchmark, result, per_op
+
+
+def group_message(text: str = '/mc list', images: int = 0) -> dict:
+    """OneBot v11 群消息事件的 JSON 结构"""
+    message = [{'type': 'at', 'data': {'qq': '10001'}}, {'type': 'text', 'data': {'text': text}}]
+    message += [{'type': 'image', 'data': {'file': f'{i}.image', 'url': f'https://example.com/{i}'}} for i in range(images)]
+    return {
+        'time': 1700000000,
+        'self_id': 10001,
+        'post_type': 'message',
+        'message_type': 'group',
+        'sub_type': 'normal',
+        'message_id': 123456,
+        'group_id': 987654,
+        'user_id': 555,
+        'anonymous': None,
+        'message': message,
+        'raw_message': text,
+        'font': 0,
+        'sender': {'user_id': 555, 'nickname': 'Steve', 'card': '', 'role': 'member'},
+    }
+
+
+@benchmark('match')
+def match_payloads(scale: float):
+    number = int(50000 * scale)
+    payload = group_message(images=3)
+    miss = group_message()
+    miss['group_id'] = 1
+
+    cases = {
+        'flat_dict': (match({'post_type': 'message', 'message_type': 'group', 'group_id': 987654}), payload),
+        'flat_dict_miss': (match({'post_type': 'message', 'message_type': 'group', 'group_id': 987654}), miss),
+        'nested_sender': (match({'sender': {'role': Or('admin', 'owner', 'member')}}), payload),
+        'segment_list': (match({'message': [{'type': 'at'}, {'type': 'text', 'data': {'text': str}}]}), payload),
+        'segment_set': (match({'message': {match({'type': 'image'}), match({'type': 'at'})}}), payload),
+        'tuple_prefix': (match({'message': ({'type': 'at', 'data': {'qq': '10001'}},)}), payload),
+    }
+    for name, (matcher, arg) in cases.items():
+        assert matcher(arg) == (name != 'flat_dict_miss'), name
+        yield result(name, per_op(lambda: matcher(arg), number), 's', higher_is_better=False)
@@ -0,0 +1,177 @@
+"""
+基准测试的注册、计时、保存和对比
+"""
+
+import gc
+import os
+import math
+import sys
+import json
+import platform
+import subprocess
+from time import perf_counter, strftime
+from typing import Any, Callable, Iterable
+
+# 名称 -> 基准测试函数，函数接受 scale 并返回结果列表
+BENCHMARKS: dict[str, Callable[[float], Iterable[dict]]] = {}
+
+
+def benchmark(name: str):
+    """注册一个基准测试，函数接受 scale(迭代次数的倍数)，返回或产生 result() 的结果"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+def result(name: str, value: float, unit: str, higher_is_better: bool = True) -> dict:
+    return {'name': name, 'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def per_op(func: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    """重复 repeat 轮，每轮调用 number 次，返回最快一轮中每次调用的秒数"""
+    best = float('inf')
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = perf_counter()
+            for _ in range(number):
+                func()
+            best = min(best, perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / number
+
+async def async_per_op(func: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    """per_op 的异步版本，func 返回 awaitable"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            await func()
+        best = min(best, perf_counter() - start)
+    return best / number
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'time': strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+    }
+
+
+def run(names: Iterable[str] | None = None, scale: float = 1.0, log: Callable[[str], Any] = print) -> dict:
+    """运行基准测试，names 为 None 时运行全部，返回可以保存为 JSON 的结果"""
+    results = []
+    for name, func in BENCHMARKS.items():
+        if names is not None and not any(name.startswith(n) for n in names):
+            continue
+        log(f'== {name}')
+        for record in func(scale):
+            record['name'] = f"{name}/{record['name']}"
+            log(f"  {record['name']:<50} {format_value(record['value'], record['unit'])}")
+            results.append(record)
+    return {'environment': environment(), 'results': results}
+
+def format_value(value: float, unit: str) -> str:
+    if unit == 's':
+        if value < 1e-6:
+            return f'{value * 1e9:.1f}ns'
+        if value < 1e-3:
+            return f'{value * 1e6:.2f}us'
+        return f'{value * 1e3:.2f}ms'
+    return f'{value:,.1f} {unit}'
+
+def save(data: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1, absolute: float = 0.0) -> list[dict]:
+    """
+    对比两次运行，返回每个共同结果的变化
+    change 为正表示变好；低于 -threshold 时标记为退化
+    旧值为 0 时比例没有意义，改为比较差值，变差超过 absolute 时标记为退化，change 为正负无穷
+    越低越好的结果降到 0 时 change 为正无穷
+    """
+    old_results = {r['name']: r for r in old['results']}
+    rows = []
+    for r in new['results']:
+        o = old_results.get(r['name'])
+        if o is None:
+            continue
+        if o['value']:
+            ratio = r['value'] / o['value']
+            change = ratio - 1 if r['higher_is_better'] else (1 / ratio - 1 if ratio else math.inf)
+            regression = change < -threshold
+        else:
+            worse = -r['value'] if r['higher_is_better'] else r['value']
+            change = 0.0 if not worse else math.copysign(math.inf, -worse)
+            regression = worse > absolute
+        rows.append({
+            'name': r['name'],
+            'old': o['value'],
+            'new': r['value'],
+            'unit': r['unit'],
+            'change': change,
+            'regression': regression,
+        })
+    return rows
+
+def format_compare(rows: list[dict]) -> str:
+    lines = []
+    for row in rows:
+        mark = 'REGRESSION' if row['regression'] else ''
+        lines.append(
+            f"{row['name']:<50} {format_value(row['old'], row['unit']):>14} -> "
+            f"{format_value(row['new'], row['unit']):>14} {row['change']:+7.1%} {mark}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m bench.runner
+    def run(value: float, higher_is_better: bool) -> dict:
+        return {'results': [result('x', value, 's', higher_is_better)]}
+
+    def change(old: float, new: float, higher_is_better: bool) -> tuple[float, bool]:
+        row, = compare(run(old, higher_is_better), run(new, higher_is_better))
+        return row['change'], row['regression']
+
+    assert change(1.0, 1.05, False) == (1 / 1.05 - 1, False)
+    assert change(1.0, 2.0, False) == (-0.5, True)
+    assert change(2.0, 1.0, True) == (-0.5, True)
+    # 旧值为 0 时按差值判断
+    assert change(0.0, 5.0, False) == (-math.inf, True)
+    assert change(0.0, 5.0, True) == (math.inf, False)
+    assert change(0.0, 0.0, False) == (0.0, False)
+    # 降到 0
+    assert change(5.0, 0.0, False) == (math.inf, False)
+    assert change(5.0, 0.0, True) == (-1.0, True)
+    assert compare(run(0.0, False), run(5.0, False), absolute=10)[0]['regression'] is False
+    print(format_compare(compare(run(0.0, False), run(5.0, False))))
+    print("所有测试通过！")
@@ -0,0 +1,57 @@
+"""
+工具：sorted_merge / sorted_append 的规模变化，AttrDict 的构造开销，重复事件过滤
+"""
+
+import random
+
+from core.utils import sorted_merge, sorted_append, AttrDict
+from core.event import Event
+from core.dedup import Deduplicator
+from .runner import benchmark, result, per_op
+from .predicate import group_message
+
+
+@benchmark('sorted_merge')
+def bench_sorted_merge(scale: float):
+    rng = random.Random(0)
+    for lists, size in ((2, 10), (4, 10), (16, 10), (4, 1000)):
+        data = [sorted(rng.randrange(7) for _ in range(size)) for _ in range(lists)]
+        number = max(10, int(200000 * scale / (lists * size)))
+        yield result(f'lists={lists},size={size}', per_op(lambda: sorted_merge(*data), number), 's', False)
+
+@benchmark('sorted_append')
+def bench_sorted_append(scale: float):
+    rng = random.Random(0)
+    for size in (10, 100, 1000):
+        base = sorted(rng.randrange(7) for _ in range(size))
+        number = max(10, int(200000 * scale / size))
+        value = 3
+
+        def append():
+            lst = base.copy()
+            sorted_append(lst, value)
+        yield result(f'size={size}', per_op(append, number), 's', False)
+
+@benchmark('attrdict')
+def bench_attrdict(scale: float):
+    number = int(50000 * scale)
+    flat = {f'key{i}': i for i in range(10)}
+    payload = group_message(images=3)
+    yield result('flat_10', per_op(lambda: AttrDict(flat), number), 's', False)
+    yield result('onebot_payload', per_op(lambda: AttrDict(payload), number), 's', False)
+    d = AttrDict(payload)
+    yield result('getattr', per_op(lambda: d.sender, number * 4), 's', False)
+
+@benchmark('dedup')
+def bench_dedup(scale: float):
+    number = int(100000 * scale)
+    message = Event(group_message())
+    notice = Event(time=1, self_id=10001, post_type='notice', notice_type='group_increase', group_id=1, user_id=5)
+    # 窗口内已经记住了 max_keys 个 key
+    dedup = Deduplicator(window=3600, max_keys=200000)
+    for i in range(200000):
+        dedup.seen_key((10001, i))
+    yield result('message', per_op(lambda: dedup.seen(message), number), 's', False)
+    yield result('notice', per_op(lambda: dedup.seen(notice), number), 's', False)
+    keys = iter(range(10 ** 9))
+    yield result('new_key', per_op(lambda: dedup.seen_key(next(keys)), number), 's', False)
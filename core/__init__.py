@@ -10,7 +10,9 @@
 实现方式:
     - 使用 importlib 进行动态模块导入
     - 通过 asyncio 实现异步模块加载
-    - 利用 GC 和 atexit 确保模块正确卸载和清理
+    - 利用 GC 和 atexit 确保模块正确卸载和清理，每个模块的 unload 只调用一次
+    - 导入和启动模块时记录处理器的归属(core.event.owned)，卸载时移除模块注册的所有处理器
+    - 热重载时暂存新模块的处理器，旧模块卸载、新模块启动后与旧处理器原子交换
     - 通过文件系统遍历实现模块自动发现
 
 使用示例:
@@ -27,9 +29,12 @@
 
     # 卸载模块
     manager.unload_module("my_package.my_module")
+
+    # 重载模块以及依赖它的模块
+    await manager.reload_modules(["my_package.my_module"])
     ```
 
-    或者直接调用start，这会加载`adapters`和`mods`下的模块
+    或者直接调用start，这会加载`adapters`和`mods`下的模块，`python main.py --hot-reload` 启用热重载
 
     ```py
     asyncio.run(start())
@@ -38,6 +43,21 @@
 要求被加载的模块需要实现以下接口:
     - async def start(): 异步初始化函数
     - def unload(): 同步清理函数
+
+延迟加载:
+    模块可以在顶层声明 `__manifest__`，列出它关心的事件类和命令，
+    管理器只读取源码中的这一声明而不导入模块，先注册轻量的占位处理器，
+    直到第一个匹配的事件到达时才真正导入并 start，start() 完成前到达的事件会等待模块就绪，
+    之后按模块处理器自己的优先级执行
+
+    ```python
+    __manifest__ = {
+        'events': ['core.message.GroupMessageEvent'],
+        'commands': ['mc'],
+    }
+    ```
+
+    `__manifest__` 必须是字面量，因为它通过 ast 读取而不执行模块
 """
 
 import asyncio
@@ -49,48 +69,325 @@ import logging
 from inspect import iscoroutinefunction
 import traceback
 import atexit
+import ast
+
+from .event import Event, on, Order, collect_handlers, run_handlers, Context, remove_handlers, staged, owned
+from .command import command_filter
 
 logger = logging.getLogger(__name__)
 
-async def start():
-    module_manager = ModuleManager()
+async def start(hot_reload: bool = False, profile: bool = False):
+    """
+    加载 adapters 和 mods 下的模块
+
+    Args:
+        hot_reload: 监视模块文件并热重载
+        profile: 记录每个模块的导入和 start() 开销，报告写入 logs 目录
+    """
+    profiler = None
+    if profile:
+        from .startup import StartupProfiler
+        profiler = StartupProfiler()
+        profiler.install()
+    module_manager = ModuleManager(profiler=profiler)
     adapter_tasks = module_manager.load_mods('adapters')
     mod_tasks = module_manager.load_mods('mods')
-    await asyncio.gather(*(adapter_tasks + mod_tasks))
+    if hot_reload:
+        from .reload import Watcher
+        asyncio.create_task(Watcher(module_manager, ['adapters', 'mods']).run())
+    tasks = adapter_tasks + mod_tasks
+    if profiler is not None:
+        # 适配器的 start 通常不会结束，最多等待 window 秒后输出报告
+        if tasks:
+            await asyncio.wait(tasks, timeout=profiler.window)
+        profiler.uninstall()
+        profiler.warn_blocking()
+        profiler.write()
+    await asyncio.gather(*tasks)
+
+
+def read_manifest(file_path: str) -> dict | None:
+    """
+    从模块源码中读取顶层的 `__manifest__` 字面量，不导入模块
+    没有声明或声明不是字面量时返回 None
+    """
+    try:
+        with open(file_path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), file_path)
+    except (OSError, SyntaxError):
+        return None
+    for node in tree.body:
+        if (isinstance(node, ast.Assign)
+                and any(isinstance(t, ast.Name) and t.id == '__manifest__' for t in node.targets)):
+            try:
+                manifest = ast.literal_eval(node.value)
+            except ValueError:
+                logger.error(f"__manifest__ in {file_path} is not a literal, ignored.")
+                return None
+            return manifest if isinstance(manifest, dict) else None
+    return None
+
+def read_imports(file_path: str | None, module_path: str) -> set[str]:
+    """
+    读取模块源码中导入的模块名，相对导入会被解析为绝对路径
+    `from a import b` 同时记录 `a` 和 `a.b`，因为 b 可能是子模块
+    """
+    if file_path is None:
+        return set()
+    try:
+        with open(file_path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), file_path)
+    except (OSError, SyntaxError):
+        return set()
+    package = module_path.rpartition('.')[0]
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package.rsplit('.', node.level - 1)[0] if node.level > 1 else package
+                base = f"{base}.{node.module}" if node.module else base
+            else:
+                base = node.module
+            imports.add(base)
+            imports.update(f"{base}.{alias.name}" for alias in node.names)
+    return imports
+
+def to_module_path(dir_path: str, file_name: str) -> str:
+    """把目录下的 .py 文件名转换为包路径"""
+    module_name = file_name[:-3]  # 去掉 .py 后缀
+    return f"{dir_path.rstrip('/').replace('/', '.')}.{module_name}"
+
+def _within(module: str | None, module_path: str) -> bool:
+    """module 是否是 module_path 或它的子模块"""
+    return module is not None and (module == module_path or module.startswith(module_path + '.'))
+
+async def _await(awaitable):
+    return await awaitable
+
+def _resolve(dotted: str):
+    """把 `package.module.Name` 解析为对象"""
+    module_name, _, name = dotted.rpartition('.')
+    return getattr(importlib.import_module(module_name), name)
+
+
+def _tier(order: int) -> int:
+    """处理器的优先级归入 Order 中的哪一档"""
+    return min(max(order, Order.ADMIN), Order.RESULT)
+
+
+class LazyModule:
+    """
+    延迟加载模块的占位
+    在 Event 基类的每一档优先级上各注册一个强制执行的占位处理器，按 manifest 过滤事件，
+    首次命中时加载真正的模块，start() 完成之前到达的事件都在占位处理器中等待
+
+    本次 emit 收集的列表中没有模块自己的处理器，每个占位处理器只执行模块在同一档优先级上的处理器，
+    因此模块仍然排在更高优先级的处理器(例如 BLOCK 阶段的限流和 recv)之后，被截断的事件也不会交给模块
+    """
+    def __init__(self, manager: 'ModuleManager', module_path: str, manifest: dict):
+        self.manager = manager
+        self.module_path = module_path
+        self.event_types = tuple(_resolve(name) for name in manifest.get('events', ()))
+        commands = manifest.get('commands', ())
+        self._is_command = command_filter(*commands) if commands else None
+        self._ready: asyncio.Task | None = None
+
+        self.stubs = []
+        for order in range(Order.ADMIN, Order.RESULT + 1):
+            stub = on(Event).order(order).force().filter(self._match)
+            stub(self._stub(order))
+            self.stubs.append(stub)
+
+    def _match(self, context: Context) -> bool:
+        if self.event_types and isinstance(context.event, self.event_types):
+            return True
+        return self._is_command is not None and self._is_command(context)
+
+    def _stub(self, order: int):
+        async def lazy_stub(context: Context):
+            await self._trigger(context, order)
+        return lazy_stub
+
+    async def _trigger(self, context: Context, order: int):
+        # 第一个事件启动加载，之后加载完成前到达的事件都在这里排队等待
+        if self._ready is None:
+            self._ready = asyncio.create_task(self._load())
+        if not await asyncio.shield(self._ready):
+            return
+        # 占位处理器是强制执行的，传播是否已经停止由 run_handlers 按模块处理器自己的 force 判断
+        handlers = [handler for handler in collect_handlers(context.event.__class__)
+                    if _tier(handler._order) == order and self.manager.owns(self.module_path, handler)]
+        if handlers:
+            await run_handlers(context, handlers)
+
+    async def _load(self) -> bool:
+        del self.manager.lazy_modules[self.module_path]
+        logger.info(f"Lazy loading module: {self.module_path}")
+        # 模块的处理器暂存到 start() 完成，与移除占位处理器之间没有 await，
+        # 之后开始的 emit 只会看到模块自己的处理器
+        with staged(lambda handler: self.manager.owns(self.module_path, handler)) as pending:
+            await self.manager.load_module(self.module_path)
+            loaded = self.module_path in self.manager.modules
+            if not loaded:
+                pending.clear()
+        self.remove()
+        return loaded
+
+    def remove(self):
+        for stub in self.stubs:
+            stub.remove()
 
 
 class ModuleManager:
-    def __init__(self):
+    def __init__(self, lazy: bool = True, profiler=None, start_timeout: float = 1.0, stop_timeout: float = 10.0):
+        """
+        Args:
+            lazy: 是否启用 __manifest__ 延迟加载
+            profiler: 启动性能分析器 core.startup.StartupProfiler，为 None 时不记录
+            start_timeout: 热重载时等待新模块 start() 的秒数，超过后不再等待，新处理器直接生效
+                (适配器的 start() 是接收循环，不会结束)
+            stop_timeout: 热重载时等待旧适配器 stop() 的秒数
+        """
         self.modules = {}
+        self.profiler = profiler
+        self.lazy = lazy
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.lazy_modules: dict[str, LazyModule] = {}
+        # 模块源码中的导入，用于热重载时找出依赖者
+        self.imports: dict[str, set[str]] = {}
+        # 执行模块 start() 的任务，卸载时取消仍在运行的 start()
+        self.tasks: dict[str, asyncio.Task] = {}
+        # 导入失败的模块，文件修改后由 reload_modules 重新加载
+        self.failed: set[str] = set()
+        self._reloading = asyncio.Lock()
+        # 退出时统一卸载，保证每个模块的 unload 只被调用一次
+        atexit.register(self.unload_all)
+
+    @staticmethod
+    def owns(module_path: str, handler) -> bool:
+        """
+        判断处理器是否属于指定模块(或其子模块)
+        注册时所在的模块(handler.owner)或处理函数定义所在的模块任一匹配即可，
+        前者包括模块通过 core 中的类注册的处理器，例如适配器的发送处理器
+        """
+        return _within(handler.owner, module_path) or _within(getattr(handler.func, '__module__', None), module_path)
+
+    @staticmethod
+    def check_module(module) -> bool:
+        """检查模块是否实现了 start 和 unload 接口"""
+        module_path = module.__name__
+        if not hasattr(module, 'unload'):
+            logger.error(f"Module {module_path} has no 'unload' function, skip.")
+            return False
+        elif not callable(module.unload):
+            logger.error(f"Module {module_path} has 'unload', but it't not a function, skip.")
+            return False
+        elif iscoroutinefunction(module.unload):
+            logger.error(f"Module {module_path} has function 'unload', but it't an async function, skip.")
+            return False
+        elif not(hasattr(module, 'start') and iscoroutinefunction(module.start)):
+            logger.error(f"Module {module_path} has no 'reload' async function, skip.")
+            return False
+        return True
+
+    def _register(self, module_path: str, module):
+        self.modules[module_path] = module
+        self.imports[module_path] = read_imports(getattr(module, '__file__', None), module_path)
 
     async def load_module(self, module_path: str):
         """加载模块并调用 start 方法"""
+        self.failed.discard(module_path)
         try:
-            module = importlib.import_module(module_path)
-            if not hasattr(module, 'unload'):
-                logger.error(f"Module {module_path} has no 'unload' function, skip.")
-                return
-            elif not callable(module.unload):
-                logger.error(f"Module {module_path} has 'unload', but it't not a function, skip.")
-                return
-            elif iscoroutinefunction(module.unload):
-                logger.error(f"Module {module_path} has function 'unload', but it't an async function, skip.")
-                return
-            elif not(hasattr(module, 'start') and iscoroutinefunction(module.start)):
-                logger.error(f"Module {module_path} has no 'reload' async function, skip.")
+            with owned(module_path):
+                if self.profiler is None:
+                    module = importlib.import_module(module_path)
+                else:
+                    with self.profiler.importing(module_path):
+                        module = importlib.import_module(module_path)
+            if not self.check_module(module):
+                self._fail(module_path)
                 return
-            self.modules[module_path] = module
-            atexit.register(module.unload)
+            self._register(module_path, module)
             logger.info(f"Successfully loaded module: {module_path}")
-            await module.start()
         except Exception as e:
             logger.error(f"Failed to load module {module_path}")
             logger.error(traceback.format_exc())
+            self._fail(module_path)
+            return
+        await self._start(module_path, module)
+
+    def _fail(self, module_path: str):
+        """导入失败时移除导入过程中已经注册的处理器，等待文件修改后重试"""
+        self.failed.add(module_path)
+        sys.modules.pop(module_path, None)
+        remove_handlers(lambda handler: self.owns(module_path, handler))
+
+    async def _start(self, module_path: str, module, timeout: float | None = None):
+        """
+        在单独的任务中执行 start()，最多等待 timeout 秒，None 表示等到结束
+        任务中注册的处理器和创建的适配器都属于该模块，卸载时取消任务即可停止仍在运行的 start()
+        """
+        start = module.start()
+        if self.profiler is not None:
+            start = self.profiler.starting(module_path, start)
+        with owned(module_path):
+            task = asyncio.create_task(_await(start))
+        self.tasks[module_path] = task
+        task.add_done_callback(lambda task: self._started(module_path, task))
+        await asyncio.wait([task], timeout=timeout)
+
+    def _started(self, module_path: str, task: asyncio.Task):
+        if self.tasks.get(module_path) is task:
+            del self.tasks[module_path]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to start module {module_path}")
+            logger.error(''.join(traceback.format_exception(task.exception())))
+
+    async def stop_module(self, module_path: str):
+        """停止模块创建的适配器，并取消仍在运行的 start()，例如适配器的接收循环"""
+        from .adapter import Adapter
+
+        for adapter in list(Adapter.instances):
+            if _within(adapter.owner, module_path):
+                try:
+                    await asyncio.wait_for(adapter.stop(), self.stop_timeout)
+                except Exception:
+                    logger.error(f"Failed to stop adapter {adapter.name} of {module_path}")
+                    logger.error(traceback.format_exc())
+        task = self.tasks.pop(module_path, None)
+        if task is not None:
+            task.cancel()
+
+    async def remove_module(self, module_path: str):
+        """停止并卸载模块，用于模块文件被删除时"""
+        await self.stop_module(module_path)
+        self.unload_module(module_path)
+
+    @staticmethod
+    def _call_unload(module_path: str, module):
+        try:
+            module.unload()
+        except Exception:
+            logger.error(f"Failed to unload module {module_path}")
+            logger.error(traceback.format_exc())
 
     def unload_module(self, module_path: str):
-        """卸载模块（依赖GC自动清理）"""
+        """卸载模块，调用 unload 并移除它注册的处理器"""
+        lazy = self.lazy_modules.pop(module_path, None)
+        if lazy is not None:
+            lazy.remove()
+        self.failed.discard(module_path)
+        task = self.tasks.pop(module_path, None)
+        if task is not None:
+            task.cancel()
         if module_path in self.modules:
-            del self.modules[module_path]
+            module = self.modules.pop(module_path)
+            self.imports.pop(module_path, None)
+            self._call_unload(module_path, module)
+            remove_handlers(lambda handler: self.owns(module_path, handler))
             if module_path in sys.modules:
                 del sys.modules[module_path]
 
@@ -98,13 +395,119 @@ class ModuleManager:
             gc.collect()
         logger.info(f"Successfully unloaded module: {module_path}")
 
+    def unload_all(self):
+        """按加载的相反顺序卸载所有模块"""
+        for module_path in reversed(list(self.modules)):
+            self.unload_module(module_path)
+
+    def dependents(self, module_paths) -> list[str]:
+        """
+        返回这些模块以及直接或间接导入了它们的已加载模块
+        按依赖顺序排列，被依赖的模块在前
+        """
+        affected = set(module_paths)
+        changed = True
+        while changed:
+            changed = False
+            for module_path, imports in self.imports.items():
+                if module_path not in affected and imports & affected:
+                    affected.add(module_path)
+                    changed = True
+
+        ordered = []
+        visited = set()
+        def visit(module_path):
+            if module_path in visited:
+                return
+            visited.add(module_path)
+            for dep in sorted(self.imports.get(module_path, ()) & affected):
+                visit(dep)
+            ordered.append(module_path)
+        for module_path in sorted(affected):
+            visit(module_path)
+        return ordered
+
+    async def reload_modules(self, module_paths):
+        """
+        热重载模块以及依赖它们的模块
+
+        新模块导入和启动期间注册的处理器先暂存。全部导入成功后依次停止旧模块的适配器、移除旧处理器、
+        对每个旧模块调用一次 unload，再启动新模块，start() 完成(或超过 start_timeout 秒)后新处理器一次性生效；
+        已经开始的 emit 会在旧的处理器列表上执行完，之后开始的 emit 在新模块就绪前不会执行这些模块的处理器。
+        任一模块导入失败时恢复旧模块，处理器保持不变
+
+        之前导入失败的模块没有旧版本，直接重新加载
+        """
+        async with self._reloading:
+            retry = [module_path for module_path in module_paths if module_path in self.failed]
+            for module_path in retry:
+                logger.info(f"Retry loading module: {module_path}")
+                await asyncio.wait([asyncio.create_task(self.load_module(module_path))],
+                                   timeout=self.start_timeout)
+
+            targets = [module_path for module_path in self.dependents(set(module_paths) - set(retry))
+                       if module_path in self.modules]
+            if not targets:
+                return
+            old = {module_path: self.modules[module_path] for module_path in targets}
+            new = {}
+            # _replace 中的每一步各自记录错误而不抛出，这里只会捕获到导入失败
+            try:
+                with staged(lambda handler: any(self.owns(p, handler) for p in targets)):
+                    for module_path in targets:
+                        sys.modules.pop(module_path, None)
+                        with owned(module_path):
+                            module = importlib.import_module(module_path)
+                        if not self.check_module(module):
+                            raise ImportError(f"Module {module_path} is not a valid module")
+                        new[module_path] = module
+                    await self._replace(targets, old, new)
+            except Exception:
+                for module_path, module in old.items():
+                    sys.modules[module_path] = module
+                logger.error(f"Failed to reload modules {targets}, keep the old ones")
+                logger.error(traceback.format_exc())
+                return
+            gc.collect()
+
+    async def _replace(self, targets: list[str], old: dict, new: dict):
+        """在暂存上下文中停止并卸载旧模块，再启动新模块"""
+        for module_path in reversed(targets):
+            await self.stop_module(module_path)
+            # 暂存的新处理器不受影响
+            remove_handlers(lambda handler: self.owns(module_path, handler))
+            self._call_unload(module_path, old[module_path])
+        for module_path in targets:
+            self._register(module_path, new[module_path])
+            logger.info(f"Successfully reloaded module: {module_path}")
+        for module_path in targets:
+            await self._start(module_path, new[module_path], self.start_timeout)
+
     def load_mods(self, dir_path: str):
         """加载一个文件夹内的所有 Python 模块"""
         tasks = []
         for file_name in os.listdir(dir_path):
             if file_name.endswith('.py') and not file_name.startswith('_'):
-                module_name = file_name[:-3]  # 去掉 .py 后缀
-                module_path = f"{dir_path.rstrip('/').replace('/', '.')}.{module_name}"  # 将路径转换为包路径
+                module_path = to_module_path(dir_path, file_name)
+                if self.lazy and self.register_lazy(module_path, os.path.join(dir_path, file_name)):
+                    continue
                 task = asyncio.create_task(self.load_module(module_path))
                 tasks.append(task)
         return tasks
+
+    def register_lazy(self, module_path: str, file_path: str) -> bool:
+        """
+        如果模块声明了 __manifest__，为它注册延迟加载占位
+        返回是否注册成功，失败时调用方应当立即加载模块
+        """
+        manifest = read_manifest(file_path)
+        if manifest is None:
+            return False
+        try:
+            self.lazy_modules[module_path] = LazyModule(self, module_path, manifest)
+        except Exception:
+            logger.error(f"Invalid __manifest__ in {module_path}, load it eagerly.")
+            logger.error(traceback.format_exc())
+            return False
+        logger.info(f"Registered lazy module: {module_path}")
+        return True
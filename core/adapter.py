@@ -19,13 +19,19 @@
 from abc import abstractmethod
 from typing import Callable, Any, Type
 from contextlib import suppress
-from asyncio import Future, wait_for, sleep, gather, create_task, Queue
+from time import perf_counter
+from asyncio import Future, Task, wait_for, sleep, gather, create_task, Queue
+from weakref import WeakSet
 import logging
 logger = logging.getLogger(__name__)
 
-from .event import Event, Context, on, emit, Order, remove_handler
-from .message import Message, MessageEvent
+from .event import Event, Context, on, emit, Order, remove_handler, current_owner, owned, T
+from .message import Message, MessageEvent, MergedMessageEvent
 from .predicate import true_func
+from .cache import Cache
+from .utils import AttrDict
+from .metrics import registry
+from .dedup import Deduplicator
 
 
 
@@ -40,25 +46,64 @@ class SendMessageEvent(Event):
 class SendPrivateMessageEvent(SendMessageEvent):
     """私聊消息发送事件类"""
     def __init__(self, message: Message, user_id: int = None):
-        super().__init__()
-        self.message = message
+        super().__init__(message)
         self.user_id = user_id
 
 class SendGroupMessageEvent(SendMessageEvent):
     """群聊消息发送事件类"""
     def __init__(self, message: Message, group_id: int = None):
-        super().__init__()
-        self.message = message
+        super().__init__(message)
         self.group_id = group_id
 
-class AdapterContext(Context):
+class AdapterContext(Context[T]):
     '''
     适配器上下文基类，提供统一的消息发送和接收接口
     新的平台适配器应继承这个类
     以此为基底来添加 api
+
+    会话状态:
+    session 和 user_state 保存在有界的缓存中，长时间不活跃或数量超过上限时被淘汰，
+    插件应在其中使用自己的 key，例如 ctx.session.setdefault('my_plugin', {})
     '''
+    __slots__ = ('received_at', 'metrics')
+
+    # 按会话(群或私聊)和按用户的状态，所有适配器共享，24 小时没有访问后过期
+    sessions = Cache(max_items=5000, ttl=24 * 3600, sliding=True)
+    users = Cache(max_items=20000, ttl=24 * 3600, sliding=True)
+
     def __init__(self, event: Event):
         super().__init__(event)
+        # 适配器接收到事件的时间，用于统计排队时间和回复延迟
+        self.received_at: float | None = None
+
+    def session_key(self) -> tuple | None:
+        """当前会话的 key，群消息按群，私聊按用户"""
+        event = self.event
+        if event.get('group_id') is not None:
+            return ('group', event['group_id'])
+        if event.get('user_id') is not None:
+            return ('private', event['user_id'])
+        return None
+
+    @staticmethod
+    def _state(cache: Cache, key) -> AttrDict:
+        state = cache.get(key)
+        if state is None:
+            state = AttrDict()
+            cache.set(key, state)
+        return state
+
+    @property
+    def session(self) -> AttrDict:
+        """当前会话的状态，事件不属于任何会话时返回一个不会被保存的空字典"""
+        key = self.session_key()
+        return AttrDict() if key is None else self._state(self.sessions, key)
+
+    @property
+    def user_state(self) -> AttrDict:
+        """当前事件发送者的状态，跨会话共享"""
+        user_id = self.event.get('user_id')
+        return AttrDict() if user_id is None else self._state(self.users, user_id)
 
     async def send(
             self,
@@ -80,7 +125,7 @@ class AdapterContext(Context):
             **kws: 额外的上下文初始化参数
         """
         if message_type is None:
-            if isinstance(self.event, MessageEvent):
+            if isinstance(self.event, (MessageEvent, MergedMessageEvent)):
                 message_type = self.event.message_type
             elif not group_id is None:
                 message_type = 'group'
@@ -144,37 +189,116 @@ class AdapterContext(Context):
 
 
 
+_received = registry.counter('adapter_received_total', '接收的事件数', ['adapter', 'type'])
+_duplicates = registry.counter('adapter_duplicates_total', '被丢弃的重复事件数', ['adapter', 'type'])
+_queue_depth = registry.gauge('adapter_queue_depth', '等待分发的事件数', ['adapter'])
+_active_tasks = registry.gauge('adapter_active_tasks', '正在处理的事件数', ['adapter'])
+_queue_seconds = registry.histogram('adapter_queue_seconds', '事件在队列中等待的时间', ['adapter', 'type'])
+_handler_seconds = registry.histogram('adapter_handler_seconds', '事件处理器的总耗时', ['adapter', 'type'])
+_send_seconds = registry.histogram('adapter_send_seconds', '向平台发送消息的耗时', ['adapter', 'type'])
+_reply_seconds = registry.histogram('adapter_reply_seconds', '从接收事件到回复发出的时间', ['adapter', 'type'])
+
+def _type_label(event: Event) -> str:
+    """指标中的事件类型：消息按 private/group，其它按类名"""
+    if isinstance(event, SendGroupMessageEvent):
+        return 'group'
+    if isinstance(event, SendPrivateMessageEvent):
+        return 'private'
+    return event.get('message_type') or event.__class__.__name__
+
+
+class _EventMetrics:
+    """一个适配器接收的一种事件的指标子项，每种事件只调用一次 labels()"""
+    __slots__ = ('received', 'duplicates', 'queue', 'handler', 'reply')
+
+    def __init__(self, adapter: str, type_label: str):
+        self.received = _received.labels(adapter, type_label)
+        self.duplicates = _duplicates.labels(adapter, type_label)
+        self.queue = _queue_seconds.labels(adapter, type_label)
+        self.handler = _handler_seconds.labels(adapter, type_label)
+        self.reply = _reply_seconds.labels(adapter, type_label)
+
+
 class Adapter:
     """
     通用适配器基类，提供消息队列和并发处理功能
+
+    指标(core.metrics)按适配器类名和事件类型记录：
+    接收数、重复数、队列深度、活跃任务数、排队时间、处理时间、发送耗时和回复延迟
+
+    所有存活的适配器记录在 instances 中，owner 为创建适配器的模块，
+    模块管理器在卸载和热重载这个模块时调用 stop
     """
-    def __init__(self, max_concurrent=100, queue_size: int = 1000):
+    instances: 'WeakSet[Adapter]' = WeakSet()
+
+    def __init__(self, max_concurrent=100, queue_size: int = 1000, dedup_window: float = 60):
         """
         初始化适配器
 
         Args:
             max_concurrent: 最大并发处理任务数
             queue_size: 消息队列大小
+            dedup_window: 在这段时间(秒)内重复收到的事件会在入队前被丢弃，0 表示不去重
         """
         self.running = False
         self.max_concurrent = max_concurrent
         self.message_queue: Queue[AdapterContext[Event]] = Queue(maxsize=queue_size)
         self.active_tasks = set()
+        self.name = self.__class__.__name__
+        self.owner = current_owner()
+        self._dispatcher_task: Task | None = None
+        self.deduplicator = Deduplicator(dedup_window) if dedup_window else None
+        # 事件类型 -> 指标子项
+        self._event_metrics: dict[str, _EventMetrics] = {}
+        self._send_metrics: dict[str, Any] = {}
+
+        _queue_depth.labels(self.name).set_function(self.message_queue.qsize)
+        _active_tasks.labels(self.name).set_function(
+            lambda: sum(not task.done() for task in self.active_tasks))
 
         (on(SendMessageEvent)
             .filter(lambda context:
                     isinstance(context, self.get_context_type()))
-        (self.send))
+        (self._send))
+        Adapter.instances.add(self)
+
+    async def _send(self, context: AdapterContext[SendMessageEvent]):
+        """记录发送耗时后交给 send"""
+        start = perf_counter()
+        try:
+            return await self.send(context)
+        finally:
+            type_label = _type_label(context.event)
+            child = self._send_metrics.get(type_label)
+            if child is None:
+                child = self._send_metrics[type_label] = _send_seconds.labels(self.name, type_label)
+            child.observe(perf_counter() - start)
+
+    def _metrics_for(self, event: Event) -> _EventMetrics:
+        """接收的事件对应的指标子项，按事件类型缓存"""
+        type_label = _type_label(event)
+        metrics = self._event_metrics.get(type_label)
+        if metrics is None:
+            metrics = self._event_metrics[type_label] = _EventMetrics(self.name, type_label)
+        return metrics
 
     async def start(self):
         """启动适配器，开始接收和处理消息"""
         self.running = True
-        # 启动消息分发器
-        create_task(self._dispatcher())
+        # 启动消息分发器，处理事件的任务不继承适配器模块的 owner
+        with owned(None):
+            self._dispatcher_task = create_task(self._dispatcher())
 
         while self.running:
             try:
                 context = await self.recv()
+                context.received_at = perf_counter()
+                context.metrics = metrics = self._metrics_for(context.event)
+                metrics.received.inc()
+                # 重连后重发或重复推送的事件，在占用队列之前丢弃
+                if self.deduplicator is not None and self.deduplicator.seen(context.event):
+                    metrics.duplicates.inc()
+                    continue
                 # 将新消息放入队列
                 await self.message_queue.put(context)
             except Exception as e:
@@ -185,8 +309,9 @@ class Adapter:
         """
         消息分发器
         负责从队列获取消息并创建新的处理任务，同时管理并发数量
+        停止后继续分发队列中剩余的消息，队列为空时由 stop 取消
         """
-        while self.running:
+        while self.running or not self.message_queue.empty():
             try:
                 # 当活跃任务数量达到上限时等待
                 while len(self.active_tasks) >= self.max_concurrent:
@@ -201,6 +326,7 @@ class Adapter:
                         await sleep(0.1)
 
                 context = await self.message_queue.get()
+                context.metrics.queue.observe(perf_counter() - context.received_at)
                 # 创建新的处理任务
                 task = create_task(self._handle_recv(context))
                 self.active_tasks.add(task)
@@ -216,6 +342,9 @@ class Adapter:
         #TODO 需要能够主动断开连接，否则self.recv会卡住
         # 等待所有消息处理完成
         await self.message_queue.join()
+        if self._dispatcher_task is not None:
+            self._dispatcher_task.cancel()
+            self._dispatcher_task = None
         # 等待所有活跃任务完成
         if self.active_tasks:
             await gather(*self.active_tasks, return_exceptions=True)
@@ -226,23 +355,27 @@ class Adapter:
         创建对应的上下文并触发事件，处理返回值
         """
         try:
+            event = context.event
+            metrics = context.metrics
+            start = perf_counter()
             result = await emit(context)
+            metrics.handler.observe(perf_counter() - start)
 
             if result is not None:
-                event = context.event
                 # 如果返回值非 None, 尽最大能力发送出去
                 if isinstance(event, MessageEvent):
-                    context.send(result)
+                    await context.send(result)
                 elif hasattr(event, 'group_id'):
-                    context.send(result, group_id=event.group_id)
+                    await context.send(result, group_id=event.group_id)
                 elif hasattr(event, 'user_id'):
-                    context.send(result, user_id=event.user_id)
+                    await context.send(result, user_id=event.user_id)
+                metrics.reply.observe(perf_counter() - context.received_at)
         except Exception as e:
             logger.error(f"Error handling message: {e}")
 
 
-    @abstractmethod
     @staticmethod
+    @abstractmethod
     def get_context_type() -> Type[AdapterContext]:
         '''获取自身的 context 类型，应返回继承自 AdapterContext 的类'''
         pass
@@ -266,3 +399,57 @@ class Adapter:
     def to_platform_event(self, event: Event) -> Any:
         """将内部Event对象转换为平台特定的事件格式"""
         pass
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.adapter
+    import asyncio
+
+    class PingEvent(Event):
+        pass
+
+    class FakeContext(AdapterContext):
+        async def call_api(self, *args, **kwargs):
+            pass
+
+        async def send(self, *args, **kwargs):
+            pass
+
+    class FakeAdapter(Adapter):
+        def __init__(self):
+            super().__init__(dedup_window=0)
+            self.incoming: Queue = Queue()
+
+        @staticmethod
+        def get_context_type():
+            return FakeContext
+
+        async def recv(self):
+            return await self.incoming.get()
+
+        async def send(self, context):
+            pass
+
+    owners = []
+
+    @on(PingEvent)
+    def register_during_dispatch(ctx):
+        handler = on(PingEvent).once()
+        handler(lambda ctx: None)
+        owners.append(handler.owner)
+
+    async def main():
+        with owned('adapters.fake'):
+            adapter = FakeAdapter()
+            task = create_task(adapter.start())
+        await sleep(0)
+        await adapter.incoming.put(FakeContext(PingEvent()))
+        await sleep(0.05)
+        # 适配器属于创建它的模块，处理消息时注册的处理器不属于
+        assert adapter.owner == 'adapters.fake' and owners == [None], owners
+        adapter.running = False
+        task.cancel()
+        await adapter.stop()
+
+    asyncio.run(main())
+    print("所有测试通过！")
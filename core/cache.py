@@ -0,0 +1,412 @@
+"""
+有界缓存，用于插件的按用户、按群状态
+
+设计目标：
+1. 长时间运行时内存保持平稳，不随用户和群的数量无限增长
+2. 并发加载同一个 key 时只加载一次
+3. 可以观察命中率和淘汰情况
+
+主要功能：
+1. LRU 淘汰：条目数超过 max_items，或估计大小超过 max_bytes 时淘汰最久未使用的条目，
+   大小默认递归计算容器和对象属性中的内容(deep_sizeof)
+2. TTL 过期：条目在 ttl 秒后过期，访问时惰性清理，写入时顺带清理最久未使用一端的过期条目；
+   sliding 为 True 时每次命中都重新计时，条目在 ttl 秒没有被访问后才过期
+3. get_or_load：未命中时调用加载函数，同一个 key 的并发请求共享同一次加载(single-flight)，
+   加载在单独的任务中进行，某个请求被取消不会中断加载，也不会影响其它等待者；
+   delete/clear 之前开始的加载仍会返回给等待者，但结果不再写入缓存
+4. 写穿：设置 backend 后，未命中时从 backend 读取，store/remove 同步写入 backend
+   backend 需要提供 async 的 get(key) / set(key, value) / delete(key)，
+   例如 core.storage 的 Namespace
+5. memoize：缓存处理器和命令的返回值，key 默认为命令名和参数，可以加上群或用户，
+   同时到达的相同请求共享同一次计算；分析器和卡顿监控通过 __wrapped__ 找到原函数
+
+使用示例：
+    ```python
+    profiles = Cache(max_items=5000, ttl=3600, backend=database.namespace('profile'))
+    profile = await profiles.get_or_load(f'user/{user_id}')
+
+    @on_command('status')
+    @memoize(ttl=5)
+    def status(ctx):
+        ...
+    ```
+"""
+
+import sys
+from time import monotonic
+from functools import wraps, partial
+from inspect import iscoroutinefunction
+from collections import OrderedDict, deque
+from types import ModuleType, FunctionType, BuiltinFunctionType, MethodType
+from typing import Any, Callable, Awaitable, Hashable
+from asyncio import Task, create_task, current_task, shield, to_thread
+
+from .command import parse_command
+from .message import message_text
+
+_missing = object()
+
+# 类、函数和模块由很多对象共享，不计入条目的大小
+_SHARED = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+def deep_sizeof(value: Any) -> int:
+    """
+    估计值占用的内存：递归计算容器的元素和对象的 __dict__ / __slots__，同一个对象只计算一次
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        attrs = getattr(obj, '__dict__', None)
+        if attrs is not None:
+            stack.append(attrs)
+        for cls in type(obj).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            for name in (slots,) if isinstance(slots, str) else slots:
+                if name not in ('__dict__', '__weakref__'):
+                    stack.append(getattr(obj, name, None))
+    return size
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.shared_loads = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'loads': self.loads,
+            'shared_loads': self.shared_loads,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class Cache:
+    def __init__(
+            self,
+            max_items: int = 10000,
+            max_bytes: int | None = None,
+            ttl: float | None = None,
+            sizeof: Callable[[Any], int] = deep_sizeof,
+            backend: Any = None,
+            sliding: bool = False,
+        ):
+        """
+        Args:
+            max_items: 最多保存的条目数
+            max_bytes: 估计大小的上限，为 None 时不限制
+            ttl: 默认过期时间(秒)，为 None 时不过期
+            sliding: 命中时重新开始计算过期时间，用于按不活跃时间淘汰的状态
+            sizeof: 估计值大小的函数，只在设置了 max_bytes 时调用
+            backend: 持久化后端，为 None 时只在内存中保存
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.backend = backend
+        self.sliding = sliding
+        self.stats = CacheStats()
+        self.bytes = 0
+        # key -> (值, 过期时间或 None, 大小, ttl)
+        self._data: OrderedDict[Hashable, tuple[Any, float | None, int, float | None]] = OrderedDict()
+        self._loading: dict[Hashable, Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key, count=False) is not _missing
+
+    def _lookup(self, key: Hashable, count: bool = True) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            if count:
+                self.stats.misses += 1
+            return _missing
+        value, expires, size, ttl = entry
+        if expires is not None:
+            now = monotonic()
+            if expires <= now:
+                self._remove(key)
+                self.stats.expirations += 1
+                if count:
+                    self.stats.misses += 1
+                return _missing
+            if self.sliding and count:
+                # 刷新后移到最近使用一端，ttl 相同时这一端的过期时间仍然是有序的；`in` 不算访问
+                self._data[key] = (value, now + ttl, size, ttl)
+        self._data.move_to_end(key)
+        if count:
+            self.stats.hits += 1
+        return value
+
+    def _remove(self, key: Hashable):
+        _, _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        return default if value is _missing else value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = _missing):
+        """只写入内存，ttl 不传时使用默认值"""
+        if key in self._data:
+            self._remove(key)
+        ttl = self.ttl if ttl is _missing else ttl
+        expires = None if ttl is None else monotonic() + ttl
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        self._data[key] = (value, expires, size, ttl)
+        self.bytes += size
+        self._evict()
+
+    def delete(self, key: Hashable) -> bool:
+        """只从内存中删除，正在进行的加载不再写入"""
+        self._loading.pop(key, None)
+        if key in self._data:
+            self._remove(key)
+            return True
+        return False
+
+    def clear(self):
+        """清空内存，正在进行的加载不再写入"""
+        self._data.clear()
+        self._loading.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        data = self._data
+        now = monotonic()
+        # 先清理最久未使用一端已经过期的条目
+        while data:
+            key, (_, expires, _, _) = next(iter(data.items()))
+            if expires is None or expires > now:
+                break
+            self._remove(key)
+            self.stats.expirations += 1
+        while len(data) > self.max_items or (self.max_bytes is not None and self.bytes > self.max_bytes and len(data) > 1):
+            self._remove(next(iter(data)))
+            self.stats.evictions += 1
+
+    def purge(self) -> int:
+        """清理所有过期条目，返回清理的数量"""
+        now = monotonic()
+        expired = [key for key, (_, expires, _, _) in self._data.items() if expires is not None and expires <= now]
+        for key in expired:
+            self._remove(key)
+        self.stats.expirations += len(expired)
+        return len(expired)
+
+    async def get_or_load(
+            self,
+            key: Hashable,
+            loader: Callable[[], Awaitable[Any]] | None = None,
+            ttl: float | None = _missing,
+        ) -> Any:
+        """
+        获取值，未命中时加载并缓存
+        loader 为 None 时从 backend 加载；同一个 key 正在加载时，后来的请求等待同一次加载
+        """
+        value = self._lookup(key)
+        if value is not _missing:
+            return value
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = create_task(self._load(key, loader, ttl))
+            task.add_done_callback(partial(self._loaded, key))
+        else:
+            self.stats.shared_loads += 1
+        # 取消的只是这一个等待者，加载继续进行，结果仍会被缓存
+        return await shield(task)
+
+    async def _load(self, key: Hashable, loader, ttl) -> Any:
+        self.stats.loads += 1
+        if loader is not None:
+            value = await loader()
+        elif self.backend is not None:
+            value = await self.backend.get(key)
+        else:
+            value = None
+        # 加载期间被 delete/clear 时，结果可能基于旧数据
+        if self._loading.get(key) is current_task():
+            self.set(key, value, ttl)
+        return value
+
+    def _loaded(self, key: Hashable, task: Task):
+        if self._loading.get(key) is task:
+            del self._loading[key]
+        if not task.cancelled():
+            # 没有等待者时避免 "exception was never retrieved"
+            task.exception()
+
+    async def store(self, key: Hashable, value: Any, ttl: float | None = _missing):
+        """写入内存并写穿到 backend"""
+        self.set(key, value, ttl)
+        if self.backend is not None:
+            await self.backend.set(key, value)
+
+    async def remove(self, key: Hashable):
+        """从内存和 backend 中删除"""
+        self.delete(key)
+        if self.backend is not None:
+            await self.backend.delete(key)
+
+    def info(self) -> dict:
+        """当前大小和统计数据"""
+        return {'items': len(self._data), 'bytes': self.bytes, **self.stats.as_dict()}
+
+
+def command_key(context, by_group: bool = False, by_user: bool = False) -> Hashable:
+    """
+    处理器返回值的缓存 key：命令名和参数，不是命令时为消息文本
+    by_group / by_user 为 True 时分别加上群号和用户 id
+    """
+    event = context.event
+    command = parse_command(event)
+    if command is not None:
+        key = (command[0], tuple(command[1]))
+    else:
+        key = (None, event.get('raw_message') or message_text(event.get('message', '')))
+    if by_group:
+        key += (event.get('group_id'),)
+    if by_user:
+        key += (event.get('user_id'),)
+    return key
+
+def memoize(
+        ttl: float = 60,
+        max_items: int = 1000,
+        key: Callable[[Any], Hashable | None] | None = None,
+        by_group: bool = False,
+        by_user: bool = False,
+    ):
+    """
+    缓存处理器返回值的装饰器，写在 on/on_command 之下
+
+    只适合结果只取决于 key 的处理器，回复应通过返回值给出而不是 context.send；
+    返回值取决于用户(例如权限)或群时应设置 by_user / by_group 或自定义 key
+    key 返回 None 时不使用缓存，例如会修改数据的子命令
+    包装后的函数带有 cache 属性，数据变化时可以调用 cache.clear()
+    同步函数被包装为异步处理器，包装器带有 offload 属性，EventHandler.offload 通过它在线程池中调用原函数
+    """
+    def decorator(func):
+        cache = Cache(max_items=max_items, ttl=ttl)
+        is_async = iscoroutinefunction(func)
+
+        async def call(context):
+            if is_async:
+                return await func(context)
+            if wrapper.offload:
+                return await to_thread(func, context)
+            return func(context)
+
+        @wraps(func)
+        async def wrapper(context):
+            k = key(context) if key is not None else command_key(context, by_group, by_user)
+            if k is None:
+                return await call(context)
+            return await cache.get_or_load(k, lambda: call(context))
+
+        wrapper.cache = cache
+        if not is_async:
+            wrapper.offload = False
+        return wrapper
+    return decorator
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.cache
+    import asyncio
+
+    async def main():
+        cache = Cache(max_items=3)
+        for i in range(5):
+            cache.set(i, i)
+        assert list(cache._data) == [2, 3, 4] and cache.stats.evictions == 2
+
+        # 第一个请求被取消，加载继续进行，其它等待者拿到结果
+        calls = []
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'value'
+        first = asyncio.create_task(cache.get_or_load('k', loader))
+        second = asyncio.create_task(cache.get_or_load('k', loader))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == 'value' and first.cancelled()
+        assert calls == [1] and cache.get('k') == 'value' and not cache._loading
+
+        # 普通异常共享给所有等待者，不缓存
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+        results = await asyncio.gather(cache.get_or_load('e', failing), cache.get_or_load('e', failing),
+                                       return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results) and 'e' not in cache
+
+        # 加载期间 clear，等待者拿到结果，但结果不写入缓存，之后的请求重新加载
+        calls.clear()
+        pending = asyncio.create_task(cache.get_or_load('k2', loader))
+        await asyncio.sleep(0.01)
+        cache.clear()
+        assert not cache._loading
+        fresh = asyncio.create_task(cache.get_or_load('k2', loader))
+        assert await pending == 'value' and 'k2' not in cache and calls == [1, 1]
+        assert await fresh == 'value' and cache.get('k2') == 'value'
+        pending = asyncio.create_task(cache.get_or_load('k3', loader))
+        await asyncio.sleep(0.01)
+        cache.delete('k3')
+        assert await pending == 'value' and 'k3' not in cache
+
+        # 滑动过期：持续访问的条目不会过期，不再访问后 ttl 秒过期
+        cache = Cache(ttl=0.1, sliding=True)
+        cache.set('active', 1)
+        cache.set('idle', 2)
+        for _ in range(4):
+            await asyncio.sleep(0.04)
+            assert cache.get('active') == 1
+        assert 'idle' not in cache
+        await asyncio.sleep(0.12)
+        assert 'active' not in cache
+        fixed = Cache(ttl=0.1)
+        fixed.set('k', 1)
+        for _ in range(3):
+            await asyncio.sleep(0.04)
+            fixed.get('k')
+        assert 'k' not in fixed
+
+        # 默认的大小包括容器中的内容
+        big = {'items': [str(i) * 1000 for i in range(10)]}
+        assert deep_sizeof(big) > 10000 > sys.getsizeof(big)
+        cache = Cache(max_bytes=25000)
+        for i in range(5):
+            cache.set(i, {'items': [str(i * 10 + j) * 500 for j in range(10)]})
+        assert len(cache) == 2 and cache.bytes <= 25000, (len(cache), cache.bytes)
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -0,0 +1,186 @@
+"""
+连续消息合并：把同一个用户在同一个会话中短时间内连续发送的消息合并为一个 MergedMessageEvent
+
+设计目标：
+1. 用户把长文本拆成多条发送时，只需要处理一次、回复一次
+2. 可选：原始消息照常逐条分发，只有监听 MergedMessageEvent 的处理器收到合并后的消息
+3. 合并带来的延迟有上限
+
+实现方式：
+- 在 Order.BEFORE 收集消息，被 BLOCK 阶段(例如限流)截断的消息不会被合并
+- 按 (self_id, 群或私聊, 用户) 缓存消息，每收到一条就把发出时间推迟到 window 秒后，
+  但距离第一条消息不超过 max_wait 秒，数量达到 max_messages 时立即发出
+- 发出时用最后一条消息的上下文类型创建新的上下文并 emit，返回值作为回复发送
+- 没有任何处理器监听 MergedMessageEvent 时不缓存，只有一次字典查询的开销
+
+使用示例：
+    ```python
+    coalescer = Coalescer(window=1.0)
+    coalescer.install()
+
+    @on(MergedMessageEvent)
+    def on_paste(ctx):
+        return f'收到 {len(ctx.event.message_ids)} 条消息'
+    ```
+"""
+
+import logging
+from time import monotonic
+from asyncio import get_running_loop, create_task, TimerHandle
+
+from . import event as _event
+from .event import Context, EventHandler, Order, on, emit
+from .message import MessageEvent, MergedMessageEvent
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_merged = registry.histogram('coalesce_messages', '每个合并事件包含的消息数', buckets=(1, 2, 3, 5, 10, 20, 50))
+
+
+class _Burst:
+    __slots__ = ('contexts', 'first', 'handle')
+
+    def __init__(self, now: float):
+        self.contexts: list[Context[MessageEvent]] = []
+        self.first = now
+        self.handle: TimerHandle | None = None
+
+
+class Coalescer:
+    def __init__(self, window: float = 1.0, max_wait: float = 3.0, max_messages: int = 20):
+        """
+        Args:
+            window: 最后一条消息之后等待的秒数
+            max_wait: 从第一条消息开始最多等待的秒数
+            max_messages: 合并的最多消息数
+        """
+        self.window = window
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self.bursts: dict[tuple, _Burst] = {}
+        self.tasks = set()
+        self.handler: EventHandler | None = None
+
+    @staticmethod
+    def burst_key(event: MessageEvent) -> tuple:
+        return (event.get('self_id'), event.get('message_type'), event.get('group_id'), event.get('user_id'))
+
+    def collect(self, context: Context[MessageEvent]):
+        if not _event._handlers.get(MergedMessageEvent):
+            return
+        key = self.burst_key(context.event)
+        now = monotonic()
+        burst = self.bursts.get(key)
+        if burst is None:
+            burst = self.bursts[key] = _Burst(now)
+        burst.contexts.append(context)
+        if burst.handle is not None:
+            burst.handle.cancel()
+        if len(burst.contexts) >= self.max_messages:
+            self.flush(key)
+            return
+        delay = min(self.window, burst.first + self.max_wait - now)
+        burst.handle = get_running_loop().call_later(max(0.0, delay), self.flush, key)
+
+    def flush(self, key: tuple):
+        burst = self.bursts.pop(key, None)
+        if burst is None:
+            return
+        if burst.handle is not None:
+            burst.handle.cancel()
+        last = burst.contexts[-1]
+        context = last.__class__(MergedMessageEvent([c.event for c in burst.contexts]))
+        if hasattr(burst.contexts[0], 'received_at'):
+            context.received_at = burst.contexts[0].received_at
+        _merged.labels().observe(len(burst.contexts))
+        task = create_task(self._emit(context))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _emit(self, context: Context[MergedMessageEvent]):
+        try:
+            result = await emit(context)
+            if result is not None and hasattr(context, 'send'):
+                await context.send(result)
+        except Exception:
+            logger.error('处理合并消息时发生了错误', exc_info=True)
+
+    def flush_all(self):
+        for key in list(self.bursts):
+            self.flush(key)
+
+    def install(self) -> EventHandler:
+        self.handler = on(MessageEvent).order(Order.BEFORE)
+        self.handler(self.collect)
+        return self.handler
+
+    def uninstall(self):
+        """移除收集器，已经缓存的消息立即发出"""
+        if self.handler is not None:
+            self.handler.remove()
+            self.handler = None
+        self.flush_all()
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.coalesce
+    import asyncio
+    from .message import GroupMessageEvent, TextNode
+
+    def message(text, message_id: int, user_id: int = 1):
+        return GroupMessageEvent(
+            time=0, self_id=10001, message_type='group', sub_type='normal', message_id=message_id,
+            user_id=user_id, message=text, raw_message=str(text), font=0, sender={}, group_id=100)
+
+    async def main():
+        coalescer = Coalescer(window=0.05, max_wait=0.2, max_messages=5)
+        coalescer.install()
+
+        # 没有监听合并事件时不缓存
+        await emit(message('a', 0))
+        assert not coalescer.bursts
+
+        raw, merged = [], []
+        on(MessageEvent)(lambda ctx: raw.append(ctx.event.message_id))
+
+        @on(MergedMessageEvent)
+        def paste(ctx):
+            merged.append(ctx.event)
+
+        for i in range(3):
+            await emit(message(f'line{i}', i))
+        await emit(message('other user', 3, user_id=2))
+        await asyncio.sleep(0.1)
+        assert raw == [0, 1, 2, 3], raw
+        assert [e.message_ids for e in merged] == [[0, 1, 2], [3]], merged
+        assert merged[0].message == 'line0\nline1\nline2'
+
+        # 混合节点
+        merged.clear()
+        await emit(message([TextNode('a')], 10))
+        await emit(message('b', 11))
+        await asyncio.sleep(0.1)
+        assert [n.text for n in merged[0].message] == ['a', '\n', 'b']
+
+        # 数量上限和最长等待
+        merged.clear()
+        for i in range(7):
+            await emit(message(str(i), i))
+        await asyncio.sleep(0.1)
+        assert [len(e.message_ids) for e in merged] == [5, 2], merged
+        merged.clear()
+        for i in range(10):
+            await emit(message(str(i), i))
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.1)
+        assert len(merged) >= 2 and sum(len(e.message_ids) for e in merged) == 10
+
+        merged.clear()
+        await emit(message('pending', 99))
+        coalescer.uninstall()
+        await asyncio.sleep(0)
+        assert merged and merged[0].message_ids == [99]
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -0,0 +1,53 @@
+"""
+命令解析工具，统一消息命令的识别方式
+
+约定：
+- 命令以 PREFIXES 中的前缀开头，例如 `/mc list`
+- 命令名之后以空白分隔参数
+- 命令名不区分大小写
+
+使用示例:
+    ```python
+    @on_command('ping')
+    def ping(ctx):
+        return 'pong'
+    ```
+"""
+
+from .event import on, Order, EventHandler, Context
+from .message import MessageEvent, message_text
+
+PREFIXES = ('/',)
+
+def parse_command(event) -> tuple[str, list[str]] | None:
+    """
+    把消息事件解析为 (命令名, 参数列表)，不是命令时返回 None
+    """
+    if not isinstance(event, MessageEvent):
+        return None
+    text = event.get('raw_message') or message_text(event.get('message', ''))
+    text = text.lstrip()
+    for prefix in PREFIXES:
+        if text.startswith(prefix):
+            break
+    else:
+        return None
+    parts = text[len(prefix):].split()
+    if not parts:
+        return None
+    return parts[0].lower(), parts[1:]
+
+def command_filter(*names: str):
+    """创建一个匹配指定命令名的上下文过滤函数"""
+    names = frozenset(name.lower() for name in names)
+    def _filter(context: Context) -> bool:
+        command = parse_command(context.event)
+        return command is not None and command[0] in names
+    return _filter
+
+def on_command(name: str, *aliases: str, order: int = Order.NORMAL) -> EventHandler:
+    """
+    命令处理器装饰器工厂函数
+    等价于在 MessageEvent 上注册一个带命令过滤的处理器
+    """
+    return on(MessageEvent).order(order).filter(command_filter(name, *aliases))
@@ -0,0 +1,379 @@
+"""
+持久化数据，以路径为 key 映射到文件夹下的 yaml
+
+设计目标：
+1. 插件通过路径读写数据，不关心文件
+2. 只写回修改过的文件，写入不阻塞事件循环
+3. 写入过程中崩溃不会留下损坏的文件
+
+映射方式：
+    key `autoreply/rules` 对应文件 `<root>/autoreply/rules.yaml`
+    文件内容是任意嵌套的字典和列表，读出后可以直接修改
+
+实现方式：
+- 文件在第一次访问时才加载，之后缓存在内存中
+- 读出的字典和列表被包装为 DataDict / DataList，任何修改都会把所属文件标记为脏
+- set 替换整个文件时原地更新已有的字典和列表，插件之前取得的引用仍然有效
+- 标记为脏后去抖 delay 秒再写入，持续修改时最多延迟 max_delay 秒
+- 写入时先在事件循环中复制出普通的 dict/list 快照，在线程中序列化，
+  写入临时文件后 fsync 再原子改名
+- 退出时同步写回所有脏文件
+
+使用示例：
+    ```python
+    from core.data import store
+
+    rules = await store.load('autoreply/rules')
+    rules['hello'] = 'world'      # 自动在稍后写回
+    rules.setdefault('groups', []).append(123)
+    ```
+"""
+
+import os
+import atexit
+import logging
+import traceback
+from typing import Any
+from asyncio import Lock, get_running_loop, to_thread, create_task, TimerHandle
+
+import yaml
+
+from .utils import AttrDict
+
+logger = logging.getLogger(__name__)
+
+
+def _wrap(value: Any, owner: '_File') -> Any:
+    if isinstance(value, dict) and not isinstance(value, DataDict):
+        return DataDict(owner, value)
+    if isinstance(value, list) and not isinstance(value, DataList):
+        return DataList(owner, value)
+    return value
+
+def _assign(current: Any, value: Any, owner: '_File') -> Any:
+    """
+    把 current 的内容原地替换为 value(普通的 dict/list)，返回替换后的对象
+    类型相同的字典和列表(包括嵌套的)保持为同一个对象，其它值重新包装
+    """
+    if isinstance(current, DataDict) and isinstance(value, dict):
+        for key in [key for key in current if key not in value]:
+            dict.__delitem__(current, key)
+        for key, item in value.items():
+            dict.__setitem__(current, key, _assign(dict.get(current, key), item, owner))
+        return current
+    if isinstance(current, DataList) and isinstance(value, list):
+        items = [_assign(current[i], item, owner) if i < len(current) else _wrap(item, owner)
+                 for i, item in enumerate(value)]
+        list.__setitem__(current, slice(None), items)
+        return current
+    return _wrap(value, owner)
+
+def _plain(value: Any) -> Any:
+    """复制为普通的 dict/list，用作写入时的快照"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+class DataDict(AttrDict):
+    """修改时会标记所属文件的字典，支持属性访问"""
+    def __init__(self, owner: '_File', data: dict = ()):
+        dict.__init__(self)
+        object.__setattr__(self, '_owner', owner)
+        for key, value in dict(data).items():
+            dict.__setitem__(self, key, _wrap(value, owner))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, _wrap(value, self._owner))
+        self._owner.mark_dirty()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._owner.mark_dirty()
+
+    def update(self, *args, **kws):
+        for key, value in dict(*args, **kws).items():
+            dict.__setitem__(self, key, _wrap(value, self._owner))
+        self._owner.mark_dirty()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self._owner.mark_dirty()
+        return result
+
+    def popitem(self):
+        result = dict.popitem(self)
+        self._owner.mark_dirty()
+        return result
+
+    def clear(self):
+        dict.clear(self)
+        self._owner.mark_dirty()
+
+    def __copy__(self):
+        return AttrDict(_plain(self))
+
+    def __deepcopy__(self, memo):
+        return AttrDict(_plain(self))
+
+
+class DataList(list):
+    """修改时会标记所属文件的列表"""
+    def __init__(self, owner: '_File', data: list = ()):
+        list.__init__(self, (_wrap(value, owner) for value in data))
+        self._owner = owner
+
+    def _changed(self):
+        self._owner.mark_dirty()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_wrap(v, self._owner) for v in value]
+        else:
+            value = _wrap(value, self._owner)
+        list.__setitem__(self, index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._changed()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._changed()
+        return self
+
+    def append(self, value):
+        list.append(self, _wrap(value, self._owner))
+        self._changed()
+
+    def extend(self, values):
+        list.extend(self, (_wrap(v, self._owner) for v in values))
+        self._changed()
+
+    def insert(self, index, value):
+        list.insert(self, index, _wrap(value, self._owner))
+        self._changed()
+
+    def pop(self, *args):
+        result = list.pop(self, *args)
+        self._changed()
+        return result
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._changed()
+
+    def clear(self):
+        list.clear(self)
+        self._changed()
+
+    def sort(self, *args, **kws):
+        list.sort(self, *args, **kws)
+        self._changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self._changed()
+
+
+class _File:
+    """一个 yaml 文件的缓存"""
+    def __init__(self, store: 'DataStore', key: str):
+        self.store = store
+        self.key = key
+        self.path = os.path.join(store.root, *key.split('/')) + '.yaml'
+        self.data: DataDict | DataList | None = None
+        self.dirty = False
+
+    def mark_dirty(self):
+        if not self.dirty:
+            self.dirty = True
+            self.store._dirty.add(self)
+        self.store._schedule()
+
+    def read(self, default) -> Any:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                value = yaml.safe_load(f)
+        except FileNotFoundError:
+            value = None
+        return _plain(default) if value is None else value
+
+    def write(self, snapshot: Any):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(snapshot, f, allow_unicode=True, sort_keys=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class DataStore:
+    def __init__(self, root: str, delay: float = 1.0, max_delay: float = 10.0):
+        """
+        Args:
+            root: 数据根目录
+            delay: 最后一次修改后等待多久写回(秒)
+            max_delay: 持续修改时，从第一次修改到写回的最长时间(秒)
+        """
+        self.root = root
+        self.delay = delay
+        self.max_delay = max_delay
+        self.files: dict[str, _File] = {}
+        self._dirty: set[_File] = set()
+        self._timer: TimerHandle | None = None
+        self._deadline: float | None = None
+        self._lock = Lock()
+
+    def _file(self, key: str) -> _File:
+        key = key.strip('/')
+        file = self.files.get(key)
+        if file is None:
+            file = self.files[key] = _File(self, key)
+        return file
+
+    def get(self, key: str, default: Any = None) -> DataDict | DataList:
+        """
+        同步获取数据，第一次访问时在当前线程读取文件
+        文件不存在时使用 default，默认为空字典
+        """
+        file = self._file(key)
+        if file.data is None:
+            file.data = _wrap(file.read({} if default is None else default), file)
+        return file.data
+
+    async def load(self, key: str, default: Any = None) -> DataDict | DataList:
+        """与 get 相同，但在线程中读取和解析文件"""
+        file = self._file(key)
+        if file.data is None:
+            value = await to_thread(file.read, {} if default is None else default)
+            # 等待期间可能已经被 get 加载过
+            if file.data is None:
+                file.data = _wrap(value, file)
+        return file.data
+
+    def set(self, key: str, value: dict | list):
+        """替换整个文件的数据，已经取得的字典和列表会被原地更新"""
+        file = self._file(key)
+        file.data = _assign(file.data, _plain(value), file)
+        file.mark_dirty()
+
+    __getitem__ = get
+    __setitem__ = set
+
+    def _schedule(self):
+        """去抖：每次修改推迟写回，但不超过 max_delay"""
+        try:
+            loop = get_running_loop()
+        except RuntimeError:
+            # 没有事件循环时只记录为脏，由 flush_sync 或 close 写回
+            return
+        now = loop.time()
+        if self._deadline is None:
+            self._deadline = now + self.max_delay
+        when = min(now + self.delay, self._deadline)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_at(when, lambda: create_task(self.flush()))
+
+    def _take_snapshots(self) -> list[tuple[_File, Any]]:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._deadline = None
+        dirty, self._dirty = self._dirty, set()
+        snapshots = []
+        for file in dirty:
+            file.dirty = False
+            snapshots.append((file, _plain(file.data)))
+        return snapshots
+
+    @staticmethod
+    def _write_all(snapshots: list[tuple[_File, Any]]) -> list[_File]:
+        failed = []
+        for file, snapshot in snapshots:
+            try:
+                file.write(snapshot)
+            except Exception:
+                logger.error(f"Failed to save data {file.key}")
+                logger.error(traceback.format_exc())
+                failed.append(file)
+        return failed
+
+    async def flush(self):
+        """写回所有脏文件，序列化和写入在线程中进行"""
+        async with self._lock:
+            snapshots = self._take_snapshots()
+            if not snapshots:
+                return
+            failed = await to_thread(self._write_all, snapshots)
+            for file in failed:
+                file.mark_dirty()
+
+    def flush_sync(self):
+        """在当前线程写回所有脏文件"""
+        self._write_all(self._take_snapshots())
+
+    close = flush_sync
+
+
+store = DataStore('data/store')
+atexit.register(store.close)
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.data
+    import asyncio
+    import tempfile
+
+    async def main():
+        root = tempfile.mkdtemp()
+        store = DataStore(root, delay=0.01, max_delay=0.05)
+        config = store.get('plugin/config', {'admins': [1], 'limit': {'count': 5}})
+        assert config.limit.count == 5
+
+        # 原地修改的各种方式都会标记为脏
+        config |= {'name': 'bot'}
+        assert store._dirty
+        await store.flush()
+        config.admins += [2]
+        config.limit.count = 10
+        await asyncio.sleep(0.1)
+        assert not store._dirty
+        with open(os.path.join(root, 'plugin', 'config.yaml'), encoding='utf-8') as f:
+            assert yaml.safe_load(f) == {'admins': [1, 2], 'limit': {'count': 10}, 'name': 'bot'}
+
+        # set 之后之前取得的引用仍然有效，之后的修改会被写入
+        limit = config.limit
+        store.set('plugin/config', {'admins': [], 'limit': {'count': 1}})
+        assert store.get('plugin/config') is config and config.limit is limit and limit.count == 1
+        assert 'name' not in config
+        limit.count = 2
+        store.flush_sync()
+        with open(os.path.join(root, 'plugin', 'config.yaml'), encoding='utf-8') as f:
+            assert yaml.safe_load(f) == {'admins': [], 'limit': {'count': 2}}
+
+        # 重新打开时读取写入的内容
+        reopened = DataStore(root)
+        assert (await reopened.load('plugin/config')).limit.count == 2
+        assert reopened.get('missing', []) == []
+
+    asyncio.run(main())
+    print("所有测试通过！")
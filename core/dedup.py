@@ -0,0 +1,178 @@
+"""
+重复事件过滤，避免重连后重发或反向 WS 重复推送的事件被处理两次
+
+设计目标：
+1. 在事件进入队列前丢弃重复的事件，处理器不需要自己去重
+2. 内存有上限，不随运行时间增长
+3. 每秒上万事件时开销可以忽略
+
+实现方式：
+- 优先使用平台提供的 id：消息按 (self_id, message_id)，撤回、精华等通知按通知类型和 message_id，
+  请求按 flag，群文件上传按文件 id
+- 没有 id 的通知中，只有已知会被重发且同一秒内不可能真实发生两次的类型(成员增减、管理员变动、
+  加好友)按事件内容的哈希判断；戳一戳等可能在同一秒内真实重复的通知和元事件不去重
+- 时间窗口被分为若干个桶，每个桶是一个 set，轮转时清空最旧的桶，
+  因此只记住最近 window 秒内的事件，每次查询只需要检查几个 set
+- 当前桶的 key 数超过 max_keys / buckets 时提前轮转，突发流量下内存同样有上限，
+  代价是记住的时间变短
+
+使用示例：
+    ```python
+    dedup = Deduplicator(window=60)
+    if dedup.seen(context.event):
+        continue
+    ```
+"""
+
+from time import monotonic
+from typing import Hashable
+
+from .event import Event
+
+
+# 没有 id、按内容去重的通知类型：重连后会被重发，且同一秒内不会真实地出现两次相同的事件
+REDELIVERED_NOTICES = frozenset({'group_increase', 'group_decrease', 'group_admin', 'friend_add'})
+
+
+def event_key(event: Event) -> Hashable | None:
+    """事件的去重 key，返回 None 时表示不去重"""
+    post_type = event.get('post_type')
+    if post_type == 'meta_event':
+        return None
+    self_id = event.get('self_id')
+    if post_type == 'request':
+        flag = event.get('flag')
+        return None if flag is None else (self_id, 'request', flag)
+    message_id = event.get('message_id')
+    if post_type != 'notice':
+        return None if message_id is None else (self_id, message_id)
+    notice_type = event.get('notice_type')
+    if message_id is not None:
+        # 撤回的通知带有被撤回消息的 id，不能和消息本身共用 key
+        return (self_id, notice_type, event.get('sub_type'), message_id)
+    file = event.get('file')
+    if isinstance(file, dict) and file.get('id') is not None:
+        return (self_id, notice_type, file['id'])
+    if notice_type not in REDELIVERED_NOTICES:
+        return None
+    try:
+        # 字典的键不会重复，排序时不会比较到值
+        return hash((event.__class__.__name__, repr(sorted(event.items()))))
+    except TypeError:
+        return None
+
+
+class Deduplicator:
+    def __init__(self, window: float = 60, buckets: int = 4, max_keys: int = 200000):
+        """
+        Args:
+            window: 记住事件的时间(秒)
+            buckets: 时间窗口分成的桶数，越多过期越精确，查询越慢
+            max_keys: 记住的 key 数上限
+        """
+        self.bucket_seconds = window / buckets
+        self.bucket_keys = max(1, max_keys // buckets)
+        self.buckets: list[set] = [set() for _ in range(buckets)]
+        self.current = self.buckets[0]
+        self.index = 0
+        self.rotate_at = monotonic() + self.bucket_seconds
+        self.checked = 0
+        self.duplicates = 0
+
+    def _rotate(self, now: float):
+        # 长时间没有事件时可能需要跳过多个桶，因 key 数提前轮转时只轮转一个
+        steps = min(len(self.buckets), max(1, int((now - self.rotate_at) // self.bucket_seconds) + 1))
+        for _ in range(steps):
+            self.index = (self.index + 1) % len(self.buckets)
+            self.buckets[self.index].clear()
+        self.current = self.buckets[self.index]
+        self.rotate_at = now + self.bucket_seconds
+
+    def seen_key(self, key: Hashable) -> bool:
+        """key 是否在窗口内出现过，没有出现过时记住它"""
+        self.checked += 1
+        for bucket in self.buckets:
+            if key in bucket:
+                self.duplicates += 1
+                return True
+        now = monotonic()
+        if now >= self.rotate_at or len(self.current) >= self.bucket_keys:
+            self._rotate(now)
+        self.current.add(key)
+        return False
+
+    def seen(self, event: Event) -> bool:
+        """事件是否是重复的，不去重的事件总是返回 False"""
+        key = event_key(event)
+        return key is not None and self.seen_key(key)
+
+    @property
+    def duplicate_rate(self) -> float:
+        return self.duplicates / self.checked if self.checked else 0.0
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.dedup
+    from time import perf_counter
+    from .message import GroupMessageEvent
+
+    def message(message_id: int, self_id: int = 10001):
+        return GroupMessageEvent(
+            time=0, self_id=self_id, message_type='group', sub_type='normal', message_id=message_id,
+            user_id=555, message='hi', raw_message='hi', font=0, sender={}, group_id=1)
+
+    dedup = Deduplicator(window=60)
+    assert not dedup.seen(message(1))
+    assert dedup.seen(message(1))
+    # 不同账号收到的同一个 id 不是重复
+    assert not dedup.seen(message(1, self_id=10002))
+
+    notice = Event(time=1, self_id=10001, post_type='notice', notice_type='group_increase', user_id=5)
+    assert not dedup.seen(notice)
+    assert dedup.seen(Event(notice))
+    heartbeat = Event(time=1, self_id=10001, post_type='meta_event', meta_event_type='heartbeat')
+    assert not dedup.seen(heartbeat) and not dedup.seen(heartbeat)
+    assert dedup.duplicate_rate == 2 / 5, dedup.duplicate_rate
+
+    # 同一秒内的两次戳一戳都是真实的
+    poke = Event(time=1, self_id=10001, post_type='notice', notice_type='notify', sub_type='poke',
+                 group_id=1, user_id=5, target_id=10001)
+    assert not dedup.seen(poke) and not dedup.seen(Event(poke))
+    # 撤回通知不会被当成被撤回的消息的重复
+    recall = Event(time=1, self_id=10001, post_type='notice', notice_type='group_recall',
+                   group_id=1, user_id=555, operator_id=555, message_id=1)
+    assert not dedup.seen(recall) and dedup.seen(Event(recall))
+    # 请求和文件上传按平台的 id
+    request = Event(time=1, self_id=10001, post_type='request', request_type='friend', user_id=5, flag='abc')
+    assert not dedup.seen(request) and dedup.seen(Event(request, time=2))
+    assert not dedup.seen(Event(request, flag='def'))
+    upload = Event(time=1, self_id=10001, post_type='notice', notice_type='group_upload',
+                   group_id=1, user_id=5, file={'id': 'f1', 'name': 'a.zip', 'size': 1, 'busid': 102})
+    assert not dedup.seen(upload) and dedup.seen(Event(upload))
+
+    # 过期
+    dedup = Deduplicator(window=0.2, buckets=2)
+    dedup.seen_key('a')
+    dedup._rotate(dedup.rotate_at + 1)
+    assert not dedup.seen_key('a')
+
+    # 内存上限
+    dedup = Deduplicator(window=60, buckets=4, max_keys=1000)
+    for i in range(100000):
+        dedup.seen_key(i)
+    assert len(dedup) <= 1000, len(dedup)
+    assert dedup.seen_key(99999) and not dedup.seen_key(0)
+
+    dedup = Deduplicator()
+    events = [message(i % 50000) for i in range(100000)]
+    start = perf_counter()
+    for event in events:
+        dedup.seen(event)
+    elapsed = perf_counter() - start
+    print(f'{len(events) / elapsed:,.0f} events/s, duplicate rate {dedup.duplicate_rate:.0%}')
+    assert dedup.duplicate_rate == 0.5
+
+    print("所有测试通过！")
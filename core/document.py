@@ -0,0 +1,436 @@
+"""
+文档系统，基于内容寻址的文件存储和内存中的标签、目录索引
+
+设计目标：
+1. 支持纯文本、图片和文件，记录创建/修改时间和创建者/修改者
+2. 支持目录和标签，按多个标签查询
+3. 在多个群重复出现的相同图片只保存一份
+4. 列表和查询命令不访问文件系统
+
+实现方式：
+- 内容按 sha256 命名保存在 <root>/blobs/<前两位>/<哈希> 下，写入前先检查是否已存在，
+  写入时先写临时文件再改名，同一内容只会保存一次
+- 文档元数据保存在 core.storage 的表中，启动时一次性读入内存
+- 内存中维护 标签 -> 文档 id 集合 的倒排，多个标签的查询就是集合求交
+- 目录树由文档路径构建并常驻内存，列目录只查字典
+- 内容的引用计数由内存中的文档计算，最后一个引用被删除时删除对应文件
+- 先计算哈希，再在按哈希区分的锁内写入内容并更新索引，删除前也在同一把锁内检查引用，
+  并发添加相同内容和删除最后一个引用时不会删掉刚被引用的文件
+
+使用示例：
+    ```python
+    docs = DocumentStore('data/docs')
+    await docs.load()
+    doc = await docs.add('mc/guide', 'setup', text='...', tags=['mc', 'guide'], user_id=123)
+    docs.by_tags('mc', 'guide')
+    docs.list_dir('mc')
+    ```
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+from time import time
+from typing import Callable, Iterable
+from functools import partial
+from contextlib import asynccontextmanager
+from asyncio import Lock, to_thread
+
+from .storage import Database, database as default_database
+
+logger = logging.getLogger(__name__)
+
+
+class Document:
+    def __init__(
+            self,
+            id: int,
+            dir: str,
+            name: str,
+            kind: str,
+            blob: str,
+            size: int,
+            tags: Iterable[str] = (),
+            created: float = 0,
+            modified: float = 0,
+            creator: int | None = None,
+            modifier: int | None = None,
+        ):
+        self.id = id
+        self.dir = dir
+        self.name = name
+        # 'text' | 'image' | 'file'
+        self.kind = kind
+        self.blob = blob
+        self.size = size
+        self.tags = set(tags)
+        self.created = created
+        self.modified = modified
+        self.creator = creator
+        self.modifier = modifier
+
+    @property
+    def path(self) -> str:
+        return f'{self.dir}/{self.name}' if self.dir else self.name
+
+    def __repr__(self):
+        return f'Document({self.id}, {self.path!r}, {self.kind})'
+
+
+class DirNode:
+    """目录树节点"""
+    def __init__(self):
+        self.children: dict[str, DirNode] = {}
+        self.docs: dict[str, int] = {}
+
+    def empty(self) -> bool:
+        return not self.children and not self.docs
+
+
+def split_path(path: str) -> tuple[str, str]:
+    """把 `a/b/c` 拆分为目录 `a/b` 和名称 `c`"""
+    parts = [part for part in path.strip('/').split('/') if part]
+    if not parts:
+        raise ValueError('Empty document path')
+    return '/'.join(parts[:-1]), parts[-1]
+
+
+class BlobStore:
+    """以 sha256 命名的内容存储"""
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes, digest: str | None = None) -> str:
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def stage_file(self, file_path: str) -> tuple[str, int, str]:
+        """分块计算哈希并复制到临时文件，不把整个文件读入内存，返回 (哈希, 大小, 临时文件)"""
+        h = hashlib.sha256()
+        size = 0
+        os.makedirs(self.root, exist_ok=True)
+        tmp = os.path.join(self.root, f'incoming.{os.getpid()}.{id(h)}.tmp')
+        with open(file_path, 'rb') as src, open(tmp, 'wb') as dst:
+            while chunk := src.read(1 << 20):
+                h.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+        return h.hexdigest(), size, tmp
+
+    def commit(self, digest: str, tmp: str):
+        """把 stage_file 的临时文件移到位，内容已存在时删除临时文件"""
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+
+    def put_file(self, file_path: str) -> tuple[str, int]:
+        digest, size, tmp = self.stage_file(file_path)
+        self.commit(digest, tmp)
+        return digest, size
+
+    def read(self, digest: str) -> bytes:
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def delete(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class DocumentStore:
+    def __init__(self, root: str, database: Database = default_database):
+        """
+        Args:
+            root: 文件存储目录
+            database: 保存元数据的数据库
+        """
+        self.blobs = BlobStore(os.path.join(root, 'blobs'))
+        self.table = database.namespace('docs').table(
+            'documents',
+            'id INTEGER PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL, kind TEXT NOT NULL, '
+            'blob TEXT NOT NULL, size INTEGER NOT NULL, tags TEXT NOT NULL, '
+            'created REAL, modified REAL, creator INTEGER, modifier INTEGER, UNIQUE (dir, name)',
+        )
+        self.docs: dict[int, Document] = {}
+        self.tags: dict[str, set[int]] = {}
+        self.tree = DirNode()
+        self.refs: dict[str, int] = {}
+        # 哈希 -> [锁, 使用者数量]，没有使用者时移除
+        self.locks: dict[str, list] = {}
+        self.loaded = False
+
+    async def load(self):
+        """读入所有元数据并构建索引"""
+        await self.table.create()
+        for row in await self.table.select():
+            row['tags'] = json.loads(row['tags'])
+            self._index(Document(**row))
+        self.loaded = True
+
+    # 内存索引
+
+    def _node(self, dir: str, create: bool = False) -> DirNode | None:
+        node = self.tree
+        for part in dir.split('/') if dir else ():
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[part] = DirNode()
+            node = child
+        return node
+
+    def _index(self, doc: Document):
+        self.docs[doc.id] = doc
+        for tag in doc.tags:
+            self.tags.setdefault(tag, set()).add(doc.id)
+        self._node(doc.dir, create=True).docs[doc.name] = doc.id
+        self.refs[doc.blob] = self.refs.get(doc.blob, 0) + 1
+
+    def _unindex(self, doc: Document) -> bool:
+        """移除索引，返回内容是否已经没有引用"""
+        del self.docs[doc.id]
+        for tag in doc.tags:
+            ids = self.tags[tag]
+            ids.discard(doc.id)
+            if not ids:
+                del self.tags[tag]
+        # 删除文档并清理变空的目录
+        parts = doc.dir.split('/') if doc.dir else []
+        path = [self.tree]
+        for part in parts:
+            path.append(path[-1].children[part])
+        del path[-1].docs[doc.name]
+        for part, parent in zip(reversed(parts), reversed(path[:-1])):
+            if parent.children[part].empty():
+                del parent.children[part]
+        self.refs[doc.blob] -= 1
+        if self.refs[doc.blob] == 0:
+            del self.refs[doc.blob]
+            return True
+        return False
+
+    # 查询，全部只访问内存
+
+    def get(self, doc_id: int) -> Document | None:
+        return self.docs.get(doc_id)
+
+    def find(self, path: str) -> Document | None:
+        dir, name = split_path(path)
+        node = self._node(dir)
+        if node is None or name not in node.docs:
+            return None
+        return self.docs[node.docs[name]]
+
+    def list_dir(self, dir: str = '') -> tuple[list[str], list[Document]] | None:
+        """返回 (子目录名, 文档)，目录不存在时返回 None"""
+        node = self._node(dir.strip('/'))
+        if node is None:
+            return None
+        return sorted(node.children), [self.docs[i] for _, i in sorted(node.docs.items())]
+
+    def by_tags(self, *tags: str) -> list[Document]:
+        """同时带有所有标签的文档，按修改时间从新到旧排列"""
+        if not tags:
+            return []
+        sets = sorted((self.tags.get(tag, set()) for tag in tags), key=len)
+        ids = sets[0].intersection(*sets[1:])
+        return sorted((self.docs[i] for i in ids), key=lambda doc: doc.modified, reverse=True)
+
+    # 修改
+
+    async def _prepare(self, text: str | None, data: bytes | None, file: str | None) -> tuple[str, int, Callable[[], object]]:
+        """计算内容的哈希，返回 (哈希, 大小, 写入内容的函数)，写入需要在 _blob_lock 内进行"""
+        if text is not None:
+            data = text.encode('utf-8')
+        if data is not None:
+            digest = await to_thread(lambda: hashlib.sha256(data).hexdigest())
+            return digest, len(data), partial(self.blobs.put, data, digest)
+        if file is not None:
+            digest, size, tmp = await to_thread(self.blobs.stage_file, file)
+            return digest, size, partial(self.blobs.commit, digest, tmp)
+        raise ValueError('One of text, data or file is required')
+
+    @asynccontextmanager
+    async def _blob_lock(self, digest: str):
+        """同一内容的写入和删除互斥"""
+        entry = self.locks.get(digest)
+        if entry is None:
+            entry = self.locks[digest] = [Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[digest]
+
+    async def _release(self, digest: str):
+        """内容已经没有引用时删除文件，在锁内检查引用，避免删掉并发添加的相同内容"""
+        async with self._blob_lock(digest):
+            if digest not in self.refs:
+                await to_thread(self.blobs.delete, digest)
+
+    def _row(self, doc: Document) -> dict:
+        return {
+            'dir': doc.dir, 'name': doc.name, 'kind': doc.kind, 'blob': doc.blob, 'size': doc.size,
+            'tags': json.dumps(sorted(doc.tags), ensure_ascii=False),
+            'created': doc.created, 'modified': doc.modified,
+            'creator': doc.creator, 'modifier': doc.modifier,
+        }
+
+    async def add(
+            self,
+            path: str,
+            *,
+            text: str | None = None,
+            data: bytes | None = None,
+            file: str | None = None,
+            kind: str | None = None,
+            tags: Iterable[str] = (),
+            user_id: int | None = None,
+        ) -> Document:
+        """新建文档，路径已存在时抛出 FileExistsError"""
+        dir, name = split_path(path)
+        if self.find(path) is not None:
+            raise FileExistsError(path)
+        blob, size, write = await self._prepare(text, data, file)
+        now = time()
+        doc = Document(0, dir, name, kind or ('text' if text is not None else 'file'), blob, size,
+                       tags, now, now, user_id, user_id)
+        # 写入内容到建立索引之间持有锁，期间其它文档释放相同内容时不会删除文件
+        async with self._blob_lock(blob):
+            await to_thread(write)
+            try:
+                doc.id = await self.table.insert(self._row(doc))
+            except sqlite3.IntegrityError:
+                # 同一路径被并发添加
+                if blob not in self.refs:
+                    await to_thread(self.blobs.delete, blob)
+                raise FileExistsError(path) from None
+            self._index(doc)
+        return doc
+
+    async def update(
+            self,
+            doc: Document,
+            *,
+            text: str | None = None,
+            data: bytes | None = None,
+            file: str | None = None,
+            user_id: int | None = None,
+        ) -> Document:
+        """替换文档内容"""
+        blob, size, write = await self._prepare(text, data, file)
+        async with self._blob_lock(blob):
+            await to_thread(write)
+            old_blob = doc.blob
+            self._unindex(doc)
+            doc.blob, doc.size = blob, size
+            doc.modified = time()
+            doc.modifier = user_id
+            self._index(doc)
+        await self.table.update(self._row(doc), 'id = ?', (doc.id,))
+        await self._release(old_blob)
+        return doc
+
+    async def set_tags(self, doc: Document, tags: Iterable[str], user_id: int | None = None) -> Document:
+        for tag in doc.tags:
+            ids = self.tags[tag]
+            ids.discard(doc.id)
+            if not ids:
+                del self.tags[tag]
+        doc.tags = set(tags)
+        for tag in doc.tags:
+            self.tags.setdefault(tag, set()).add(doc.id)
+        doc.modified = time()
+        doc.modifier = user_id
+        await self.table.update(self._row(doc), 'id = ?', (doc.id,))
+        return doc
+
+    async def remove(self, doc: Document):
+        self._unindex(doc)
+        await self.table.delete('id = ?', (doc.id,))
+        await self._release(doc.blob)
+
+    async def read(self, doc: Document) -> bytes:
+        return await to_thread(self.blobs.read, doc.blob)
+
+    async def read_text(self, doc: Document) -> str:
+        return (await self.read(doc)).decode('utf-8')
+
+    def blob_path(self, doc: Document) -> str:
+        """内容文件的路径，用于以文件形式发送图片等"""
+        return os.path.abspath(self.blobs.path(doc.blob))
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.document
+    import asyncio
+    import tempfile
+
+    async def main():
+        with tempfile.TemporaryDirectory() as root:
+            database = Database(os.path.join(root, 'test.db'))
+            docs = DocumentStore(root, database)
+            await docs.load()
+
+            a = await docs.add('mc/guide', text='same', tags=['mc', 'guide'], user_id=1)
+            b = await docs.add('mc/copy', text='same', tags=['mc'])
+            assert a.blob == b.blob and docs.refs[a.blob] == 2
+            assert os.listdir(os.path.dirname(docs.blob_path(a))) == [a.blob]
+            assert docs.by_tags('mc', 'guide') == [a]
+            assert docs.list_dir('mc') == ([], [b, a])
+
+            # 修改后旧内容没有引用时删除
+            await docs.update(b, text='changed')
+            assert docs.refs[a.blob] == 1 and await docs.read_text(b) == 'changed'
+            old = b.blob
+            await docs.update(b, text='changed again')
+            assert not os.path.exists(docs.blobs.path(old))
+
+            # 删除最后一个引用的同时添加相同内容，文件不会被删掉
+            for _ in range(5):
+                blob = a.blob
+                _, c = await asyncio.gather(docs.remove(a), docs.add('other/c', text='same'))
+                assert os.path.exists(docs.blobs.path(blob)) and await docs.read_text(c) == 'same'
+                await docs.remove(c)
+                assert not os.path.exists(docs.blobs.path(blob))
+                a = await docs.add('mc/guide', text='same')
+
+            # 并发添加同一路径
+            results = await asyncio.gather(
+                docs.add('race', text='x'), docs.add('race', text='y'), return_exceptions=True)
+            errors = [r for r in results if isinstance(r, Exception)]
+            assert len(errors) == 1 and isinstance(errors[0], FileExistsError), results
+            assert set(docs.refs) == {a.blob, b.blob, docs.find('race').blob}
+            assert not docs.locks
+            assert sum(len(files) for _, _, files in os.walk(docs.blobs.root)) == 3
+
+            # 重新读入
+            reloaded = DocumentStore(root, database)
+            await reloaded.load()
+            assert {doc.path for doc in reloaded.docs.values()} == {'mc/guide', 'mc/copy', 'race'}
+            database.close()
+
+    asyncio.run(main())
+    print("所有测试通过！")
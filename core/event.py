@@ -21,9 +21,11 @@
 from weakref import WeakKeyDictionary
 from typing import Any, Type, Callable, TypeVar, Generic, Coroutine
 from inspect import iscoroutinefunction
-import traceback
+from asyncio import to_thread
+from contextlib import contextmanager
+from contextvars import ContextVar
 import logging
-from asyncio import Lock
+from threading import Lock
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +44,12 @@ class Context(Generic[T]):
         event: 原始事件对象
         result: 事件处理结果
         _stopped: 是否停止事件传播的内部标记
+
+    每条消息都会创建上下文，因此使用 __slots__；
+    子类需要额外属性时应声明自己的 __slots__，否则实例会重新带上 __dict__
     """
+    __slots__ = ('event', 'result', '_stopped')
+
     def __init__(self, event: T):
         self.event = event
         self.result: Any = None
@@ -89,7 +96,8 @@ class EventHandler:
     2. 支持强制执行(即使事件传播被停止)
     3. 支持一次性处理器
     4. 支持条件过滤
-    5. 自动注册到全局事件系统
+    5. 同步处理器可以放到线程池中执行，避免阻塞事件循环
+    6. 自动注册到全局事件系统
 
     用法示例:
     @on(MyEvent)
@@ -102,17 +110,23 @@ class EventHandler:
         # 优先级1，强制执行，只执行一次
         pass
     '''
-    func: Callable | None
+    # 一次性处理器可能同时存在很多个；__weakref__ 用于按处理器记录统计的弱引用字典
+    __slots__ = ('func', 'event_type', 'owner', '_order', '_force', '_once', '_filter', '_offload', '_async', '__weakref__')
+
     def __init__(
         self,
         event_type: Type[Event],
     ):
         self.func: EventHandlerFunc | None = None
         self.event_type = event_type
+        # 注册时所在的模块，见 owned
+        self.owner: str | None = None
         self._order: int = Order.NORMAL
         self._force: bool = False
         self._once: bool = False
         self._filter: Callable[[Context], bool] = true_func
+        self._offload: bool = False
+        self._async: bool = False
 
     def __repr__(self):
         return f'EventHandler({self.event_type.__name__})({self.func.__name__})'
@@ -123,10 +137,21 @@ class EventHandler:
             # 由于handler基于_handlers，其键值会被自动回收
             # 因此不需要额外的弱引用
             self.func = func
+            self._async = iscoroutinefunction(func)
+            if self._offload and hasattr(func, 'offload'):
+                # 在注册前调用了 offload()，例如 on(X).offload()(memoize()(f))
+                func.offload = True
+            self.owner = _owner.get()
             # 注册到事件系统
             with _handlers_lock:
+                for owns, pending in _staging:
+                    if owns(self):
+                        # 热重载或延迟加载期间模块的处理器先暂存，等待一次性交换
+                        pending.append(self)
+                        return func
                 lst = _handlers.setdefault(self.event_type, [])
-                sorted_append(lst, self, lambda e: e._order)
+                sorted_append(lst, self, _order_key)
+                _invalidate(self.event_type)
             return func
 
     def order(self, order: int = 0):
@@ -149,12 +174,23 @@ class EventHandler:
         self._filter = filter
         return self
 
+    def offload(self, enable: bool = True):
+        """
+        同步处理器在线程池中执行，处理器需要自行保证线程安全
+        包装了同步函数的异步处理器(带有 offload 属性，例如 memoize)由包装器在线程池中调用原函数
+        """
+        self._offload = enable
+        if self._async and hasattr(self.func, 'offload'):
+            self.func.offload = enable
+        return self
+
     def remove(self):
         """从事件系统中移除此处理器"""
         with _handlers_lock:
             handlers = _handlers.get(self.event_type, [])
             if self in handlers:
                 handlers.remove(self)
+                _invalidate(self.event_type)
 
 
 
@@ -162,6 +198,41 @@ class EventHandler:
 _handlers_lock = Lock()
 # 使用弱引用字典存储事件处理器，防止内存泄漏
 _handlers: WeakKeyDictionary[Type[Event], list[EventHandler]] = WeakKeyDictionary()
+# 暂存区：每个 staged 上下文一项 (归属判断, 暂存的处理器)
+_staging: list[tuple[Callable[[EventHandler], bool], list[EventHandler]]] = []
+# 事件类 -> collect_handlers 的结果，某个事件类的处理器变化时丢弃它和子类的结果，批量变化时清空
+# 动态创建的事件类会被强引用，数量超过上限时整体清空
+_collected: dict[Type[Event], list[EventHandler]] = {}
+_COLLECTED_LIMIT = 1024
+# 当前注册处理器的模块，随任务的上下文传递给其中创建的任务
+_owner: ContextVar[str | None] = ContextVar('owner', default=None)
+
+
+def _invalidate(event_type: Type[Event]):
+    """丢弃受 event_type 的处理器影响的合并列表，需要持有 _handlers_lock"""
+    for cls in [cls for cls in _collected if issubclass(cls, event_type)]:
+        del _collected[cls]
+
+def _order_key(handler: EventHandler) -> int:
+    return handler._order
+
+@contextmanager
+def owned(module_path: str | None):
+    """
+    上下文内注册的处理器的 owner 为 module_path，其中创建的任务同样如此
+    模块管理器在导入和启动模块时使用，卸载时据此找到模块通过 core 中的类注册的处理器，例如适配器的发送处理器
+    module_path 为 None 时之后注册的处理器不属于任何模块，用于分发事件的任务，
+    否则处理消息时注册的处理器(例如 recv 的一次性处理器)会被算作适配器模块的
+    """
+    token = _owner.set(module_path)
+    try:
+        yield
+    finally:
+        _owner.reset(token)
+
+def current_owner() -> str | None:
+    """当前上下文中注册处理器的模块，不在模块的导入和启动过程中时为 None"""
+    return _owner.get()
 
 def on(event_type: Type[Event]):
     """
@@ -197,9 +268,24 @@ async def emit(val: Event | Context) -> Any:
     else:
         raise TypeError()
 
+    return await run_handlers(context, collect_handlers(event.__class__))
+
+
+def collect_handlers(event_class: Type[Event]) -> list[EventHandler]:
+    """
+    收集某个事件类及其所有父类上的处理器
+    按优先级排序(优先级小的优先 -> 父类优先 -> 先添加的优先)
+
+    结果按事件类缓存，处理器变化时失效，稳定状态下不产生新的列表
+    返回的列表在多次 emit 之间共享，调用者不应修改
+    """
+    handlers = _collected.get(event_class)
+    if handlers is not None:
+        return handlers
+
     # 遍历事件类及其父类
-    event_classes = [event.__class__]
-    current_class = event.__class__
+    event_classes = [event_class]
+    current_class = event_class
     while True:
         parent_class = current_class.__base__
         if parent_class is Event.__base__: # 直到到达Event的父类
@@ -210,13 +296,22 @@ async def emit(val: Event | Context) -> Any:
 
     # 收集所有相关handler
     with _handlers_lock:
-        all_handlers = sorted_merge(*map(
+        handlers = sorted_merge(*map(
                 lambda cls: _handlers.get(cls, []),
                 event_classes),
-                key=lambda e: e._order)
+                key=_order_key)
+        if len(_collected) >= _COLLECTED_LIMIT:
+            _collected.clear()
+        _collected[event_class] = handlers
+        return handlers
 
+async def run_handlers(context: Context, handlers: list[EventHandler]) -> Any:
+    """
+    在给定上下文上依次执行一组处理器，返回上下文的结果
+    handlers 应当已经按优先级排好序，通常来自 collect_handlers
+    """
     # 处理事件
-    for handler in all_handlers:
+    for handler in handlers:
         if context._stopped and not handler._force:
             continue
 
@@ -224,8 +319,10 @@ async def emit(val: Event | Context) -> Any:
             if not handler._filter(context):
                 continue
 
-            if iscoroutinefunction(handler.func):
+            if handler._async:
                 result = await handler.func(context)
+            elif handler._offload:
+                result = await to_thread(handler.func, context)
             else:
                 result = handler.func(context)
 
@@ -238,12 +335,13 @@ async def emit(val: Event | Context) -> Any:
                 with _handlers_lock:
                     if handler in _handlers.get(handler.event_type, []):
                         _handlers[handler.event_type].remove(handler)
+                        _invalidate(handler.event_type)
         except:
-            logger.error(f"执行 {handler} 时发生了错误")
-            logger.error(traceback.format_exc())
+            # 堆栈通过 exc_info 交给日志线程格式化，不占用事件循环
+            logger.error(f"执行 {handler} 时发生了错误", exc_info=True)
             continue
 
-    return event.result
+    return context.result
 
 
 def get_handler(event_type: Type[Event], func: Callable):
@@ -253,7 +351,7 @@ def get_handler(event_type: Type[Event], func: Callable):
     with _handlers_lock:
         for handler in _handlers.get(event_type, []):
             if handler.func == func:
-                return func
+                return handler
         return None
 
 def remove_handler(event_type: Type[Event], func: Callable, count=0):
@@ -270,9 +368,75 @@ def remove_handler(event_type: Type[Event], func: Callable, count=0):
         for i in range(len(handlers)):
             if handlers[i].func == func:
                 handlers.remove(handlers[i])
+                _invalidate(event_type)
                 count -= 1
                 if count == 0:
                     return
 
+def remove_handlers(owns: Callable[[EventHandler], bool]):
+    """移除所有满足 owns 的处理器，用于卸载模块"""
+    with _handlers_lock:
+        for event_type, handlers in list(_handlers.items()):
+            _handlers[event_type] = [h for h in handlers if not owns(h)]
+        _collected.clear()
+
+@contextmanager
+def staged(owns: Callable[[EventHandler], bool]):
+    """
+    暂存上下文，用于热重载和延迟加载时原子地替换一组处理器
+
+    在上下文内注册且满足 owns 的处理器不会立即生效，
+    正常退出时在同一次加锁中移除所有满足 owns 的旧处理器并放入暂存的新处理器；
+    异常退出时丢弃暂存的处理器，旧处理器保持不变
+    上下文返回暂存的处理器列表，清空它可以在正常退出时只移除旧处理器而不放入新的
+
+    多个暂存上下文可以同时存在(例如同时延迟加载两个模块)，它们的 owns 不应重叠
+
+    emit 使用的合并列表只会被整体替换而不会被修改，因此已经开始的 emit 会在旧的处理器集合上执行完毕
+    """
+    entry = (owns, [])
+    with _handlers_lock:
+        _staging.append(entry)
+    try:
+        yield entry[1]
+    except BaseException:
+        with _handlers_lock:
+            _staging.remove(entry)
+        raise
+    with _handlers_lock:
+        _staging.remove(entry)
+        for event_type, handlers in list(_handlers.items()):
+            _handlers[event_type] = [h for h in handlers if not owns(h)]
+        _collected.clear()
+        for handler in entry[1]:
+            lst = _handlers.setdefault(handler.event_type, [])
+            sorted_append(lst, handler, _order_key)
+
 if __name__=='__main__':
-    ...
+    # 运行方式: python -m core.event
+    import asyncio
+    import threading
+    from .cache import memoize
+
+    class OffloadEvent(Event):
+        pass
+
+    threads = []
+
+    def record(ctx):
+        threads.append(threading.get_ident())
+
+    # 注册前后调用 offload 都会让包装器在线程池中调用同步的原函数
+    before = on(OffloadEvent).offload()
+    before(memoize(key=lambda ctx: None)(record))
+    after = on(OffloadEvent)
+    after(memoize(key=lambda ctx: None)(record))
+    after.offload()
+    assert before._async and before.func.offload and after.func.offload
+
+    async def main():
+        await emit(OffloadEvent())
+        assert len(threads) == 2 and threading.get_ident() not in threads, threads
+
+    asyncio.run(main())
+    print("所有测试通过！")
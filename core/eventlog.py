@@ -0,0 +1,396 @@
+"""
+事件日志，按日期和区域分文件夹追加记录所有事件
+
+设计目标：
+1. 记录经过事件系统的所有事件，包括 bot 自己发送的消息
+2. 写入不阻塞事件处理，按量或按时批量落盘
+3. 按时间、群号、用户查询时不需要扫描整天的数据
+
+存储结构：
+    <root>/<YYYY-MM-DD>/<区域>/<序号>.log   记录，每行一个紧凑的 json
+    <root>/<YYYY-MM-DD>/<区域>/<序号>.idx   稀疏索引，每个块一行
+    区域为 group_<群号>、private_<用户>，其它事件归入 other
+
+    每个记录块(至多 BLOCK_RECORDS 条，或一次落盘的全部记录)在索引中对应一行，
+    包含块在段文件中的偏移和长度、时间范围、出现过的用户和群
+
+实现方式：
+- 作为 Order.RESULT 的 force 处理器接收事件，只在内存缓冲区追加
+- 缓冲超过 flush_bytes 或每隔 flush_interval 秒在线程中写入文件；
+  取出的缓冲按顺序排队，落盘线程和退出时的 close 在同一个线程锁下依次写入，不会交错
+- 合并消息事件只记录合并后的字段，原始消息已经各自记录过
+- 段文件超过 segment_bytes 后切换到新的段；已有的段号和大小在第一次写入时(写入线程中)读取
+- 过去日期的段在取出缓冲后从内存中移除，迟到的事件会重新创建它，内存不随天数增长
+- 查询时先读索引筛选块，再用 mmap 只读取命中块所在的字节范围
+
+使用示例：
+    ```python
+    log = EventLog('data/eventlog')
+    log.install()
+    create_task(log.run())
+
+    records = await log.query(start=time() - 3600, group_id=123456)
+    ```
+"""
+
+import os
+import json
+import mmap
+import logging
+import traceback
+import threading
+from collections import deque
+from time import time, localtime, strftime
+from datetime import date, timedelta
+from asyncio import Lock, sleep, to_thread, create_task
+
+from .event import Event, Context, on, Order, EventHandler
+from .message import MergedMessageEvent
+
+logger = logging.getLogger(__name__)
+
+BLOCK_RECORDS = 64
+
+
+def region_of(event: Event) -> str:
+    """事件所属的区域，决定记录写入哪个文件夹"""
+    if event.get('group_id') is not None:
+        return f"group_{event['group_id']}"
+    if event.get('user_id') is not None:
+        return f"private_{event['user_id']}"
+    return 'other'
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class _Segment:
+    """一个 (日期, 区域) 当前正在写入的段和尚未落盘的记录"""
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        # 第一次写入时由 _discover 得到，避免在事件循环中访问文件系统
+        self.number: int | None = None
+        self.size = 0
+        self.buffer = bytearray()
+        self.blocks: list[dict] = []
+        self.block: dict | None = None
+
+    def _discover(self) -> tuple[int, int]:
+        try:
+            numbers = [int(name[:-4]) for name in os.listdir(self.dir_path) if name.endswith('.log')]
+        except FileNotFoundError:
+            return 0, 0
+        if not numbers:
+            return 0, 0
+        number = max(numbers)
+        return number, os.path.getsize(os.path.join(self.dir_path, f"{number:06d}.log"))
+
+    def append(self, line: bytes, t: float, user_id, group_id):
+        block = self.block
+        if block is None:
+            block = self.block = {'o': len(self.buffer), 'n': 0, 'c': 0, 't0': t, 't1': t, 'u': set(), 'g': set()}
+            self.blocks.append(block)
+        self.buffer += line
+        block['n'] += len(line)
+        block['c'] += 1
+        block['t0'] = min(block['t0'], t)
+        block['t1'] = max(block['t1'], t)
+        if user_id is not None:
+            block['u'].add(user_id)
+        if group_id is not None:
+            block['g'].add(group_id)
+        if block['c'] >= BLOCK_RECORDS:
+            self.block = None
+
+    def take(self) -> tuple[bytes, list[dict]]:
+        """取出缓冲的记录和块，当前块随之关闭"""
+        data, blocks = bytes(self.buffer), self.blocks
+        self.buffer = bytearray()
+        self.blocks = []
+        self.block = None
+        return data, blocks
+
+
+class EventLog:
+    def __init__(
+            self,
+            root: str,
+            flush_bytes: int = 256 * 1024,
+            flush_interval: float = 10,
+            segment_bytes: int = 16 * 1024 * 1024,
+        ):
+        """
+        Args:
+            root: 存储根目录
+            flush_bytes: 缓冲超过该字节数时立即落盘
+            flush_interval: 定时落盘的间隔(秒)
+            segment_bytes: 单个段文件的大小上限
+        """
+        self.root = root
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segments: dict[tuple[str, str], _Segment] = {}
+        self.buffered = 0
+        self.running = False
+        self.handler: EventHandler | None = None
+        self._flush_lock = Lock()
+        self._flushing = False
+        # 等待写入的缓冲，按取出的顺序写入；close 是同步的，因此用线程锁而不是 _flush_lock
+        self._pending: deque[list[tuple[_Segment, bytes, list[dict]]]] = deque()
+        self._write_lock = threading.Lock()
+
+    def install(self) -> EventHandler:
+        """在 Event 基类上注册 Order.RESULT 的 force 处理器"""
+        self.handler = on(Event).order(Order.RESULT).force()
+        self.handler(self.record)
+        return self.handler
+
+    def record(self, context: Context):
+        """记录一个事件，只写入内存缓冲"""
+        event = context.event
+        t = event.get('time') or time()
+        user_id = event.get('user_id')
+        group_id = event.get('group_id')
+        if isinstance(event, MergedMessageEvent):
+            event = {key: value for key, value in event.items() if key != 'events'}
+        line = _dumps({
+            't': t,
+            'k': context.event.__class__.__name__,
+            'u': user_id,
+            'g': group_id,
+            'e': event,
+        }) + b'\n'
+        key = (strftime('%Y-%m-%d', localtime(t)), region_of(context.event))
+        segment = self.segments.get(key)
+        if segment is None:
+            segment = self.segments[key] = _Segment(os.path.join(self.root, *key))
+        segment.append(line, t, user_id, group_id)
+        self.buffered += len(line)
+        if self.buffered >= self.flush_bytes and not self._flushing:
+            self._flushing = True
+            create_task(self.flush())
+
+    def _take(self) -> list[tuple[_Segment, bytes, list[dict]]]:
+        pending = []
+        today = strftime('%Y-%m-%d')
+        for key, segment in list(self.segments.items()):
+            if segment.buffer:
+                data, blocks = segment.take()
+                pending.append((segment, data, blocks))
+            if key[0] < today:
+                # 写入按顺序进行，之后重新创建的段会在这次写入完成后再读取段号
+                del self.segments[key]
+        self.buffered = 0
+        return pending
+
+    def _write_pending(self):
+        """按取出的顺序写入所有排队的缓冲"""
+        with self._write_lock:
+            while self._pending:
+                self._write(self._pending.popleft())
+
+    def _write(self, pending: list[tuple[_Segment, bytes, list[dict]]]):
+        for segment, data, blocks in pending:
+            if segment.number is None:
+                segment.number, segment.size = segment._discover()
+            os.makedirs(segment.dir_path, exist_ok=True)
+            if segment.size and segment.size + len(data) > self.segment_bytes:
+                segment.number += 1
+                segment.size = 0
+            name = os.path.join(segment.dir_path, f"{segment.number:06d}")
+            with open(name + '.log', 'ab') as f:
+                f.write(data)
+            index = bytearray()
+            for block in blocks:
+                block['o'] += segment.size
+                block['u'] = sorted(block['u'], key=str)
+                block['g'] = sorted(block['g'], key=str)
+                index += _dumps(block) + b'\n'
+            with open(name + '.idx', 'ab') as f:
+                f.write(index)
+            segment.size += len(data)
+
+    async def flush(self):
+        """把缓冲的记录写入文件，写入在线程中进行"""
+        async with self._flush_lock:
+            self._flushing = False
+            pending = self._take()
+            if pending:
+                self._pending.append(pending)
+                await to_thread(self._write_pending)
+
+    def close(self):
+        """同步写入剩余记录并注销处理器，用于退出时"""
+        self.running = False
+        if self.handler is not None:
+            self.handler.remove()
+            self.handler = None
+        pending = self._take()
+        if pending:
+            self._pending.append(pending)
+        # 正在线程中进行的写入完成后再写入，排在它之前取出的缓冲也会在这里写入
+        self._write_pending()
+
+    async def run(self):
+        """定时落盘"""
+        self.running = True
+        while self.running:
+            await sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.error("Failed to flush event log")
+                logger.error(traceback.format_exc())
+
+    async def query(
+            self,
+            start: float | None = None,
+            end: float | None = None,
+            group_id: int | None = None,
+            user_id: int | None = None,
+            limit: int | None = None,
+        ) -> list[dict]:
+        """
+        查询记录，按段内顺序返回
+
+        Args:
+            start, end: 时间范围(时间戳)，默认为今天
+            group_id: 只查询这个群的区域
+            user_id: 只返回这个用户的记录
+            limit: 最多返回的记录数
+        """
+        await self.flush()
+        return await to_thread(self._query, start, end, group_id, user_id, limit)
+
+    def _days(self, start: float | None, end: float | None) -> list[str]:
+        first = date.fromtimestamp(start) if start is not None else date.today()
+        last = date.fromtimestamp(end) if end is not None else date.today()
+        days = []
+        while first <= last:
+            days.append(first.isoformat())
+            first += timedelta(days=1)
+        return days
+
+    def _query(self, start, end, group_id, user_id, limit) -> list[dict]:
+        results = []
+        for day in self._days(start, end):
+            day_path = os.path.join(self.root, day)
+            if group_id is not None:
+                regions = [f"group_{group_id}"]
+            else:
+                try:
+                    regions = sorted(os.listdir(day_path))
+                except FileNotFoundError:
+                    continue
+            for region in regions:
+                dir_path = os.path.join(day_path, region)
+                try:
+                    names = sorted(name[:-4] for name in os.listdir(dir_path) if name.endswith('.idx'))
+                except FileNotFoundError:
+                    continue
+                for name in names:
+                    base = os.path.join(dir_path, name)
+                    ranges = self._match_blocks(base + '.idx', start, end, group_id, user_id)
+                    if not ranges:
+                        continue
+                    for record in self._read_ranges(base + '.log', ranges):
+                        t = record['t']
+                        if start is not None and t < start or end is not None and t > end:
+                            continue
+                        if user_id is not None and record['u'] != user_id:
+                            continue
+                        if group_id is not None and record['g'] != group_id:
+                            continue
+                        results.append(record)
+                        if limit is not None and len(results) >= limit:
+                            return results
+        return results
+
+    @staticmethod
+    def _match_blocks(index_path: str, start, end, group_id, user_id) -> list[tuple[int, int]]:
+        ranges = []
+        with open(index_path, 'rb') as f:
+            for line in f:
+                block = json.loads(line)
+                if start is not None and block['t1'] < start:
+                    continue
+                if end is not None and block['t0'] > end:
+                    continue
+                if user_id is not None and user_id not in block['u']:
+                    continue
+                if group_id is not None and group_id not in block['g']:
+                    continue
+                ranges.append((block['o'], block['n']))
+        return ranges
+
+    @staticmethod
+    def _read_ranges(log_path: str, ranges: list[tuple[int, int]]):
+        with open(log_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for offset, length in ranges:
+                    for line in m[offset:offset + length].splitlines():
+                        yield json.loads(line)
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.eventlog
+    import asyncio
+    import tempfile
+
+    def message(t: float, text: str, group_id: int | None = 100, user_id: int = 1):
+        event = Event(time=t, self_id=1, post_type='message', user_id=user_id, message=text)
+        if group_id is not None:
+            event['group_id'] = group_id
+        return Context(event)
+
+    async def main(root: str):
+        log = EventLog(root, segment_bytes=2000)
+        now = time()
+        yesterday = now - 86400
+
+        # 追加和按群、用户读回
+        for i in range(100):
+            log.record(message(now + i * 0.001, f'msg {i}', user_id=i % 3))
+        log.record(message(now, 'private', group_id=None, user_id=7))
+        records = await log.query(start=now - 1, group_id=100)
+        assert [r['e']['message'] for r in records] == [f'msg {i}' for i in range(100)]
+        assert len(await log.query(start=now - 1, group_id=100, user_id=1)) == 33
+        assert [r['e']['message'] for r in await log.query(start=now - 1, user_id=7)] == ['private']
+
+        # 段文件超过上限后切换，读回的顺序不变
+        for i in range(100, 200):
+            log.record(message(now + i * 0.001, f'msg {i}'))
+            if i % 20 == 0:
+                await log.flush()
+        await log.flush()
+        dir_path = os.path.join(root, strftime('%Y-%m-%d', localtime(now)), 'group_100')
+        logs = sorted(name for name in os.listdir(dir_path) if name.endswith('.log'))
+        assert len(logs) > 2, logs
+        records = await log.query(start=now - 1, group_id=100)
+        assert [r['e']['message'] for r in records] == [f'msg {i}' for i in range(200)]
+        assert len(await log.query(start=now - 1, group_id=100, limit=5)) == 5
+
+        # 过去日期的段落盘后移除，迟到的事件接着写到已有的段之后
+        log.record(message(yesterday, 'late 1'))
+        await log.flush()
+        assert all(day >= strftime('%Y-%m-%d') for day, _ in log.segments), list(log.segments)
+        log.record(message(yesterday + 1, 'late 2'))
+        await log.flush()
+        late = await log.query(start=yesterday - 1, end=yesterday + 2, group_id=100)
+        assert [r['e']['message'] for r in late] == ['late 1', 'late 2'], late
+
+        # 新实例接着已有的段写入
+        log.record(message(now + 1, 'before close'))
+        log.close()
+        reopened = EventLog(root, segment_bytes=2000)
+        reopened.record(message(now + 2, 'after reopen'))
+        records = await reopened.query(start=now - 1, group_id=100)
+        assert [r['e']['message'] for r in records][-2:] == ['before close', 'after reopen']
+        assert len(records) == 202
+
+    with tempfile.TemporaryDirectory() as root:
+        asyncio.run(main(root))
+    print("所有测试通过！")
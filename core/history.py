@@ -0,0 +1,527 @@
+"""
+消息历史与全文检索，基于倒排索引
+
+设计目标：
+1. 保存所有消息事件的文本，按关键词、用户、群、时间范围检索
+2. 查询不扫描原始消息，数百万条消息时也能在毫秒级返回
+3. 建索引不阻塞事件循环
+
+分词：
+- 中日韩文字按字切分，同时索引单字和相邻两字(bigram)，多字查询只使用 bigram
+- 其它文字按单词切分并转为小写
+- 用户和群以特殊词项 `\\0u<id>`、`\\0g<id>` 加入同一个索引，按人按群查询也走倒排表
+
+存储结构(每个段)：
+    <name>.terms  词典，json 格式的 {词项: [偏移, 字节数, 文档数, 最后一个文档号]}
+    <name>.post   倒排表，文档号差值的 varint 编码
+    <name>.meta   每条文档的时间、用户、群，三个定长数组，用于时间过滤
+    <name>.docs   文档内容，每行一个 json
+    <name>.doff   文档在 .docs 中的偏移
+    segments.json 当前生效的段列表，通过写临时文件再改名原子替换
+
+实现方式：
+- 新消息先进入内存缓冲，积累到 buffer_docs 条或定时写成一个新段
+- 文档号全局递增，每个段覆盖一段连续的文档号，合并相邻段时只重新编码每个倒排表的第一个差值，
+  其余字节直接拼接，词典中记录的最后一个文档号用于计算下一段的第一个差值
+- 按大小比例合并：每个段都应大于它之后所有段总和的 1/(MERGE_FACTOR-1)，
+  写入新段后从最早一个不满足的段开始，把它和之后的段在线程中合并为一个。
+  不论每次写入多少文档，段数都随文档总数对数增长
+- 查询时对各词项的倒排表求交集，再按时间过滤，最后读取候选文档确认关键词确实连续出现
+"""
+
+import os
+import re
+import json
+import mmap
+import logging
+import traceback
+from array import array
+from time import time
+from asyncio import Lock, sleep, to_thread, create_task
+
+from .message import MessageEvent, message_text
+
+logger = logging.getLogger(__name__)
+
+MERGE_FACTOR = 4
+
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af'
+_TOKEN = re.compile(f'(?P<cjk>[{_CJK}]+)|(?P<word>[^\\W{_CJK}]+)')
+
+
+def tokenize(text: str, query: bool = False) -> set[str]:
+    """
+    切分文本为词项
+    query 为 True 时多字的中文只生成 bigram，减少需要求交集的倒排表
+    """
+    tokens = set()
+    for m in _TOKEN.finditer(text.lower()):
+        run = m.group()
+        if m.lastgroup == 'word':
+            tokens.add(run)
+            continue
+        if len(run) == 1 or not query:
+            tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def user_term(user_id) -> str:
+    return f'\0u{user_id}'
+
+def group_term(group_id) -> str:
+    return f'\0g{group_id}'
+
+
+def encode_postings(docids: list[int]) -> bytes:
+    """把递增的文档号编码为差值 varint"""
+    out = bytearray()
+    prev = 0
+    for docid in docids:
+        delta = docid - prev
+        prev = docid
+        while delta >= 0x80:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+def _read_varint(data, pos: int = 0) -> tuple[int, int]:
+    """读取一个 varint，返回 (值, 之后的位置)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def decode_postings(data) -> list[int]:
+    result = []
+    docid = shift = delta = 0
+    for byte in data:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            docid += delta
+            result.append(docid)
+            delta = shift = 0
+    return result
+
+
+class Segment:
+    """只读的磁盘段"""
+    def __init__(self, dir_path: str, name: str, base: int, count: int):
+        self.name = name
+        self.base = base
+        self.count = count
+        self.path = os.path.join(dir_path, name)
+        with open(self.path + '.terms', encoding='utf-8') as f:
+            # 词项 -> [偏移, 字节数, 文档数, 最后一个文档号]
+            self.terms: dict[str, list[int]] = json.load(f)
+        self.postings_data = self._map('.post')
+        self.docs_data = self._map('.docs')
+        self.offsets = array('Q')
+        with open(self.path + '.doff', 'rb') as f:
+            self.offsets.fromfile(f, count + 1)
+        self.times, self.users, self.groups = array('d'), array('q'), array('q')
+        with open(self.path + '.meta', 'rb') as f:
+            self.times.fromfile(f, count)
+            self.users.fromfile(f, count)
+            self.groups.fromfile(f, count)
+
+    def _map(self, suffix: str):
+        with open(self.path + suffix, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def postings(self, term: str) -> list[int]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return []
+        offset, length = entry[:2]
+        return decode_postings(self.postings_data[offset:offset + length])
+
+    def posting_size(self, term: str) -> int:
+        """倒排表中的文档数"""
+        entry = self.terms.get(term)
+        if entry is None:
+            return 0
+        return entry[2]
+
+    def posting_info(self, term: str) -> tuple[bytes, int, int]:
+        """(编码后的倒排表, 文档数, 最后一个文档号)"""
+        offset, length, count, last = self.terms[term]
+        return self.postings_data[offset:offset + length], count, last
+
+    def time_of(self, docid: int) -> float:
+        return self.times[docid - self.base]
+
+    def doc(self, docid: int) -> dict:
+        i = docid - self.base
+        return json.loads(self.docs_data[self.offsets[i]:self.offsets[i + 1]])
+
+    def files(self) -> list[str]:
+        return [self.path + suffix for suffix in ('.terms', '.post', '.meta', '.docs', '.doff')]
+
+
+class _Buffer:
+    """内存中尚未写成段的文档"""
+    def __init__(self, base: int):
+        self.base = base
+        self.terms: dict[str, list[int]] = {}
+        self.docs: list[dict] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.docs)
+
+    def add(self, doc: dict, tokens: set[str]) -> int:
+        docid = self.base + len(self.docs)
+        self.docs.append(doc)
+        for token in tokens:
+            self.terms.setdefault(token, []).append(docid)
+        return docid
+
+    def postings(self, term: str) -> list[int]:
+        return list(self.terms.get(term, ()))
+
+    def posting_size(self, term: str) -> int:
+        return len(self.terms.get(term, ()))
+
+    def time_of(self, docid: int) -> float:
+        return self.docs[docid - self.base]['time']
+
+    def doc(self, docid: int) -> dict:
+        return self.docs[docid - self.base]
+
+
+def _merge_buffers(first: _Buffer, second: _Buffer) -> _Buffer:
+    """把两个相邻的缓冲合并为一个"""
+    merged = _Buffer(first.base)
+    merged.docs = first.docs + second.docs
+    merged.terms = {term: list(docids) for term, docids in first.terms.items()}
+    for term, docids in second.terms.items():
+        merged.terms.setdefault(term, []).extend(docids)
+    return merged
+
+
+def write_segment(dir_path: str, name: str, terms: dict[str, tuple[bytes, int, int]], docs: list[bytes]):
+    """
+    写出一个段
+    terms 为 {词项: (已编码的倒排表, 文档数, 最后一个文档号)}，docs 为已序列化的文档，每条以换行结尾
+    """
+    path = os.path.join(dir_path, name)
+    index = {}
+    with open(path + '.post', 'wb') as f:
+        offset = 0
+        for term in sorted(terms):
+            data, count, last = terms[term]
+            f.write(data)
+            index[term] = [offset, len(data), count, last]
+            offset += len(data)
+    with open(path + '.terms', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    offsets = array('Q', [0])
+    times, users, groups = array('d'), array('q'), array('q')
+    with open(path + '.docs', 'wb') as f:
+        for raw in docs:
+            f.write(raw)
+            offsets.append(offsets[-1] + len(raw))
+            doc = json.loads(raw)
+            times.append(doc['time'])
+            users.append(doc['user_id'] or 0)
+            groups.append(doc['group_id'] or 0)
+    with open(path + '.doff', 'wb') as f:
+        offsets.tofile(f)
+    with open(path + '.meta', 'wb') as f:
+        times.tofile(f)
+        users.tofile(f)
+        groups.tofile(f)
+
+
+class MessageHistory:
+    def __init__(self, dir_path: str, buffer_docs: int = 5000, flush_interval: float = 60):
+        """
+        Args:
+            dir_path: 索引目录
+            buffer_docs: 内存缓冲达到该文档数时写成新段
+            flush_interval: 定时写段的间隔(秒)
+        """
+        self.dir_path = dir_path
+        self.buffer_docs = buffer_docs
+        self.flush_interval = flush_interval
+        os.makedirs(dir_path, exist_ok=True)
+        self.segments: list[Segment] = []
+        next_docid = 0
+        manifest = self._load_manifest()
+        for entry in manifest.get('segments', []):
+            self.segments.append(Segment(dir_path, entry['name'], entry['base'], entry['count']))
+            next_docid = entry['base'] + entry['count']
+        self.buffer = _Buffer(next_docid)
+        # 正在写成段的缓冲，写完之前仍参与查询
+        self.pending: _Buffer | None = None
+        self.running = False
+        self._lock = Lock()
+        self._flushing = False
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.dir_path, 'segments.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_manifest(self, segments: list[Segment]):
+        path = os.path.join(self.dir_path, 'segments.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'segments': [
+                {'name': s.name, 'base': s.base, 'count': s.count} for s in segments
+            ]}, f)
+        os.replace(path + '.tmp', path)
+
+    def add(self, event: MessageEvent) -> int | None:
+        """索引一条消息事件，返回文档号；没有文本的消息不索引"""
+        text = message_text(event.message) if event.get('message') else event.get('raw_message', '')
+        if not text:
+            return None
+        doc = {
+            'time': event.get('time') or time(),
+            'user_id': event.get('user_id'),
+            'group_id': event.get('group_id'),
+            'message_id': event.get('message_id'),
+            'text': text,
+        }
+        tokens = tokenize(text)
+        if doc['user_id'] is not None:
+            tokens.add(user_term(doc['user_id']))
+        if doc['group_id'] is not None:
+            tokens.add(group_term(doc['group_id']))
+        docid = self.buffer.add(doc, tokens)
+        if self.buffer.count >= self.buffer_docs and not self._flushing:
+            self._flushing = True
+            create_task(self.flush())
+        return docid
+
+    async def flush(self):
+        """把内存缓冲写成新段，然后按需合并"""
+        async with self._lock:
+            self._flushing = False
+            buffer = self.buffer
+            if not buffer.count:
+                return
+            self.buffer = _Buffer(buffer.base + buffer.count)
+            self.pending = buffer
+            try:
+                segment = await to_thread(self._write_buffer, buffer)
+            except BaseException:
+                # 写入失败时把文档放回，新缓冲中的文档号接在后面，不会冲突
+                self.buffer, self.pending = _merge_buffers(buffer, self.buffer), None
+                raise
+            self.segments = self.segments + [segment]
+            self.pending = None
+            await to_thread(self._save_manifest, self.segments)
+            await self._merge()
+
+    def _write_buffer(self, buffer: _Buffer) -> Segment:
+        name = f"seg_{buffer.base:012d}_{buffer.count}"
+        terms = {term: (encode_postings(docids), len(docids), docids[-1]) for term, docids in buffer.terms.items()}
+        docs = [json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                for doc in buffer.docs]
+        write_segment(self.dir_path, name, terms, docs)
+        return Segment(self.dir_path, name, buffer.base, buffer.count)
+
+    @staticmethod
+    def _merge_start(segments: list[Segment]) -> int | None:
+        """最早一个不大于之后所有段总和 1/(MERGE_FACTOR-1) 的段，都满足时返回 None"""
+        start = None
+        total = 0
+        for i in range(len(segments) - 1, -1, -1):
+            if total and segments[i].count * (MERGE_FACTOR - 1) <= total:
+                start = i
+            total += segments[i].count
+        return start
+
+    async def _merge(self):
+        """从最早一个过小的段开始，把它和之后的段合并为一个；合并后之前的段仍然满足比例"""
+        segments = self.segments
+        start = self._merge_start(segments)
+        if start is None:
+            return
+        old = segments[start:]
+        merged = await to_thread(self._merge_segments, old)
+        self.segments = segments[:start] + [merged]
+        await to_thread(self._save_manifest, self.segments)
+        await to_thread(self._remove_segments, old)
+        logger.info(f"Merged {len(old)} history segments into {merged.name}")
+
+    @staticmethod
+    def _remove_segments(segments: list[Segment]):
+        for segment in segments:
+            for file in segment.files():
+                os.remove(file)
+
+    def _merge_segments(self, segments: list[Segment]) -> Segment:
+        base = segments[0].base
+        count = sum(s.count for s in segments)
+        # 词项 -> [倒排表, 文档数, 最后一个文档号]
+        terms: dict[str, list] = {}
+        for s in segments:
+            for term in s.terms:
+                data, n, last = s.posting_info(term)
+                # 相邻段的文档号连续递增，只需修正每段第一个差值，其余字节直接拼接
+                first, head = _read_varint(data)
+                merged = terms.get(term)
+                if merged is None:
+                    merged = terms[term] = [bytearray(), 0, 0]
+                merged[0] += encode_postings([first - merged[2]])
+                merged[0] += data[head:]
+                merged[1] += n
+                merged[2] = last
+        docs = []
+        for s in segments:
+            for i in range(s.count):
+                docs.append(s.docs_data[s.offsets[i]:s.offsets[i + 1]])
+        name = f"seg_{base:012d}_{count}"
+        write_segment(self.dir_path, name, {t: (bytes(v[0]), v[1], v[2]) for t, v in terms.items()}, docs)
+        return Segment(self.dir_path, name, base, count)
+
+    def close(self):
+        """同步写出内存缓冲，用于退出时"""
+        self.running = False
+        if self.buffer.count:
+            buffer = self.buffer
+            self.buffer = _Buffer(buffer.base + buffer.count)
+            self.segments.append(self._write_buffer(buffer))
+            self._save_manifest(self.segments)
+
+    async def run(self):
+        """定时写段"""
+        self.running = True
+        while self.running:
+            await sleep(self.flush_interval)
+            try:
+                if self.buffer.count:
+                    await self.flush()
+            except Exception:
+                logger.error("Failed to flush message history")
+                logger.error(traceback.format_exc())
+
+    async def search(
+            self,
+            keywords: str = '',
+            user_id: int | None = None,
+            group_id: int | None = None,
+            start: float | None = None,
+            end: float | None = None,
+            limit: int = 20,
+        ) -> list[dict]:
+        """
+        检索消息，按时间从新到旧返回
+
+        Args:
+            keywords: 空白分隔的关键词，每个都必须出现
+            user_id, group_id: 限定发送者和群
+            start, end: 时间范围(时间戳)
+            limit: 最多返回的条数
+        """
+        sources = [self.buffer, self.pending] + self.segments[::-1]
+        return await to_thread(self._search, sources, keywords, user_id, group_id, start, end, limit)
+
+    def _search(self, sources, keywords, user_id, group_id, start, end, limit) -> list[dict]:
+        words = keywords.lower().split()
+        terms = set()
+        for word in words:
+            terms |= tokenize(word, query=True)
+        if user_id is not None:
+            terms.add(user_term(user_id))
+        if group_id is not None:
+            terms.add(group_term(group_id))
+        if not terms:
+            return []
+
+        results = []
+        for source in sources:
+            if source is None or not source.count:
+                continue
+            candidates = None
+            # 从最短的倒排表开始求交集；候选已经很少时跳过很长的倒排表，交给最后的确认步骤
+            for term in sorted(terms, key=source.posting_size):
+                if candidates is not None and len(candidates) * 64 < source.posting_size(term):
+                    break
+                postings = source.postings(term)
+                candidates = set(postings) if candidates is None else candidates.intersection(postings)
+                if not candidates:
+                    break
+            if not candidates:
+                continue
+            for docid in sorted(candidates, reverse=True):
+                t = source.time_of(docid)
+                if start is not None and t < start or end is not None and t > end:
+                    continue
+                doc = source.doc(docid)
+                if user_id is not None and doc['user_id'] != user_id:
+                    continue
+                if group_id is not None and doc['group_id'] != group_id:
+                    continue
+                text = doc['text'].lower()
+                # n-gram 只保证每个片段出现，这里确认关键词整体出现
+                if not all(word in text for word in words):
+                    continue
+                results.append(dict(doc, docid=docid))
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.history
+    import asyncio
+    import random
+    import tempfile
+    from .message import GroupMessageEvent
+
+    def message(text: str, i: int):
+        return GroupMessageEvent(
+            time=1700000000 + i, self_id=1, message_type='group', sub_type='normal', message_id=i,
+            user_id=i % 7, message=text, raw_message=text, font=0, sender={}, group_id=100 + i % 3)
+
+    async def main():
+        random.seed(1)
+        history = MessageHistory(tempfile.mkdtemp(), buffer_docs=1 << 30)
+        words = ['苹果', '香蕉', 'creeper', '红石', 'server']
+        total = 0
+        # 每次写入的文档数差别很大，段数仍然有上限
+        for _ in range(40):
+            for _ in range(random.choice((1, 3, 17, 60, 250))):
+                history.add(message(f'{words[total % 5]} 第{total}条 {total}', total))
+                total += 1
+            await history.flush()
+            sizes = [s.count for s in history.segments]
+            for i in range(len(sizes) - 1):
+                assert sizes[i] * (MERGE_FACTOR - 1) > sum(sizes[i + 1:]), sizes
+        sizes = [s.count for s in history.segments]
+        print(f'{total} 条消息，{len(sizes)} 个段: {sizes}')
+        assert len(sizes) <= 10, sizes
+
+        # 合并后的倒排表与逐条解码一致
+        expected = {i for i in range(total) if i % 5 == 3}
+        found = await history.search('红石', limit=total)
+        assert {doc['message_id'] for doc in found} == expected
+        found = await history.search('creeper', user_id=2, limit=total)
+        assert {doc['message_id'] for doc in found} == {i for i in range(total) if i % 5 == 2 and i % 7 == 2}
+        for segment in history.segments:
+            for term in ('红石', user_term(3)):
+                if term not in segment.terms:
+                    continue
+                docids = segment.postings(term)
+                assert segment.posting_size(term) == len(docids) == segment.posting_info(term)[1]
+                assert docids == sorted(docids) and docids[-1] == segment.posting_info(term)[2]
+        # 缓冲和段的 posting_size 都是文档数
+        history.add(message('红石', total))
+        assert history.buffer.posting_size('红石') == 1
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -0,0 +1,284 @@
+"""
+物理机监控，定时采样 CPU、内存、硬盘和网络并保存在内存中
+
+设计目标：
+1. 状态命令直接从内存中读取，立即返回
+2. 采样本身的开销远低于 1% 的 CPU
+3. 内存占用固定，可以查看最近几分钟到最近一个月的变化
+
+实现方式：
+- /proc/stat、/proc/meminfo、/proc/diskstats、/proc/net/dev 和 /proc/self/statm 只打开一次，
+  每次用 os.pread 从头读取，直接解析字节，不经过文本解码
+- 每个指标有三个分辨率的环形缓冲区：每秒(10 分钟)、每分钟(24 小时)、每小时(30 天)，
+  使用 array 保存，大小固定
+- 高分辨率的采样累积满一个周期后，平均值写入下一级缓冲区
+- 采样在事件循环中进行，一次采样只有几次系统调用，不需要线程
+
+指标：
+    cpu: CPU 使用率(%)
+    mem: 内存使用率(%)
+    mem_used: 已用内存(字节)
+    disk: 根分区使用率(%)
+    disk_read / disk_write: 硬盘读写速度(字节/秒)
+    net_rx / net_tx: 网络收发速度(字节/秒)
+    rss: 本进程的常驻内存(字节)
+
+只支持 Linux
+
+使用示例：
+    ```python
+    sampler = HostSampler()
+    create_task(sampler.run())
+    sampler.latest()                     # {'cpu': 3.1, 'mem': 42.0, ...}
+    sampler.summary('cpu', MINUTE, 60)   # 最近一小时每分钟平均值的 (平均, 最大)
+    ```
+"""
+
+import os
+import logging
+from array import array
+from time import monotonic, perf_counter
+from asyncio import sleep
+
+logger = logging.getLogger(__name__)
+
+SECOND = 0
+MINUTE = 1
+HOUR = 2
+# 每个分辨率的周期(秒)和保存的点数
+RESOLUTIONS = ((1, 600), (60, 1440), (3600, 720))
+
+METRICS = ('cpu', 'mem', 'mem_used', 'disk', 'disk_read', 'disk_write', 'net_rx', 'net_tx', 'rss')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class Ring:
+    """定长环形缓冲区"""
+    __slots__ = ('data', 'size', 'index', 'count')
+
+    def __init__(self, size: int):
+        self.data = array('d', bytes(8 * size))
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, value: float):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def last(self, n: int | None = None) -> list[float]:
+        """最近的 n 个值，从旧到新"""
+        n = self.count if n is None else min(n, self.count)
+        start = (self.index - n) % self.size
+        if start + n <= self.size:
+            return self.data[start:start + n].tolist()
+        return self.data[start:].tolist() + self.data[:self.index].tolist()
+
+
+class Series:
+    """一个指标的多分辨率时间序列"""
+    __slots__ = ('rings', 'sums', 'counts')
+
+    def __init__(self):
+        self.rings = [Ring(size) for _, size in RESOLUTIONS]
+        # 各级正在累积的周期
+        self.sums = [0.0] * len(RESOLUTIONS)
+        self.counts = [0] * len(RESOLUTIONS)
+
+    def add(self, value: float):
+        self.rings[SECOND].append(value)
+        level = SECOND
+        while level + 1 < len(RESOLUTIONS):
+            next_level = level + 1
+            self.sums[next_level] += value
+            self.counts[next_level] += 1
+            ratio = RESOLUTIONS[next_level][0] // RESOLUTIONS[level][0]
+            if self.counts[next_level] < ratio:
+                break
+            value = self.sums[next_level] / self.counts[next_level]
+            self.sums[next_level] = 0.0
+            self.counts[next_level] = 0
+            self.rings[next_level].append(value)
+            level = next_level
+
+    @property
+    def latest(self) -> float | None:
+        ring = self.rings[SECOND]
+        return ring.last(1)[0] if ring.count else None
+
+
+class HostSampler:
+    def __init__(self, interval: float = 1.0, disk_path: str = '/'):
+        """
+        Args:
+            interval: 采样间隔(秒)，时间序列按每次采样为一秒记录
+            disk_path: 统计使用率的分区
+        """
+        self.interval = interval
+        self.disk_path = disk_path
+        self.series = {name: Series() for name in METRICS}
+        self.samples = 0
+        self.cost = 0.0
+        self.running = False
+        self._fds: dict[str, int] = {}
+        self._prev: dict[str, float] | None = None
+        self._prev_time = 0.0
+        self._disks = self._whole_disks()
+
+    @staticmethod
+    def available() -> bool:
+        return os.path.exists('/proc/stat')
+
+    @staticmethod
+    def _whole_disks() -> set[bytes]:
+        """整块硬盘的名称，统计时跳过分区和虚拟设备避免重复计算"""
+        try:
+            names = os.listdir('/sys/block')
+        except FileNotFoundError:
+            return set()
+        return {name.encode() for name in names if not name.startswith(('loop', 'ram', 'zram', 'dm-', 'md'))}
+
+    def _read(self, path: str) -> bytes:
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = self._fds[path] = os.open(path, os.O_RDONLY)
+        return os.pread(fd, 65536, 0)
+
+    def close(self):
+        self.running = False
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    def read_counters(self) -> dict[str, float]:
+        """读取累计值和瞬时值"""
+        values = {}
+
+        cpu = self._read('/proc/stat').split(b'\n', 1)[0].split()[1:]
+        ticks = [int(x) for x in cpu[:8]]
+        values['cpu_total'] = sum(ticks)
+        values['cpu_idle'] = ticks[3] + ticks[4]
+
+        mem = {}
+        for line in self._read('/proc/meminfo').split(b'\n'):
+            if line.startswith((b'MemTotal:', b'MemAvailable:')):
+                key, value = line.split()[:2]
+                mem[key] = int(value) * 1024
+                if len(mem) == 2:
+                    break
+        total = mem.get(b'MemTotal:', 0)
+        used = total - mem.get(b'MemAvailable:', 0)
+        values['mem_used'] = used
+        values['mem'] = used / total * 100 if total else 0.0
+
+        read = write = 0
+        for line in self._read('/proc/diskstats').split(b'\n'):
+            fields = line.split()
+            if len(fields) > 9 and fields[2] in self._disks:
+                read += int(fields[5])
+                write += int(fields[9])
+        values['disk_read_total'] = read * 512
+        values['disk_write_total'] = write * 512
+
+        rx = tx = 0
+        for line in self._read('/proc/net/dev').split(b'\n')[2:]:
+            name, _, rest = line.partition(b':')
+            if not rest or name.strip() == b'lo':
+                continue
+            fields = rest.split()
+            rx += int(fields[0])
+            tx += int(fields[8])
+        values['net_rx_total'] = rx
+        values['net_tx_total'] = tx
+
+        values['rss'] = int(self._read('/proc/self/statm').split()[1]) * _PAGE_SIZE
+
+        st = os.statvfs(self.disk_path)
+        size = st.f_blocks * st.f_frsize
+        values['disk'] = (size - st.f_bavail * st.f_frsize) / size * 100 if size else 0.0
+        return values
+
+    def sample(self):
+        """采样一次，第一次只记录累计值"""
+        start = perf_counter()
+        now = monotonic()
+        current = self.read_counters()
+        prev = self._prev
+        if prev is not None:
+            elapsed = now - self._prev_time or 1e-9
+            total = current['cpu_total'] - prev['cpu_total']
+            idle = current['cpu_idle'] - prev['cpu_idle']
+            add = {
+                'cpu': (1 - idle / total) * 100 if total > 0 else 0.0,
+                'mem': current['mem'],
+                'mem_used': current['mem_used'],
+                'disk': current['disk'],
+                'disk_read': (current['disk_read_total'] - prev['disk_read_total']) / elapsed,
+                'disk_write': (current['disk_write_total'] - prev['disk_write_total']) / elapsed,
+                'net_rx': (current['net_rx_total'] - prev['net_rx_total']) / elapsed,
+                'net_tx': (current['net_tx_total'] - prev['net_tx_total']) / elapsed,
+                'rss': current['rss'],
+            }
+            for name, value in add.items():
+                self.series[name].add(value)
+            self.samples += 1
+        self._prev = current
+        self._prev_time = now
+        self.cost += perf_counter() - start
+
+    async def run(self):
+        if not self.available():
+            logger.warning('/proc is not available, host metrics disabled')
+            return
+        self.running = True
+        while self.running:
+            try:
+                self.sample()
+            except Exception:
+                logger.error('Failed to sample host metrics', exc_info=True)
+            await sleep(self.interval)
+
+    # 查询，只访问内存
+
+    def latest(self) -> dict[str, float]:
+        return {name: series.latest for name, series in self.series.items() if series.latest is not None}
+
+    def values(self, name: str, resolution: int = SECOND, n: int | None = None) -> list[float]:
+        return self.series[name].rings[resolution].last(n)
+
+    def summary(self, name: str, resolution: int = SECOND, n: int | None = None) -> tuple[float, float] | None:
+        """最近 n 个点的 (平均值, 最大值)，没有数据时返回 None"""
+        values = self.values(name, resolution, n)
+        if not values:
+            return None
+        return sum(values) / len(values), max(values)
+
+    @property
+    def cost_per_sample(self) -> float:
+        """平均每次采样的耗时(秒)"""
+        return self.cost / self.samples if self.samples else 0.0
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.hostmetrics
+    series = Series()
+    for i in range(3600 * 2):
+        series.add(i % 60)
+    assert len(series.rings[SECOND]) == 600 and series.rings[SECOND].last(2) == [58.0, 59.0]
+    assert len(series.rings[MINUTE]) == 120 and series.rings[MINUTE].last(1) == [29.5]
+    assert len(series.rings[HOUR]) == 2 and series.rings[HOUR].last() == [29.5, 29.5]
+
+    sampler = HostSampler()
+    if sampler.available():
+        for _ in range(1001):
+            sampler.sample()
+        print({k: round(v, 1) for k, v in sampler.latest().items()})
+        print(f'每次采样 {sampler.cost_per_sample * 1e6:.0f}us')
+        sampler.close()
+    print("所有测试通过！")
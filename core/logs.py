@@ -5,23 +5,36 @@
 1. 提供统一的日志接口
 2. 支持文件和控制台输出
 3. 实现日志文件轮转
+4. 记录日志不阻塞事件循环
 
 特点：
 1. 使用RotatingFileHandler控制日志文件大小
 2. 支持多个日志处理器
 3. 统一的日志格式
+4. 事件循环只把日志记录放入有界队列，格式化、写入和轮转都在后台线程批量完成
+5. 队列满时直接丢弃并计数，日志风暴不会拖慢消息处理
+6. 低于级别的日志在入队前就被过滤，不会被格式化
 
 配置：
 - 日志级别：INFO
 - 文件大小：1MB
 - 备份数量：5个
+- 队列长度：10000条
+- 单批最多写入：512条
 """
 
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+import atexit
 import os
 import sys
 
+LEVEL = logging.INFO
+QUEUE_SIZE = 10000
+BATCH_SIZE = 512
+
 # 设置日志目录
 log_dir = 'logs'
 if not os.path.exists(log_dir):
@@ -30,6 +43,121 @@ if not os.path.exists(log_dir):
 # 设置日志文件名格式
 log_file = os.path.join(log_dir, 'latest.log')
 
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    把日志记录放入有界队列，队列满时丢弃并按级别计数
+
+    与标准 QueueHandler 不同，入队前不格式化记录，
+    消息拼接和异常堆栈的格式化都留给后台线程
+    """
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped: dict[str, int] = {}
+        self._dropped_lock = Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 监听线程与当前线程在同一进程内，直接传递记录对象
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with self._dropped_lock:
+                self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+    def take_dropped(self) -> dict[str, int]:
+        """取出并清零丢弃计数"""
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, {}
+        return dropped
+
+
+class BatchListener:
+    """
+    后台日志线程，从队列批量取出记录写入各个处理器
+
+    对 StreamHandler(包括文件处理器)，一批记录格式化后连续写入，整批只 flush 一次，
+    文件轮转也在这个线程中进行
+    """
+    _sentinel = None
+
+    def __init__(self, queue: Queue, source: BoundedQueueHandler, *handlers: logging.Handler):
+        self.queue = queue
+        self.source = source
+        self.handlers = handlers
+        self.written = 0
+        self._thread: Thread | None = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='log-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """放入结束标记并等待线程写完队列中剩余的记录"""
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def _run(self):
+        queue = self.queue
+        while True:
+            batch = [queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+            stop = self._sentinel in batch
+            records = [record for record in batch if record is not self._sentinel]
+
+            dropped = self.source.take_dropped()
+            if dropped:
+                records.append(logging.makeLogRecord({
+                    'name': __name__,
+                    'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': f"Log queue full, dropped {sum(dropped.values())} records {dropped}",
+                }))
+            self._write(records)
+            if stop:
+                return
+
+    def _write(self, records: list[logging.LogRecord]):
+        for handler in self.handlers:
+            try:
+                if isinstance(handler, logging.StreamHandler):
+                    self._write_stream(handler, records)
+                else:
+                    for record in records:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+            except Exception:
+                if records:
+                    handler.handleError(records[-1])
+        self.written += len(records)
+
+    @staticmethod
+    def _write_stream(handler: logging.StreamHandler, records: list[logging.LogRecord]):
+        rotating = isinstance(handler, RotatingFileHandler)
+        with handler.lock:
+            for record in records:
+                if record.levelno < handler.level or not handler.filter(record):
+                    continue
+                if rotating and handler.shouldRollover(record):
+                    handler.doRollover()
+                if handler.stream is None:
+                    handler.stream = handler._open()
+                handler.stream.write(handler.format(record) + handler.terminator)
+            if handler.stream is not None:
+                handler.stream.flush()
+
+
 # 创建 RotatingFileHandler 用于文件输出
 file_handler = RotatingFileHandler(log_file, maxBytes=1*1024*1024, backupCount=5, encoding='utf-8')
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
@@ -38,5 +166,15 @@ file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(mes
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 
+# 事件循环一侧只有入队的开销
+log_queue: Queue = Queue(maxsize=QUEUE_SIZE)
+queue_handler = BoundedQueueHandler(log_queue)
+queue_handler.setLevel(LEVEL)
+
+listener = BatchListener(log_queue, queue_handler, file_handler, console_handler)
+listener.start()
+# atexit 按注册的相反顺序执行，之后创建的 ModuleManager 在退出时卸载模块产生的日志也会被写出
+atexit.register(listener.stop)
+
 # 配置日志
-logging.basicConfig(level=logging.INFO, handlers=[file_handler, console_handler])
+logging.basicConfig(level=LEVEL, handlers=[queue_handler])
@@ -0,0 +1,344 @@
+"""
+图片和文件的下载缓存，按内容哈希保存在硬盘上
+
+设计目标：
+1. 反复出现的表情和转发图片只下载一次
+2. 同一个 URL 的并发请求只发起一次下载
+3. 下载大文件时不把整个文件放进内存
+4. 总大小有上限，重启后缓存仍然有效
+
+实现方式：
+- 同一个 URL 正在下载时，后来的请求等待同一个任务(single-flight)；下载和写入索引在单独的任务中进行，
+  某个请求被取消不会中断下载，也不会影响其它等待者，下载完成的文件仍会被索引
+- 下载在线程中分块读取，边写入临时文件边计算 sha256，完成后改名为 <root>/<前两位>/<哈希>，
+  内容相同的不同 URL 共享同一个文件
+- 内存中按文件(哈希)维护 LRU 和总大小，超过 max_bytes 时删除最久未使用的文件
+- URL -> 哈希 的索引保存在 core.storage 的表中，启动时读入内存；
+  访问时间只在距离上次记录超过 TOUCH_INTERVAL 时才写回
+
+使用示例：
+    ```python
+    media = MediaCache('data/media')
+    await media.load()
+    for url in media_urls(context.event.message):
+        file = await media.get(url)
+        data = await file.read()
+    ```
+"""
+
+import os
+import hashlib
+import logging
+import urllib.request
+from time import time
+from collections import OrderedDict
+from functools import partial
+from asyncio import Task, to_thread, create_task, shield
+
+from .message import Message
+from .storage import Database, database as default_database
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 1 << 16
+TOUCH_INTERVAL = 300
+MEDIA_TYPES = ('image', 'record', 'video', 'file')
+
+
+def media_urls(message: Message) -> list[str]:
+    """提取 OneBot 格式消息中图片、语音、视频和文件的 URL"""
+    if isinstance(message, str):
+        return []
+    urls = []
+    for node in message:
+        if node.get('type') in MEDIA_TYPES:
+            url = (node.get('data') or {}).get('url')
+            if url:
+                urls.append(url)
+    return urls
+
+
+class MediaFile:
+    def __init__(self, url: str, path: str, digest: str, size: int, mime: str):
+        self.url = url
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.mime = mime
+
+    async def read(self) -> bytes:
+        def read():
+            with open(self.path, 'rb') as f:
+                return f.read()
+        return await to_thread(read)
+
+    def __repr__(self):
+        return f'MediaFile({self.url!r}, {self.digest[:12]}, {self.size})'
+
+
+class _Blob:
+    __slots__ = ('size', 'mime', 'urls')
+
+    def __init__(self, size: int, mime: str):
+        self.size = size
+        self.mime = mime
+        self.urls: set[str] = set()
+
+
+class MediaCache:
+    def __init__(
+            self,
+            root: str,
+            max_bytes: int = 1 << 30,
+            max_file_bytes: int = 64 << 20,
+            timeout: float = 30.0,
+            database: Database = default_database,
+        ):
+        """
+        Args:
+            root: 文件保存目录
+            max_bytes: 所有文件的总大小上限
+            max_file_bytes: 单个文件的大小上限，超过时下载失败
+            timeout: 下载的网络超时时间(秒)
+            database: 保存索引的数据库
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.timeout = timeout
+        self.table = database.namespace('media').table(
+            'urls',
+            'url TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, mime TEXT, atime REAL',
+            ['digest'],
+        )
+        self.urls: dict[str, str] = {}
+        self.atimes: dict[str, float] = {}
+        self.blobs: OrderedDict[str, _Blob] = OrderedDict()
+        self.bytes = 0
+        self._loading: dict[str, Task] = {}
+        self.hits = 0
+        self.downloads = 0
+        self.shared = 0
+        self.evictions = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    async def load(self):
+        """读入索引，按访问时间重建 LRU"""
+        await self.table.create()
+        for row in await self.table.select(suffix='ORDER BY atime'):
+            self._index(row['url'], row['digest'], row['size'], row['mime'] or '', row['atime'] or 0)
+
+    def _index(self, url: str, digest: str, size: int, mime: str, atime: float):
+        old = self.urls.get(url)
+        if old is not None and old != digest and old in self.blobs:
+            # URL 的内容变了，旧文件不再被它引用
+            self.blobs[old].urls.discard(url)
+        blob = self.blobs.get(digest)
+        if blob is None:
+            blob = self.blobs[digest] = _Blob(size, mime)
+            self.bytes += size
+        else:
+            self.blobs.move_to_end(digest)
+        blob.urls.add(url)
+        self.urls[url] = digest
+        self.atimes[url] = atime
+
+    def _file(self, url: str, digest: str) -> MediaFile:
+        blob = self.blobs[digest]
+        return MediaFile(url, self.path(digest), digest, blob.size, blob.mime)
+
+    def _touch(self, url: str, digest: str):
+        self.blobs.move_to_end(digest)
+        now = time()
+        if now - self.atimes.get(url, 0) > TOUCH_INTERVAL:
+            self.atimes[url] = now
+            create_task(self.table.update({'atime': now}, 'url = ?', (url,)))
+
+    async def get(self, url: str) -> MediaFile:
+        """获取 URL 对应的文件，未缓存时下载，同一个 URL 的并发请求共享同一次下载"""
+        digest = self.urls.get(url)
+        if digest is not None:
+            if os.path.exists(self.path(digest)):
+                self.hits += 1
+                self._touch(url, digest)
+                return self._file(url, digest)
+            # 文件被外部删除
+            await self._forget(digest)
+
+        task = self._loading.get(url)
+        if task is None:
+            task = self._loading[url] = create_task(self._fetch(url))
+            task.add_done_callback(partial(self._fetched, url))
+        else:
+            self.shared += 1
+        # 取消的只是这一个等待者，下载继续进行，结果仍会被索引
+        return await shield(task)
+
+    async def _fetch(self, url: str) -> MediaFile:
+        self.downloads += 1
+        digest, size, mime = await to_thread(self._download, url)
+        now = time()
+        self._index(url, digest, size, mime, now)
+        await self.table.database.execute(
+            f'INSERT OR REPLACE INTO {self.table.name} (url, digest, size, mime, atime) VALUES (?, ?, ?, ?, ?)',
+            (url, digest, size, mime, now))
+        await self._evict(keep=digest)
+        return self._file(url, digest)
+
+    def _fetched(self, url: str, task: Task):
+        if self._loading.get(url) is task:
+            del self._loading[url]
+        if not task.cancelled():
+            # 没有等待者时避免 "exception was never retrieved"
+            task.exception()
+
+    def _download(self, url: str) -> tuple[str, int, str]:
+        """在线程中下载，返回 (sha256, 大小, 类型)"""
+        os.makedirs(self.root, exist_ok=True)
+        h = hashlib.sha256()
+        size = 0
+        tmp = os.path.join(self.root, f'download.{os.getpid()}.{id(h)}.tmp')
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response, open(tmp, 'wb') as f:
+                mime = response.headers.get_content_type()
+                while chunk := response.read(CHUNK):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise ValueError(f'Media larger than {self.max_file_bytes} bytes: {url}')
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+            return digest, size, mime
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    async def _forget(self, digest: str):
+        """从索引中删除一个文件和指向它的所有 URL"""
+        blob = self.blobs.pop(digest, None)
+        if blob is None:
+            return
+        self.bytes -= blob.size
+        for url in blob.urls:
+            # URL 可能已经被重新索引到其它文件
+            if self.urls.get(url) == digest:
+                del self.urls[url]
+                self.atimes.pop(url, None)
+        await self.table.delete('digest = ?', (digest,))
+
+    async def _evict(self, keep: str | None = None):
+        while self.bytes > self.max_bytes and len(self.blobs) > 1:
+            digest = next(iter(self.blobs))
+            if digest == keep:
+                self.blobs.move_to_end(digest)
+                continue
+            await self._forget(digest)
+            await to_thread(self._remove_file, digest)
+            self.evictions += 1
+
+    def _remove_file(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def info(self) -> dict:
+        return {
+            'urls': len(self.urls),
+            'files': len(self.blobs),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'downloads': self.downloads,
+            'shared': self.shared,
+            'evictions': self.evictions,
+        }
+
+
+if __name__ == '__main__':
+    # 用本地 HTTP 服务测试，运行方式: python -m core.media
+    import asyncio
+    import tempfile
+    import threading
+    from time import sleep
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    requests: dict[str, int] = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests[self.path] = requests.get(self.path, 0) + 1
+            if self.path == '/slow':
+                sleep(0.1)
+            if self.path.startswith('/same'):
+                body = b'same sticker' * 100
+            else:
+                body = self.path.encode() * 1000
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    async def main(tmp: str):
+        db = Database(os.path.join(tmp, 'media.db'))
+        media = MediaCache(os.path.join(tmp, 'media'), max_bytes=9000, database=db)
+        await media.load()
+
+        # 并发请求只下载一次
+        files = await asyncio.gather(*(media.get(f'{base}/a') for _ in range(10)))
+        assert requests['/a'] == 1 and len({f.digest for f in files}) == 1
+        assert await files[0].read() == b'/a' * 1000 and files[0].mime == 'image/png'
+
+        # 相同内容只保存一份
+        x = await media.get(f'{base}/same?1')
+        y = await media.get(f'{base}/same?2')
+        assert x.digest == y.digest and len(media.blobs) == 2
+
+        # 超过总大小时淘汰最久未使用的
+        await media.get(f'{base}/a')
+        for name in ('b', 'c', 'd', 'e', 'f', 'g'):
+            await media.get(f'{base}/{name}')
+        assert media.bytes <= 9000 and media.evictions > 0
+        assert f'{base}/a' not in media.urls
+
+        # 第一个请求被取消，其它等待者仍然拿到结果，下载完成的文件被索引
+        first = asyncio.create_task(media.get(f'{base}/slow'))
+        second = asyncio.create_task(media.get(f'{base}/slow'))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        file = await second
+        assert first.cancelled() and await file.read() == b'/slow' * 1000
+        assert media.urls[f'{base}/slow'] == file.digest and not media._loading
+
+        # 重启后索引仍然有效
+        await asyncio.sleep(0.05)
+        restarted = MediaCache(os.path.join(tmp, 'media'), max_bytes=9000, database=db)
+        await restarted.load()
+        assert restarted.urls == media.urls and restarted.bytes == media.bytes
+        before = dict(requests)
+        await restarted.get(f'{base}/g')
+        assert requests == before
+
+        print(restarted.info())
+        db.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(tmp))
+    server.shutdown()
+    print("所有测试通过！")
@@ -0,0 +1,214 @@
+"""
+内存诊断：用 tracemalloc 找出一段时间内增长的内存属于哪个插件
+
+设计目标：
+1. 长时间运行后内存增长时，能在线上定位到具体插件和代码行
+2. 默认不产生任何开销，只在诊断期间开启 tracemalloc，结束后立即关闭
+3. 同时统计事件系统中容易泄漏的对象数量
+
+实现方式：
+- diff(seconds) 开启 tracemalloc，取开始和结束时的快照并比较，只有这段时间内的分配会被记录
+- 分配按调用栈中最内层位于插件包(mods/adapters)中的帧归属到插件，否则归属到 core 或其它
+- 快照的比较在线程中进行，记录的栈深度由 frames 限制
+- count_objects 遍历 gc 跟踪的对象，按类型统计 EventHandler、Context、Event 和 Future，
+  并与上一次统计比较
+
+使用示例：
+    ```python
+    diagnostics = MemoryDiagnostics()
+    report = await diagnostics.diff(30)
+    print(report.format(10))
+    print(diagnostics.count_objects())
+    ```
+"""
+
+import os
+import gc
+import tracemalloc
+from asyncio import Future, sleep, to_thread
+from collections import Counter
+
+from .event import Context, Event, EventHandler
+from .profiler import PLUGIN_PACKAGES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACKED_TYPES = (EventHandler, Context, Event, Future)
+
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def owner_of(filename: str) -> str | None:
+    """文件所属的插件或 core，例如 <ROOT>/mods/history/index.py -> mods.history"""
+    if not filename.startswith(ROOT + os.sep):
+        return None
+    parts = os.path.relpath(filename, ROOT).split(os.sep)
+    if parts[0] in PLUGIN_PACKAGES and len(parts) > 1:
+        return f'{parts[0]}.{parts[1].removesuffix(".py")}'
+    if parts[0] == 'core':
+        return 'core'
+    return None
+
+
+def _owner(traceback: tracemalloc.Traceback) -> str:
+    core = False
+    # 从最内层的帧开始找
+    for frame in reversed(traceback):
+        owner = owner_of(frame.filename)
+        if owner == 'core':
+            core = True
+        elif owner is not None:
+            return owner
+    return 'core' if core else '(其它)'
+
+
+class MemoryReport:
+    def __init__(self, seconds: float, by_owner: list[tuple[str, int, int]], top: list[tuple[str, int, int]], total: int):
+        """
+        Args:
+            by_owner: (插件, 增长字节数, 增长块数)，按增长字节数降序
+            top: (文件:行, 增长字节数, 增长块数)，按增长字节数降序
+            total: 总增长字节数
+        """
+        self.seconds = seconds
+        self.by_owner = by_owner
+        self.top = top
+        self.total = total
+
+    def format(self, n: int = 10) -> str:
+        lines = [f'{self.seconds:g}s 内增长 {_size(self.total)}']
+        lines.append('[插件]')
+        lines += [f'{_size(size):>10} {count:+d} {owner}' for owner, size, count in self.by_owner[:n]]
+        lines.append('[位置]')
+        lines += [f'{_size(size):>10} {count:+d} {where}' for where, size, count in self.top[:n]]
+        return '\n'.join(lines)
+
+
+def _size(size: int) -> str:
+    sign = '-' if size < 0 else '+'
+    size = abs(size)
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{sign}{size:.0f}{unit}' if unit == 'B' else f'{sign}{size:.1f}{unit}'
+        size /= 1024
+    return f'{sign}{size:.1f}GiB'
+
+
+def _location(filename: str) -> str:
+    if filename.startswith(ROOT + os.sep):
+        return os.path.relpath(filename, ROOT)
+    return filename
+
+def _compare(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, seconds: float) -> MemoryReport:
+    old = old.filter_traces(_FILTERS)
+    new = new.filter_traces(_FILTERS)
+    owners: dict[str, list[int]] = {}
+    total = 0
+    for stat in new.compare_to(old, 'traceback'):
+        item = owners.setdefault(_owner(stat.traceback), [0, 0])
+        item[0] += stat.size_diff
+        item[1] += stat.count_diff
+        total += stat.size_diff
+    by_owner = sorted(((owner, size, count) for owner, (size, count) in owners.items()), key=lambda x: -x[1])
+    top = [
+        (f'{_location(stat.traceback[0].filename)}:{stat.traceback[0].lineno}', stat.size_diff, stat.count_diff)
+        for stat in new.compare_to(old, 'lineno') if stat.size_diff > 0
+    ]
+    return MemoryReport(seconds, by_owner, top, total)
+
+
+class MemoryDiagnostics:
+    def __init__(self, frames: int = 16):
+        """
+        Args:
+            frames: tracemalloc 为每次分配记录的栈深度，越大越准确，开销也越大
+        """
+        self.frames = frames
+        self.running = False
+        self.last_counts: Counter | None = None
+
+    async def diff(self, seconds: float) -> MemoryReport:
+        """开启 tracemalloc seconds 秒，返回这段时间内仍存活的分配"""
+        if self.running or tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is already running')
+        self.running = True
+        try:
+            tracemalloc.start(self.frames)
+            try:
+                old = tracemalloc.take_snapshot()
+                await sleep(seconds)
+                # 回收循环引用，只留下真正存活的对象
+                gc.collect()
+                new = tracemalloc.take_snapshot()
+            finally:
+                tracemalloc.stop()
+            return await to_thread(_compare, old, new, seconds)
+        finally:
+            self.running = False
+
+    def count_objects(self, types: tuple[type, ...] = TRACKED_TYPES) -> list[tuple[str, int, int]]:
+        """
+        统计 gc 跟踪的对象中属于 types 的数量
+        返回 (类型名, 数量, 与上一次统计相比的变化)，按数量降序
+        """
+        counts = Counter()
+        for obj in gc.get_objects():
+            if isinstance(obj, types):
+                cls = type(obj)
+                counts[f'{cls.__module__}.{cls.__qualname__}'] += 1
+        last = self.last_counts or Counter()
+        self.last_counts = counts
+        return [(name, count, count - last.get(name, 0)) for name, count in counts.most_common()]
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.memdiag
+    import sys
+    import types
+    import asyncio
+    from .event import on, emit
+
+    # 模拟一个插件
+    plugin = types.ModuleType('mods.leaky')
+    plugin.__file__ = os.path.join(ROOT, 'mods', 'leaky.py')
+    sys.modules[plugin.__name__] = plugin
+    exec(compile('leaked = []\ndef leak():\n    leaked.append(bytearray(1000))\n', plugin.__file__, 'exec'), plugin.__dict__)
+
+    class LeakEvent(Event):
+        pass
+
+    contexts = []
+
+    @on(LeakEvent)
+    def keep(ctx):
+        contexts.append(ctx)
+
+    async def main():
+        diagnostics = MemoryDiagnostics()
+        diagnostics.count_objects()
+
+        async def run():
+            for _ in range(200):
+                plugin.leak()
+                await emit(LeakEvent())
+                await asyncio.sleep(0.001)
+        task = asyncio.create_task(run())
+        report = await diagnostics.diff(1)
+        await task
+        print(report.format(5))
+        owners = {owner: size for owner, size, _ in report.by_owner}
+        assert owners['mods.leaky'] >= 200 * 1000, owners
+        assert any(where.startswith(os.path.join('mods', 'leaky.py')) for where, _, _ in report.top[:3])
+        assert not tracemalloc.is_tracing()
+
+        counts = {name: diff for name, _, diff in diagnostics.count_objects()}
+        print(counts)
+        assert counts['core.event.Context'] >= 200
+        assert counts['__main__.LeakEvent'] >= 200
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -10,6 +10,7 @@
 1. MessageNode: 消息节点基类
 2. Sender: 发送者信息模型
 3. MessageEvent: 消息事件模型
+4. MergedMessageEvent: 连续多条消息合并后的事件
 
 特点：
 - 使用继承体系支持不同类型消息
@@ -33,6 +34,22 @@ class TextNode(MessageNode):
         super().__init__()
         self.text = text
 
+def message_text(message: Message) -> str:
+    '''
+    提取消息中的纯文本部分，非文本节点会被忽略
+    同时兼容 TextNode 和 OneBot 格式的 {'type': 'text', 'data': {'text': ...}}
+    '''
+    if isinstance(message, str):
+        return message
+    texts = []
+    for node in message:
+        if isinstance(node, TextNode):
+            texts.append(node.text)
+        elif node.get('type') == 'text':
+            data = node.get('data') or {}
+            texts.append(data.get('text', ''))
+    return ''.join(texts)
+
 class Sender(AttrDict):
     def __init__(
             self,
@@ -187,6 +204,47 @@ class GroupMessageEvent(MessageEvent):
                 anonymous=anonymous,
         )
 
+def merge_messages(messages: list[Message], separator: str = '\n') -> Message:
+    '''
+    把多条消息按顺序拼接为一条，消息之间插入 separator
+    全部是字符串时结果仍是字符串，否则为节点列表
+    '''
+    if all(isinstance(message, str) for message in messages):
+        return separator.join(messages)
+    nodes = []
+    for message in messages:
+        if nodes and separator:
+            nodes.append(TextNode(separator))
+        if isinstance(message, str):
+            nodes.append(TextNode(message))
+        else:
+            nodes.extend(message)
+    return nodes
+
+class MergedMessageEvent(Event):
+    '''
+    同一个用户在同一个会话中连续发送的多条消息合并而成的事件，由 core.coalesce 产生
+
+    不是 MessageEvent 的子类，监听 MessageEvent 的处理器仍然逐条收到原始消息，
+    需要合并后的消息流的处理器应监听此事件；每条原始消息恰好出现在一个合并事件中
+    '''
+    def __init__(self, events: list[MessageEvent]):
+        super().__init__()
+        last = events[-1]
+        self.time = last.time
+        self.self_id = last.self_id
+        self.post_type = 'message'
+        self.message_type = last.message_type
+        self.sub_type = last.sub_type
+        self.user_id = last.user_id
+        self.group_id = last.get('group_id')
+        self.sender = last.sender
+        self.message_ids = [event.message_id for event in events]
+        self.message = merge_messages([event.message for event in events])
+        self.raw_message = '\n'.join(event.raw_message for event in events)
+        # 原始的消息事件
+        self.events = events
+
 if __name__=='__main__':
     msg = PrivateMessageEvent(time=1, self_id=1, post_type='1', message_type='1',sub_type='1', message_id=1, message='1', raw_message='1', font=1, sender=Sender(), user_id=1)
     print(msg)
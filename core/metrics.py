@@ -0,0 +1,277 @@
+"""
+运行时指标：计数器、仪表和固定分桶的直方图，以 Prometheus 文本格式导出
+
+设计目标：
+1. 在消息处理的热路径上记录指标，开销只有几次加法
+2. 运行中可以随时查看队列深度、排队时间、处理时间和回复延迟
+3. 可以被 Prometheus 抓取，也可以在聊天中查看
+
+实现方式：
+- 所有更新都在事件循环线程中进行，不需要加锁；其它线程只应通过 call_soon_threadsafe 更新
+- 带标签的指标按标签值缓存子指标，热路径上可以保存子指标直接更新
+- 直方图的分桶固定，observe 用二分查找定位分桶
+- 仪表可以设置为函数，在导出时才计算，例如队列长度
+- serve 在本地端口提供 /metrics，不依赖第三方 HTTP 库
+
+使用示例：
+    ```python
+    from core.metrics import registry
+
+    handled = registry.counter('plugin_handled_total', '处理的消息数', ['plugin'])
+    handled.labels(plugin='mc').inc()
+
+    latency = registry.histogram('plugin_seconds', '处理时间', ['plugin'])
+    latency.labels(plugin='mc').observe(0.003)
+
+    create_task(serve(registry, port=9108))
+    ```
+"""
+
+import math
+import logging
+from bisect import bisect_left
+from typing import Callable, Iterable
+from asyncio import StreamReader, StreamWriter, start_server, wait_for
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ('_value', 'function')
+
+    def __init__(self):
+        self._value = 0.0
+        self.function: Callable[[], float] | None = None
+
+    @property
+    def value(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return math.nan
+        return self._value
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1.0):
+        self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self._value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """导出时调用 function 获取值"""
+        self.function = function
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # 最后一个是 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """根据分桶线性插值估计分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+
+class Metric:
+    """带标签的指标，没有标签时用 labels() 获取唯一的子指标"""
+    type = ''
+
+    def __init__(self, name: str, help: str = '', labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: dict[tuple, object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kws):
+        if kws:
+            values = tuple(kws[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {key}')
+            child = self.children[key] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        self.children.pop(tuple(str(v) for v in values), None)
+
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def samples(self):
+        for key, child in self.children.items():
+            yield self.name, dict(zip(self.labelnames, key)), child.value
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def samples(self):
+        for key, child in self.children.items():
+            yield self.name, dict(zip(self.labelnames, key)), child.value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str = '', labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def samples(self):
+        for key, child in self.children.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for upper, count in zip(self.buckets, child.counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': repr(upper)}, cumulative
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, child.count
+            yield f'{self.name}_sum', labels, child.sum
+            yield f'{self.name}_count', labels, child.count
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def _get(self, cls: type[Metric], name: str, *args, **kws) -> Metric:
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args, **kws)
+        elif not isinstance(metric, cls):
+            raise ValueError(f'Metric {name} is already registered as {metric.type}')
+        return metric
+
+    def counter(self, name: str, help: str = '', labelnames: Iterable[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str = '', labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str = '', labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        """Prometheus 文本格式 0.0.4"""
+        lines = []
+        for metric in self.metrics.values():
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {_escape(metric.help)}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                    lines.append(f'{name}{{{label_text}}} {_format_value(value)}')
+                else:
+                    lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> list[str]:
+        """便于在聊天中阅读的摘要，直方图显示次数、平均值和估计的 p50/p95"""
+        lines = []
+        for metric in self.metrics.values():
+            for key, child in metric.children.items():
+                label = ','.join(key)
+                name = f'{metric.name}{{{label}}}' if label else metric.name
+                if isinstance(child, _HistogramChild):
+                    if not child.count:
+                        continue
+                    lines.append(
+                        f'{name} n={child.count} avg={child.sum / child.count * 1000:.2f}ms '
+                        f'p50={child.quantile(0.5) * 1000:.2f}ms p95={child.quantile(0.95) * 1000:.2f}ms')
+                else:
+                    lines.append(f'{name} {_format_value(child.value)}')
+        return lines
+
+
+registry = Registry()
+
+
+async def serve(registry: Registry = registry, host: str = '127.0.0.1', port: int = 9108):
+    """在本地端口提供 GET /metrics，返回 Server 对象"""
+    async def handle(reader: StreamReader, writer: StreamWriter):
+        try:
+            request = await wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            path = request.split(b' ', 2)[1] if request.count(b' ') >= 2 else b''
+            if path.split(b'?')[0] == b'/metrics':
+                body = registry.render().encode('utf-8')
+                status = b'200 OK'
+            else:
+                body = b'Not Found\n'
+                status = b'404 Not Found'
+            writer.write(
+                b'HTTP/1.1 ' + status + b'\r\n'
+                b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    server = await start_server(handle, host, port)
+    logger.info(f'Metrics available at http://{host}:{port}/metrics')
+    return server
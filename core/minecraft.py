@@ -0,0 +1,337 @@
+"""
+Minecraft 服务器日志监控，增量读取 latest.log 并转换为事件
+
+设计目标：
+1. 实时获取玩家聊天、进出和死亡信息
+2. 每分钟数千行日志时仍然开销很低
+3. 聊天转发到群时合并发送，而不是每行发送一次
+4. 可以用伪造的日志文件测试
+
+实现方式：
+- 记录已读取的字节偏移，每次只读取新增部分，不完整的最后一行留到下次
+- 通过 inode 变化识别日志轮转(先读完旧文件剩余部分再切换)，通过文件变小识别截断
+- 只有包含 `[Server thread/INFO]: ` 的行才进入预编译的正则匹配，并且按字节匹配，命中后才解码
+- 解析出的事件通过 core.event 触发，ChatForwarder 订阅这些事件，按时间窗口合并后发送到群
+
+使用示例：
+    ```python
+    tailer = LogTailer('/srv/mc/logs/latest.log')
+    create_task(tailer.run())
+
+    forwarder = ChatForwarder(OneBotContext, [123456], window=2)
+    forwarder.install()
+    create_task(forwarder.run())
+    ```
+"""
+
+import os
+import re
+import logging
+import traceback
+from time import time
+from typing import Type
+from asyncio import sleep, to_thread
+
+from .event import Event, Context, on, emit, EventHandler
+from .adapter import AdapterContext, SendGroupMessageEvent
+
+logger = logging.getLogger(__name__)
+
+
+class MinecraftEvent(Event):
+    """Minecraft 服务器日志事件基类"""
+    def __init__(self, server: str, time: float, line: str):
+        super().__init__()
+        self.server = server
+        self.time = time
+        self.line = line
+
+class PlayerChatEvent(MinecraftEvent):
+    def __init__(self, server: str, time: float, line: str, player: str, message: str):
+        super().__init__(server, time, line)
+        self.player = player
+        self.message = message
+
+class PlayerJoinEvent(MinecraftEvent):
+    def __init__(self, server: str, time: float, line: str, player: str):
+        super().__init__(server, time, line)
+        self.player = player
+
+class PlayerLeaveEvent(MinecraftEvent):
+    def __init__(self, server: str, time: float, line: str, player: str):
+        super().__init__(server, time, line)
+        self.player = player
+
+class PlayerDeathEvent(MinecraftEvent):
+    def __init__(self, server: str, time: float, line: str, player: str, message: str):
+        super().__init__(server, time, line)
+        self.player = player
+        self.message = message
+
+
+_MARKER = b'[Server thread/INFO]: '
+_CHAT = re.compile(rb'<([^>]+)> (.*)')
+_JOIN = re.compile(rb'(\w{1,16}) joined the game$')
+_LEAVE = re.compile(rb'(\w{1,16}) left the game$')
+_DEATH = re.compile(
+    rb'(\w{1,16}) (?:was |were |fell |drowned|died|blew up|burned|went |hit the ground|tried to swim|'
+    rb'starved|suffocated|froze|withered|experienced kinetic|discovered the floor|walked into|'
+    rb"didn't want to live|left the confines|can't swim)")
+
+
+def parse_line(line: bytes, server: str = '') -> MinecraftEvent | None:
+    """解析一行日志，不是关心的内容时返回 None"""
+    i = line.find(_MARKER)
+    if i < 0:
+        return None
+    body = line[i + len(_MARKER):]
+    now = time()
+    if m := _CHAT.match(body):
+        return PlayerChatEvent(server, now, line.decode('utf-8', 'replace'),
+                               m[1].decode('utf-8', 'replace'), m[2].decode('utf-8', 'replace'))
+    if m := _JOIN.match(body):
+        return PlayerJoinEvent(server, now, line.decode('utf-8', 'replace'), m[1].decode())
+    if m := _LEAVE.match(body):
+        return PlayerLeaveEvent(server, now, line.decode('utf-8', 'replace'), m[1].decode())
+    if m := _DEATH.match(body):
+        return PlayerDeathEvent(server, now, line.decode('utf-8', 'replace'),
+                                m[1].decode(), body.decode('utf-8', 'replace'))
+    return None
+
+
+class LogTailer:
+    def __init__(self, path: str, server: str = '', interval: float = 0.5, from_end: bool = True, chunk: int = 1 << 20):
+        """
+        Args:
+            path: latest.log 的路径
+            server: 服务器名，写入事件的 server 字段
+            interval: 轮询间隔(秒)
+            from_end: 启动时跳过已有内容，只读取之后新增的日志
+            chunk: 单次最多读取的字节数
+        """
+        self.path = path
+        self.server = server
+        self.interval = interval
+        self.chunk = chunk
+        # 保持打开的文件，轮转后仍然可以读完旧文件
+        self.file = None
+        self.inode: int | None = None
+        self.offset = 0
+        self.partial = b''
+        self.lines = 0
+        self.running = False
+        if self._open() and from_end:
+            self.offset = os.fstat(self.file.fileno()).st_size
+
+    def _open(self) -> bool:
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self.file = None
+            return False
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.offset = 0
+        return True
+
+    def _read(self) -> bytes:
+        self.file.seek(self.offset)
+        data = self.file.read(self.chunk)
+        self.offset += len(data)
+        return data
+
+    def _split(self, data: bytes) -> list[bytes]:
+        if not data:
+            return []
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        self.lines += len(lines)
+        return [line.rstrip(b'\r') for line in lines]
+
+    def read_new(self) -> list[bytes]:
+        """读取新增的完整行，同步执行"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        lines = []
+        if self.file is not None and (st is None or st.st_ino != self.inode):
+            # 轮转：先读完旧文件剩余的部分再切换
+            while data := self._read():
+                lines += self._split(data)
+            if self.partial:
+                lines.append(self.partial)
+                self.partial = b''
+            self.file.close()
+            self.file = None
+        if st is None:
+            return lines
+        if self.file is None:
+            if not self._open():
+                return lines
+        elif st.st_size < self.offset:
+            # 截断
+            self.offset = 0
+            self.partial = b''
+        if st.st_size > self.offset:
+            lines += self._split(self._read())
+        return lines
+
+    def poll(self) -> list[MinecraftEvent]:
+        """读取并解析新增的行"""
+        return [event for line in self.read_new() if (event := parse_line(line, self.server)) is not None]
+
+    async def run(self):
+        self.running = True
+        while self.running:
+            try:
+                events = await to_thread(self.poll)
+                for event in events:
+                    await emit(event)
+            except Exception:
+                logger.error(f"Failed to tail {self.path}")
+                logger.error(traceback.format_exc())
+            await sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ChatForwarder:
+    """把聊天、进出和死亡事件按时间窗口合并后转发到群"""
+    def __init__(
+            self,
+            context_type: Type[AdapterContext],
+            groups: list[int],
+            window: float = 2.0,
+            max_lines: int = 30,
+        ):
+        """
+        Args:
+            context_type: 用于发送消息的适配器上下文类型
+            groups: 转发到的群
+            window: 合并窗口(秒)
+            max_lines: 缓冲超过该行数时提前发送
+        """
+        self.context_type = context_type
+        self.groups = groups
+        self.window = window
+        self.max_lines = max_lines
+        self.buffer: list[str] = []
+        self.handler: EventHandler | None = None
+        self.running = False
+        self.sent = 0
+
+    @staticmethod
+    def format(event: MinecraftEvent) -> str | None:
+        if isinstance(event, PlayerChatEvent):
+            return f'<{event.player}> {event.message}'
+        if isinstance(event, PlayerJoinEvent):
+            return f'{event.player} 加入了游戏'
+        if isinstance(event, PlayerLeaveEvent):
+            return f'{event.player} 离开了游戏'
+        if isinstance(event, PlayerDeathEvent):
+            return event.message
+        return None
+
+    def install(self) -> EventHandler:
+        self.handler = on(MinecraftEvent)
+        self.handler(self.collect)
+        return self.handler
+
+    async def collect(self, context: Context[MinecraftEvent]):
+        text = self.format(context.event)
+        if text is not None:
+            self.buffer.append(text)
+            if len(self.buffer) >= self.max_lines:
+                await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        text, self.buffer = '\n'.join(self.buffer), []
+        for group_id in self.groups:
+            await emit(self.context_type(SendGroupMessageEvent(text, group_id)))
+            self.sent += 1
+
+    async def run(self):
+        self.running = True
+        while self.running:
+            await sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                logger.error("Failed to forward minecraft chat")
+                logger.error(traceback.format_exc())
+
+    def stop(self):
+        self.running = False
+        if self.handler is not None:
+            self.handler.remove()
+            self.handler = None
+
+
+if __name__ == '__main__':
+    # 用伪造的日志文件测试，运行方式: python -m core.minecraft
+    import tempfile
+    import asyncio
+
+    def write(f, *lines):
+        for line in lines:
+            f.write(f'[12:00:00] [Server thread/INFO]: {line}\n')
+        f.flush()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'latest.log')
+        with open(path, 'w', encoding='utf-8') as f:
+            write(f, 'Starting minecraft server')
+            tailer = LogTailer(path)
+            assert tailer.poll() == []
+
+            write(f, '<Steve> 你好', 'Alex joined the game', 'Steve was slain by Zombie')
+            f.write('[12:00:01] [Server thread/INFO]: <Alex> half')
+            f.flush()
+            events = tailer.poll()
+            assert [type(e) for e in events] == [PlayerChatEvent, PlayerJoinEvent, PlayerDeathEvent]
+            assert events[0].message == '你好' and events[2].player == 'Steve'
+
+            # 不完整的行在补全后才被解析
+            f.write(' line\n')
+            f.flush()
+            events = tailer.poll()
+            assert len(events) == 1 and events[0].message == 'half line'
+
+            # 轮转，改名后写入旧文件的内容也要读到
+            os.rename(path, path + '.1')
+            write(f, '<Alex> last words')
+        with open(path, 'w', encoding='utf-8') as f:
+            write(f, 'Alex left the game')
+        events = tailer.poll()
+        assert [type(e) for e in events] == [PlayerChatEvent, PlayerLeaveEvent]
+
+        # 截断
+        with open(path, 'w', encoding='utf-8') as f:
+            write(f, '<Bob> hi')
+        events = tailer.poll()
+        assert len(events) == 1 and events[0].player == 'Bob'
+
+        # 合并转发
+        sent = []
+        class FakeContext(AdapterContext):
+            pass
+        @on(SendGroupMessageEvent).filter(lambda ctx: isinstance(ctx, FakeContext))
+        def capture(ctx):
+            sent.append((ctx.event.group_id, ctx.event.message))
+
+        async def main():
+            forwarder = ChatForwarder(FakeContext, [1, 2], max_lines=100)
+            forwarder.install()
+            for i in range(50):
+                await emit(PlayerChatEvent('', 0, '', 'Steve', f'msg {i}'))
+            await forwarder.flush()
+            assert len(sent) == 2 and sent[0][1].count('\n') == 49
+        asyncio.run(main())
+
+    print("所有测试通过！")
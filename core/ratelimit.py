@@ -0,0 +1,273 @@
+"""
+消息限流，在 Order.BLOCK 截流刷屏的用户、群和命令
+
+设计目标：
+1. 刷屏在到达耗时的插件处理器和发送队列之前就被截断
+2. 每个 key 的内存固定，长时间不活跃的 key 会被清理
+3. 超限时可以选择丢弃、延迟或者丢弃并提醒一次
+
+实现方式：
+- 滑动窗口计数：每个 key 只保存当前窗口和上一个窗口的计数，
+  估计值 = 上一个窗口计数 * 上一个窗口仍在滑动窗口内的比例 + 当前窗口计数
+- 分别按用户、群和(用户, 命令)计数，任意一个超限即视为超限；超限的消息也会计数，持续刷屏会一直被限制
+- 每隔 sweep_interval 秒清理一次空闲超过两个窗口的 key
+- delay 动作在估计值回到上限以下之前等待，等待时间超过 max_delay 时丢弃
+- warn 动作在一个 key 第一次超限时回复一次提醒，恢复之前不再提醒
+
+使用示例：
+    ```python
+    limiter = RateLimiter(user=RateLimit(10, 60), command={'pack': RateLimit(1, 60)}, action='warn')
+    limiter.install()
+    ```
+"""
+
+import logging
+from time import monotonic
+from asyncio import sleep
+from typing import Callable, Hashable, Literal
+
+from .event import Context, EventHandler, Order, on
+from .message import MessageEvent
+from .command import parse_command
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_limited = registry.counter('ratelimit_limited_total', '被限流的消息数', ['scope', 'action'])
+
+type Action = Literal['drop', 'delay', 'warn']
+
+
+class RateLimit:
+    """window 秒内最多 limit 条"""
+    __slots__ = ('limit', 'window')
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+
+    def __repr__(self):
+        return f'RateLimit({self.limit}, {self.window})'
+
+
+class _Counter:
+    __slots__ = ('start', 'current', 'previous', 'warned')
+
+    def __init__(self, now: float):
+        self.start = now
+        self.current = 0
+        self.previous = 0
+        self.warned = False
+
+    def estimate(self, now: float, window: float) -> float:
+        """推进到 now 所在的窗口，返回滑动窗口内的估计数量"""
+        elapsed = now - self.start
+        if elapsed >= window:
+            # 跳过一个窗口时上一个窗口的计数保留，跳过更多时清零
+            self.previous = self.current if elapsed < 2 * window else 0
+            self.current = 0
+            self.start += (elapsed // window) * window
+            elapsed = now - self.start
+        return self.previous * (1 - elapsed / window) + self.current
+
+    def wait_time(self, now: float, window: float, limit: int) -> float:
+        """估计值降到 limit 以下需要等待的秒数"""
+        elapsed = now - self.start
+        if self.current >= limit:
+            # 要等到下一个窗口，之后 current 成为 previous
+            excess = self.current + 1 - limit
+            return window - elapsed + window * excess / self.current
+        if not self.previous:
+            return 0.0
+        # previous * (1 - (elapsed + t) / window) + current + 1 <= limit
+        need = (self.previous * (1 - elapsed / window) + self.current + 1 - limit) / self.previous * window
+        return max(0.0, need)
+
+
+class _Scope:
+    def __init__(self, name: str, key: Callable[[MessageEvent, str | None], Hashable | None], rules: dict[str | None, RateLimit]):
+        """
+        Args:
+            key: 从事件和命令名得到计数的 key，返回 None 表示不计数
+            rules: 命令名 -> 规则，None 为默认规则
+        """
+        self.name = name
+        self.key = key
+        self.rules = rules
+        self.counters: dict[Hashable, tuple[_Counter, RateLimit]] = {}
+
+    def rule(self, command: str | None) -> RateLimit | None:
+        return self.rules.get(command) or self.rules.get(None)
+
+
+class RateLimiter:
+    def __init__(
+            self,
+            user: RateLimit | None = None,
+            group: RateLimit | None = None,
+            command: RateLimit | dict[str | None, RateLimit] | None = None,
+            action: Action = 'drop',
+            max_delay: float = 5.0,
+            warning: str = '消息太频繁了，请稍后再试',
+            exempt: Callable[[Context], bool] | None = None,
+            sweep_interval: float = 60.0,
+        ):
+        """
+        Args:
+            user: 每个用户的限制
+            group: 每个群的限制
+            command: 每个用户每个命令的限制，可以是 {命令名: 规则}，None 键为其它命令的默认规则
+            action: 超限时 drop 丢弃，delay 延迟到不超限(最多 max_delay 秒，否则丢弃)，warn 丢弃并提醒一次
+            exempt: 返回 True 的上下文不受限制，例如管理员
+        """
+        if action not in ('drop', 'delay', 'warn'):
+            raise ValueError(f'Unknown action {action}')
+        if isinstance(command, RateLimit):
+            command = {None: command}
+        self.scopes: list[_Scope] = []
+        if user is not None:
+            self.scopes.append(_Scope('user', lambda e, c: e.get('user_id'), {None: user}))
+        if group is not None:
+            self.scopes.append(_Scope('group', lambda e, c: e.get('group_id'), {None: group}))
+        if command:
+            self.scopes.append(_Scope('command', lambda e, c: None if c is None else (e.get('user_id'), c), command))
+        self.action = action
+        self.max_delay = max_delay
+        self.warning = warning
+        self.exempt = exempt
+        self.sweep_interval = sweep_interval
+        self.next_sweep = monotonic() + sweep_interval
+        self.handler: EventHandler | None = None
+
+    def hit(self, event: MessageEvent, now: float | None = None) -> tuple[float, _Scope | None, _Counter | None]:
+        """
+        记录一条消息，返回 (需要等待的秒数, 超限的范围, 超限的计数器)
+        没有超限时等待时间为 0
+        """
+        if now is None:
+            now = monotonic()
+        if now >= self.next_sweep:
+            self.sweep(now)
+        command = None
+        if any(scope.name == 'command' for scope in self.scopes):
+            parsed = parse_command(event)
+            command = parsed[0] if parsed is not None else None
+        wait, limited, limited_counter = 0.0, None, None
+        for scope in self.scopes:
+            key = scope.key(event, command)
+            if key is None:
+                continue
+            entry = scope.counters.get(key)
+            if entry is None:
+                rule = scope.rule(command)
+                if rule is None:
+                    continue
+                entry = scope.counters[key] = (_Counter(now), rule)
+            counter, rule = entry
+            if counter.estimate(now, rule.window) + 1 > rule.limit:
+                scope_wait = counter.wait_time(now, rule.window, rule.limit)
+                if limited is None or scope_wait > wait:
+                    wait, limited, limited_counter = scope_wait, scope, counter
+            else:
+                counter.warned = False
+            counter.current += 1
+        return wait, limited, limited_counter
+
+    def sweep(self, now: float):
+        """清理空闲超过两个窗口的 key"""
+        self.next_sweep = now + self.sweep_interval
+        for scope in self.scopes:
+            idle = [key for key, (counter, rule) in scope.counters.items() if now - counter.start >= 2 * rule.window]
+            for key in idle:
+                del scope.counters[key]
+
+    async def check(self, context: Context[MessageEvent]):
+        if self.exempt is not None and self.exempt(context):
+            return
+        wait, scope, counter = self.hit(context.event)
+        if scope is None:
+            return
+        if self.action == 'delay' and wait <= self.max_delay:
+            _limited.labels(scope.name, 'delay').inc()
+            await sleep(wait)
+            return
+        _limited.labels(scope.name, 'drop').inc()
+        context.stop_propagation()
+        if self.action == 'warn' and not counter.warned:
+            counter.warned = True
+            return self.warning
+
+    def install(self) -> EventHandler:
+        self.handler = on(MessageEvent).order(Order.BLOCK)
+        self.handler(self.check)
+        return self.handler
+
+    def uninstall(self):
+        if self.handler is not None:
+            self.handler.remove()
+            self.handler = None
+
+    def __len__(self):
+        return sum(len(scope.counters) for scope in self.scopes)
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.ratelimit
+    import asyncio
+    from .event import emit
+    from .message import GroupMessageEvent
+
+    def message(text: str, user_id: int = 1, group_id: int = 100):
+        return GroupMessageEvent(
+            time=0, self_id=10001, message_type='group', sub_type='normal', message_id=0,
+            user_id=user_id, message=text, raw_message=text, font=0, sender={}, group_id=group_id)
+
+    # 滑动窗口估计
+    limiter = RateLimiter(user=RateLimit(5, 10))
+    results = [limiter.hit(message('hi'), now=t)[1] is None for t in (0, 1, 2, 3, 4, 5, 6)]
+    assert results == [True] * 5 + [False] * 2, results
+    # 第 15 秒：上一个窗口 7 条 * 0.5 = 3.5，加上这条不超过 5
+    assert limiter.hit(message('hi'), now=15)[1] is None
+    wait, scope, _ = limiter.hit(message('hi'), now=15)
+    assert scope is not None and scope.name == 'user' and wait > 0
+    # 空闲 key 被清理
+    limiter.sweep(100)
+    assert len(limiter) == 0
+
+    # 命令按用户分别计数，未配置的命令使用默认规则
+    limiter = RateLimiter(command={'pack': RateLimit(1, 60), None: RateLimit(100, 60)})
+    assert limiter.hit(message('/pack'), now=0)[1] is None
+    assert limiter.hit(message('/pack'), now=1)[1] is not None
+    assert limiter.hit(message('/pack', user_id=2), now=1)[1] is None
+    assert limiter.hit(message('/ping'), now=1)[1] is None
+    assert limiter.hit(message('hello'), now=1)[1] is None
+
+    async def main():
+        handled = []
+
+        @on(MessageEvent)
+        def plugin(ctx):
+            handled.append(ctx.event.user_id)
+
+        limiter = RateLimiter(user=RateLimit(3, 60), action='warn', exempt=lambda ctx: ctx.event.user_id == 9)
+        limiter.install()
+        replies = [await emit(message('spam')) for _ in range(6)]
+        assert handled == [1, 1, 1], handled
+        # 只提醒一次
+        assert replies == [None, None, None, limiter.warning, None, None], replies
+        for _ in range(6):
+            await emit(message('spam', user_id=9))
+        assert handled.count(9) == 6
+        limiter.uninstall()
+
+        handled.clear()
+        limiter = RateLimiter(group=RateLimit(2, 0.2), action='delay', max_delay=1)
+        limiter.install()
+        start = monotonic()
+        await asyncio.gather(*(emit(message('hi', user_id=i)) for i in range(4)))
+        elapsed = monotonic() - start
+        assert len(handled) == 4 and 0.05 < elapsed < 1, (handled, elapsed)
+        limiter.uninstall()
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -0,0 +1,416 @@
+"""
+异步 RCON 客户端，向 Minecraft 服务器发送命令
+
+设计目标：
+1. 保持一个已认证的长连接，不为每条命令重新连接
+2. 兼容原版服务器；服务器能正确解析连续的包时，多条命令可以一次性写出(流水线)
+3. 正确拼接被拆分成多个包的长响应
+4. 连接断开后自动重连
+
+实现方式：
+- 每个请求带有递增的 id，读取任务按 id 把响应交给对应的 Future
+- 服务器按顺序处理请求，长响应会被拆成多个包且包中没有结束标记，
+  所以每条命令后面跟一个类型无效的结束包，服务器对它的回复到达时，前一条命令的响应就完整了
+- 原版服务器每次 read() 最多读 1460 字节并且只解析其中的第一个包，同时到达的后续包会被丢弃，
+  所以默认逐个发送：写出命令，收到它的第一个响应包后(服务器已经读完命令)再写出结束包，
+  结束包的回复到达后再写下一条命令，同一时间只有一个包在路上
+- pipeline=True 时 batch 把所有命令和结束包拼成一次写入，500 条命令只需要一个往返的时间，
+  只用于能从流中解析多个包的服务器
+- 连接断开时所有等待中的请求以 ConnectionError 失败，下一次调用时重新连接并认证
+
+使用示例：
+    ```python
+    rcon = RconClient('127.0.0.1', 25575, 'password')
+    print(await rcon.command('list'))
+    results = await rcon.batch(['say hi', 'time set day'])
+    ```
+"""
+
+import struct
+import logging
+from asyncio import (
+    Future, Lock, StreamReader, StreamWriter, Task,
+    open_connection, wait_for, gather, sleep, create_task, get_running_loop,
+)
+
+logger = logging.getLogger(__name__)
+
+TYPE_RESPONSE = 0
+TYPE_COMMAND = 2
+TYPE_AUTH = 3
+TYPE_AUTH_RESPONSE = 2
+# 客户端不应该发送 RESPONSE_VALUE，服务器会回复 `Unknown request 0`，用作结束包
+TYPE_TERMINATOR = TYPE_RESPONSE
+
+# 服务器接收缓冲区为 1460 字节，减去包头和结尾
+MAX_COMMAND_BYTES = 1446
+
+_HEADER = struct.Struct('<iii')
+
+
+class RconError(Exception):
+    pass
+
+class RconAuthError(RconError):
+    pass
+
+
+def encode_packet(request_id: int, type: int, payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload) + 10, request_id, type) + payload + b'\x00\x00'
+
+async def read_packet(reader: StreamReader) -> tuple[int, int, bytes]:
+    length, request_id, type = _HEADER.unpack(await reader.readexactly(12))
+    body = await reader.readexactly(length - 8)
+    return request_id, type, body[:-2]
+
+
+def function_commands(text: str) -> list[str]:
+    """把 .mcfunction 的内容拆分为命令"""
+    commands = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            commands.append(line.removeprefix('/'))
+    return commands
+
+
+class _Request:
+    __slots__ = ('future', 'parts', 'started')
+
+    def __init__(self, future: Future, started: Future | None = None):
+        self.future = future
+        self.parts: list[bytes] = []
+        # 逐个发送时，收到第一个响应包或连接断开时完成
+        self.started = started
+
+
+class RconClient:
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            password: str,
+            timeout: float = 10.0,
+            retry_delay: float = 1.0,
+            max_retry_delay: float = 30.0,
+            pipeline: bool = False,
+        ):
+        """
+        Args:
+            host, port, password: RCON 地址和密码
+            timeout: 连接、认证和等待响应的超时时间(秒)
+            retry_delay: 连接失败后第一次重试前等待的时间，之后每次加倍
+            max_retry_delay: 重试等待时间的上限
+            pipeline: 一次性写出所有命令，原版服务器会丢弃同一次读取中的后续包，只用于能解析连续包的服务器
+        """
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.pipeline = pipeline
+        self.reader: StreamReader | None = None
+        self.writer: StreamWriter | None = None
+        self._reader_task: Task | None = None
+        self._lock = Lock()
+        # 逐个发送时，同一时间只有一个 batch 在写
+        self._send_lock = Lock()
+        self._next_id = 0
+        self._pending: dict[int, _Request] = {}
+        # 结束包 id -> 命令 id
+        self._terminators: dict[int, int] = {}
+        self._failures = 0
+        self.connects = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def _new_id(self) -> int:
+        # 避免 -1，认证失败时服务器返回 -1
+        self._next_id = (self._next_id + 1) & 0x7fffffff
+        return self._next_id
+
+    async def connect(self):
+        """连接并认证，已连接时不做任何事"""
+        async with self._lock:
+            if self.connected:
+                return
+            if self._failures:
+                await sleep(min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay))
+            try:
+                await self._connect()
+            except RconAuthError:
+                raise
+            except (OSError, TimeoutError, EOFError) as e:
+                self._failures += 1
+                raise ConnectionError(f'Failed to connect to rcon {self.host}:{self.port}') from e
+            self._failures = 0
+
+    async def _connect(self):
+        reader, writer = await wait_for(open_connection(self.host, self.port), self.timeout)
+        try:
+            request_id = self._new_id()
+            writer.write(encode_packet(request_id, TYPE_AUTH, self.password.encode('utf-8')))
+            await writer.drain()
+            while True:
+                response_id, type, _ = await wait_for(read_packet(reader), self.timeout)
+                # 部分服务器会在认证响应前先发一个空的 RESPONSE_VALUE
+                if type == TYPE_AUTH_RESPONSE:
+                    break
+            if response_id == -1:
+                raise RconAuthError('Rcon authentication failed')
+        except BaseException:
+            writer.close()
+            raise
+        self.reader, self.writer = reader, writer
+        self.connects += 1
+        self._reader_task = create_task(self._read_loop(reader))
+        logger.info(f'Connected to rcon {self.host}:{self.port}')
+
+    async def _read_loop(self, reader: StreamReader):
+        error: BaseException = ConnectionError('Rcon connection closed')
+        try:
+            while True:
+                request_id, _, payload = await read_packet(reader)
+                request = self._pending.get(request_id)
+                if request is not None:
+                    request.parts.append(payload)
+                    if request.started is not None and not request.started.done():
+                        request.started.set_result(None)
+                    continue
+                command_id = self._terminators.pop(request_id, None)
+                if command_id is None:
+                    continue
+                request = self._pending.pop(command_id, None)
+                if request is not None and not request.future.done():
+                    request.future.set_result(b''.join(request.parts).decode('utf-8', 'replace'))
+        except (OSError, EOFError) as e:
+            error = ConnectionError(f'Rcon connection lost: {e!r}')
+        except Exception as e:
+            logger.error('Unexpected rcon packet', exc_info=True)
+            error = RconError(str(e))
+        finally:
+            # 超时等情况下连接已经被断开，可能已经建立了新的连接
+            if self.reader is reader:
+                self._reader_task = None
+                self._disconnect(error)
+
+    def _disconnect(self, error: BaseException):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        pending, self._pending = self._pending, {}
+        self._terminators.clear()
+        for request in pending.values():
+            if not request.future.done():
+                request.future.set_exception(error)
+            if request.started is not None and not request.started.done():
+                request.started.set_result(None)
+
+    def _request(self, started: Future | None = None) -> tuple[int, int, _Request]:
+        """登记一条命令，返回 (命令 id, 结束包 id, 请求)"""
+        command_id = self._new_id()
+        terminator_id = self._new_id()
+        request = _Request(get_running_loop().create_future(), started)
+        self._pending[command_id] = request
+        self._terminators[terminator_id] = command_id
+        return command_id, terminator_id, request
+
+    def _encode(self, payloads: list[bytes]) -> tuple[bytes, list[Future]]:
+        """为每条命令编码命令包和结束包，并登记等待的 Future"""
+        packets = []
+        futures = []
+        for payload in payloads:
+            command_id, terminator_id, request = self._request()
+            futures.append(request.future)
+            packets.append(encode_packet(command_id, TYPE_COMMAND, payload))
+            packets.append(encode_packet(terminator_id, TYPE_TERMINATOR, b''))
+        return b''.join(packets), futures
+
+    async def _send_each(self, payloads: list[bytes]) -> list[str]:
+        """逐个发送，保证服务器的每次读取中只有一个包"""
+        results = []
+        async with self._send_lock:
+            for payload in payloads:
+                writer = self.writer
+                if writer is None:
+                    raise ConnectionError('Rcon connection closed')
+                command_id, terminator_id, request = self._request(get_running_loop().create_future())
+                try:
+                    writer.write(encode_packet(command_id, TYPE_COMMAND, payload))
+                    await writer.drain()
+                    await wait_for(request.started, self.timeout)
+                    if not request.future.done():
+                        writer.write(encode_packet(terminator_id, TYPE_TERMINATOR, b''))
+                        await writer.drain()
+                    results.append(await wait_for(request.future, self.timeout))
+                except BaseException:
+                    # 不再等待这条命令，之后到达的响应直接丢弃；断开连接时设置的异常不需要再被取出
+                    self._pending.pop(command_id, None)
+                    self._terminators.pop(terminator_id, None)
+                    if not request.future.done():
+                        request.future.cancel()
+                    elif not request.future.cancelled():
+                        request.future.exception()
+                    raise
+        return results
+
+    async def batch(self, commands: list[str]) -> list[str]:
+        """执行多条命令，按顺序返回每条命令的响应"""
+        if not commands:
+            return []
+        payloads = [command.encode('utf-8') for command in commands]
+        for command, payload in zip(commands, payloads):
+            if len(payload) > MAX_COMMAND_BYTES:
+                raise ValueError(f'Rcon command too long ({len(payload)} bytes): {command[:50]}...')
+        await self.connect()
+        try:
+            if not self.pipeline:
+                return await self._send_each(payloads)
+            data, futures = self._encode(payloads)
+            self.writer.write(data)
+            await self.writer.drain()
+            return list(await wait_for(gather(*futures), self.timeout + len(commands) * 0.01))
+        except TimeoutError:
+            # 服务器没有响应，连接可能已经失效，断开后下次调用时重新连接
+            self._disconnect(ConnectionError('Rcon request timed out'))
+            raise
+
+    async def command(self, command: str) -> str:
+        return (await self.batch([command]))[0]
+
+    async def run_function(self, text: str) -> list[str]:
+        """执行数据包函数(.mcfunction)的内容，忽略空行和注释"""
+        return await self.batch(function_commands(text))
+
+    def close(self):
+        self._disconnect(ConnectionError('Rcon client closed'))
+
+
+if __name__ == '__main__':
+    # 用本地的模拟服务器测试，运行方式: python -m core.rcon
+    import asyncio
+    from time import perf_counter
+    from functools import partial
+    from asyncio import start_server, IncompleteReadError
+
+    PASSWORD = 'secret'
+    FRAGMENT = 4096
+
+    async def handle(reader: StreamReader, writer: StreamWriter, vanilla: bool = True):
+        """
+        模拟 Minecraft 的 RCON：按顺序处理请求，长响应按 4096 字节拆包
+        vanilla 时和原版一样每次最多读 1460 字节，只解析其中的第一个包
+        """
+        authed = False
+        try:
+            while True:
+                if vanilla:
+                    data = await reader.read(1460)
+                    if not data:
+                        raise IncompleteReadError(b'', 12)
+                    length, request_id, type = _HEADER.unpack_from(data)
+                    payload = data[12:length + 2]
+                else:
+                    request_id, type, payload = await read_packet(reader)
+                if type == TYPE_AUTH:
+                    authed = payload.decode() == PASSWORD
+                    writer.write(encode_packet(request_id if authed else -1, TYPE_AUTH_RESPONSE, b''))
+                elif type == TYPE_COMMAND and authed:
+                    command = payload.decode()
+                    if command == 'disconnect':
+                        writer.close()
+                        return
+                    if command == 'slow':
+                        await asyncio.sleep(0.1)
+                    if command.startswith('big '):
+                        result = b'x' * int(command[4:])
+                    else:
+                        result = f'ok: {command}'.encode()
+                    for i in range(0, max(len(result), 1), FRAGMENT):
+                        writer.write(encode_packet(request_id, TYPE_RESPONSE, result[i:i + FRAGMENT]))
+                else:
+                    writer.write(encode_packet(request_id, TYPE_RESPONSE, f'Unknown request {type:x}'.encode()))
+                await writer.drain()
+        except IncompleteReadError:
+            writer.close()
+
+    async def main():
+        server = await start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        try:
+            await RconClient('127.0.0.1', port, 'wrong').command('list')
+            assert False
+        except RconAuthError:
+            pass
+
+        rcon = RconClient('127.0.0.1', port, PASSWORD, retry_delay=0.01)
+        assert await rcon.command('list') == 'ok: list'
+
+        # 长响应拼接
+        results = await rcon.batch(['big 10000', 'say a', 'big 4096', 'big 0'])
+        assert len(results[0]) == 10000 and results[1] == 'ok: say a' and len(results[2]) == 4096, results
+        assert results[3] == ''
+
+        # 逐个发送数据包函数，并发的 batch 不会交错
+        function = '# test\n' + '\n'.join(f'/setblock {i} 64 0 stone' for i in range(500))
+        start = perf_counter()
+        results, other = await asyncio.gather(rcon.run_function(function), rcon.batch(['say b'] * 10))
+        assert len(results) == 500 and results[-1] == 'ok: setblock 499 64 0 stone'
+        assert other == ['ok: say b'] * 10
+        print(f'逐个发送 500 条命令耗时 {(perf_counter() - start) * 1000:.1f}ms')
+
+        # 取消等待中的命令不会留下登记，迟到的响应被丢弃
+        task = asyncio.create_task(rcon.command('slow'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+            assert False
+        except asyncio.CancelledError:
+            pass
+        assert not rcon._pending and not rcon._terminators
+        assert await rcon.command('list') == 'ok: list' and rcon.connects == 1
+        assert not rcon._pending and not rcon._terminators
+
+        # 断线后自动重连
+        try:
+            await rcon.command('disconnect')
+            assert False
+        except ConnectionError:
+            pass
+        assert await rcon.command('list') == 'ok: list' and rcon.connects == 2
+        rcon.close()
+
+        # 流水线会让原版服务器丢包
+        rcon = RconClient('127.0.0.1', port, PASSWORD, timeout=0.2, pipeline=True)
+        try:
+            await rcon.batch(['say a', 'say b'])
+            assert False
+        except TimeoutError:
+            pass
+        rcon.close()
+        server.close()
+        await server.wait_closed()
+
+        # 能解析连续包的服务器可以使用流水线
+        server = await start_server(partial(handle, vanilla=False), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        rcon = RconClient('127.0.0.1', port, PASSWORD, pipeline=True)
+        start = perf_counter()
+        results = await rcon.run_function(function)
+        assert len(results) == 500 and results[-1] == 'ok: setblock 499 64 0 stone'
+        print(f'流水线 500 条命令耗时 {(perf_counter() - start) * 1000:.1f}ms')
+
+        rcon.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -0,0 +1,110 @@
+"""
+模块热重载，监视模块目录并在文件变化时重载对应模块
+
+设计目标:
+    - 在不重启进程的前提下更新插件，避免断开连接和重放积压消息
+    - 只重载发生变化的模块和依赖它们的模块
+
+实现方式:
+    - 定时轮询目录下 .py 文件的 mtime，不依赖 inotify 等平台特性
+    - 修改过的模块交给 ModuleManager.reload_modules 统一处理
+    - 新增的文件按正常流程加载，被删除的文件对应的模块会被停止并卸载
+    - 导入失败的模块在文件再次修改时重新加载
+
+使用示例:
+    ```python
+    watcher = Watcher(manager, ['adapters', 'mods'])
+    asyncio.create_task(watcher.run())
+    ```
+"""
+
+import asyncio
+import os
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher:
+    def __init__(self, manager, dirs: list[str], interval: float = 1.0):
+        """
+        Args:
+            manager: 模块管理器 ModuleManager
+            dirs: 被监视的目录，与 load_mods 使用的目录一致
+            interval: 轮询间隔(秒)
+        """
+        self.manager = manager
+        self.dirs = dirs
+        self.interval = interval
+        self.running = False
+        self.mtimes = self.scan()
+        # start() 可能长期运行(例如适配器)，放到任务里执行，避免阻塞轮询
+        self.tasks: set[asyncio.Task] = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def scan(self) -> dict[str, tuple[str, int]]:
+        """返回 {模块路径: (目录, mtime)}"""
+        from . import to_module_path
+
+        result = {}
+        for dir_path in self.dirs:
+            try:
+                entries = list(os.scandir(dir_path))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.endswith('.py') and not entry.name.startswith('_'):
+                    result[to_module_path(dir_path, entry.name)] = (dir_path, entry.stat().st_mtime_ns)
+        return result
+
+    async def check(self):
+        """对比一次文件状态并处理变化"""
+        current = self.scan()
+        old = self.mtimes
+        self.mtimes = current
+
+        removed = old.keys() - current.keys()
+        added = current.keys() - old.keys()
+        modified = [module_path for module_path in current.keys() & old.keys()
+                    if current[module_path][1] != old[module_path][1]]
+
+        for module_path in removed:
+            self._spawn(self.manager.remove_module(module_path))
+
+        changed = []
+        for module_path in modified:
+            if module_path in self.manager.lazy_modules:
+                # 还没有真正加载的模块只需要重新读取 manifest
+                self.manager.unload_module(module_path)
+                added.add(module_path)
+            else:
+                changed.append(module_path)
+        if changed:
+            logger.info(f"Modules changed: {', '.join(sorted(changed))}")
+            self._spawn(self.manager.reload_modules(changed))
+
+        for module_path in added:
+            dir_path = current[module_path][0]
+            file_path = os.path.join(dir_path, module_path.rpartition('.')[2] + '.py')
+            if self.manager.lazy and self.manager.register_lazy(module_path, file_path):
+                continue
+            self._spawn(self.manager.load_module(module_path))
+
+    async def run(self):
+        """持续轮询，直到 stop 被调用"""
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.error("Error in module watcher")
+                logger.error(traceback.format_exc())
+
+    def stop(self):
+        self.running = False
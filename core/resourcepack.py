@@ -0,0 +1,388 @@
+"""
+增量资源包打包，只重新压缩变化的文件
+
+设计目标：
+1. 400MB 的资源包改动一张贴图后，几秒内完成重新打包
+2. 打包结果是确定的，内容不变时 SHA-1 也不变
+3. 打包不阻塞事件循环
+
+实现方式：
+- 清单(<输出>.manifest.json)记录每个文件的大小、修改时间、SHA-1，以及它在上一次输出的 zip 中压缩后数据的位置
+- 大小和修改时间都没变的文件直接视为未变化，不读取内容
+- 其它文件在进程池中读取并计算 SHA-1，内容没变时只返回哈希，变化的文件才压缩
+- 写入新 zip 时，未变化的文件直接从旧 zip 复制已经压缩好的数据，不解压也不重新压缩
+- zip 由本模块直接写出(文件头、数据、中央目录)，写出的同时计算整个文件的 SHA-1，不需要再读一遍
+- 多个源目录按顺序合并，后面的目录覆盖前面同名的文件，用于合并上传的资源包文件
+- 内容有变化时版本号加一
+
+不支持 zip64，文件数超过 65535 或大小超过 4GB 时抛出 ValueError
+
+使用示例：
+    ```python
+    builder = PackBuilder(['packs/base', 'packs/uploads'], 'data/pack/pack.zip')
+    result = await builder.build()
+    print(result.sha1, result.version)
+    ```
+"""
+
+import os
+import json
+import zlib
+import struct
+import hashlib
+import logging
+import multiprocessing
+from time import perf_counter
+from asyncio import Lock, gather, to_thread, get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STORED = 0
+DEFLATED = 8
+
+# 固定的时间戳 1980-01-01 00:00，保证相同内容得到相同的 zip
+_DOS_TIME = 0
+_DOS_DATE = (0 << 9) | (1 << 5) | 1
+_UTF8_FLAG = 0x800
+
+_LOCAL = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END = struct.Struct('<IHHHHIIH')
+
+# 每个进程池任务处理的文件总大小上限
+BATCH_BYTES = 8 << 20
+BATCH_FILES = 256
+COPY_CHUNK = 1 << 20
+
+
+def _process_file(path: str, known_sha1: str | None, level: int) -> tuple:
+    """
+    在子进程中执行：计算 SHA-1，内容与 known_sha1 相同时不压缩
+    返回 (sha1, size, crc, method, data)，未变化时 data 为 None
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    sha1 = hashlib.sha1(raw).hexdigest()
+    if sha1 == known_sha1:
+        return sha1, len(raw), 0, 0, None
+    crc = zlib.crc32(raw)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(raw) + compressor.flush()
+    if len(data) >= len(raw):
+        return sha1, len(raw), crc, STORED, raw
+    return sha1, len(raw), crc, DEFLATED, data
+
+def _process_batch(items: list[tuple[str, str | None]], level: int) -> list[tuple]:
+    return [_process_file(path, known_sha1, level) for path, known_sha1 in items]
+
+
+class BuildResult:
+    def __init__(self, path: str, sha1: str, version: int, size: int, files: int,
+                 compressed: int, reused: int, removed: int, seconds: float):
+        self.path = path
+        self.sha1 = sha1
+        self.version = version
+        self.size = size
+        self.files = files
+        # 重新压缩的文件数
+        self.compressed = compressed
+        # 复用旧压缩数据的文件数
+        self.reused = reused
+        self.removed = removed
+        self.seconds = seconds
+
+    @property
+    def changed(self) -> bool:
+        return self.compressed > 0 or self.removed > 0
+
+    def __repr__(self):
+        return (f'BuildResult(v{self.version}, {self.sha1[:8]}, files={self.files}, '
+                f'compressed={self.compressed}, reused={self.reused}, removed={self.removed}, '
+                f'{self.seconds:.2f}s)')
+
+
+class _HashWriter:
+    """写入文件的同时计算 SHA-1 并记录位置"""
+    def __init__(self, f):
+        self.f = f
+        self.sha1 = hashlib.sha1()
+        self.pos = 0
+
+    def write(self, data: bytes):
+        self.f.write(data)
+        self.sha1.update(data)
+        self.pos += len(data)
+
+
+class PackBuilder:
+    def __init__(self, sources: list[str] | str, output: str, level: int = 6, workers: int | None = None):
+        """
+        Args:
+            sources: 源目录，多个目录时后面的覆盖前面的
+            output: 输出的 zip 路径，清单保存在旁边的 .manifest.json
+            level: 压缩等级
+            workers: 压缩进程数，默认为 CPU 数
+        """
+        self.sources = [sources] if isinstance(sources, str) else list(sources)
+        self.output = output
+        self.manifest_path = output + '.manifest.json'
+        self.level = level
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = Lock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 入口脚本没有 __main__ 保护，不能使用 spawn；
+            # forkserver 只预加载本模块，避免在有其它线程的进程中 fork
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # 清单
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'version': 0, 'output': None, 'files': {}}
+
+    def _save_manifest(self, manifest: dict):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.manifest_path)
+
+    def _output_valid(self, manifest: dict) -> bool:
+        """旧 zip 是否还是清单记录的那一个，只有这样才能复用其中的数据"""
+        info = manifest.get('output')
+        if not info:
+            return False
+        try:
+            st = os.stat(self.output)
+        except FileNotFoundError:
+            return False
+        return st.st_size == info['size'] and st.st_mtime_ns == info['mtime_ns']
+
+    # 打包
+
+    def _scan(self) -> dict[str, tuple[str, os.stat_result]]:
+        """相对路径 -> (绝对路径, stat)，后面的源目录覆盖前面的"""
+        files = {}
+        output = os.path.abspath(self.output)
+        for source in self.sources:
+            source = os.path.abspath(source)
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if path == output or path.startswith(output + '.'):
+                        continue
+                    rel = os.path.relpath(path, source).replace(os.sep, '/')
+                    files[rel] = (path, os.stat(path))
+        return files
+
+    async def _process(self, items: list[tuple[str, str | None]]) -> list[tuple]:
+        """把文件分批交给进程池处理，按原顺序返回结果"""
+        loop = get_running_loop()
+        batches, batch, batch_bytes = [], [], 0
+        for path, known_sha1, size in items:
+            batch.append((path, known_sha1))
+            batch_bytes += size
+            if batch_bytes >= BATCH_BYTES or len(batch) >= BATCH_FILES:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+        if batch:
+            batches.append(batch)
+        results = await gather(*(
+            loop.run_in_executor(self.pool, _process_batch, batch, self.level) for batch in batches
+        ))
+        return [result for batch_result in results for result in batch_result]
+
+    async def build(self, force: bool = False) -> BuildResult:
+        """
+        增量打包，force 为 True 时忽略清单重新压缩所有文件
+        同一时间只会进行一次打包
+        """
+        async with self._lock:
+            start = perf_counter()
+            manifest = await to_thread(self.load_manifest)
+            reusable = not force and await to_thread(self._output_valid, manifest)
+            old_files: dict = manifest['files'] if reusable else {}
+            files = await to_thread(self._scan)
+
+            entries: dict[str, dict] = {}
+            pending: list[tuple[str, str | None, int]] = []
+            pending_names: list[str] = []
+            for rel, (path, st) in files.items():
+                old = old_files.get(rel)
+                if old is not None and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                    entries[rel] = dict(old)
+                else:
+                    pending.append((path, old['sha1'] if old is not None else None, st.st_size))
+                    pending_names.append(rel)
+
+            new_data: dict[str, bytes] = {}
+            compressed = 0
+            for rel, (sha1, size, crc, method, data) in zip(pending_names, await self._process(pending)):
+                st = files[rel][1]
+                if data is None:
+                    # 只是修改时间变了
+                    entry = dict(old_files[rel])
+                else:
+                    entry = {'sha1': sha1, 'crc': crc, 'method': method, 'csize': len(data), 'offset': None}
+                    new_data[rel] = data
+                    compressed += 1
+                entry.update(size=size, mtime_ns=st.st_mtime_ns)
+                entries[rel] = entry
+
+            removed = len(old_files.keys() - files.keys())
+            sha1, size = await to_thread(self._write, entries, new_data, reusable)
+            # 只有内容变化时才升级版本，force 或输出文件丢失后重新打包出相同的内容时不变
+            previous = (manifest.get('output') or {}).get('sha1')
+            version = manifest['version'] + (sha1 != previous)
+            st = await to_thread(os.stat, self.output)
+            manifest = {
+                'version': version,
+                'output': {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1},
+                'files': entries,
+            }
+            await to_thread(self._save_manifest, manifest)
+            result = BuildResult(self.output, sha1, version, size, len(entries), compressed,
+                                 len(entries) - compressed, removed, perf_counter() - start)
+            logger.info(f'Built resource pack {result}')
+            return result
+
+    def _write(self, entries: dict[str, dict], new_data: dict[str, bytes], reusable: bool) -> tuple[str, int]:
+        """写出 zip，返回 (SHA-1, 大小)；entries 中的 offset 被更新为新 zip 中数据的位置"""
+        if len(entries) >= 0xffff:
+            raise ValueError(f'Too many files for zip without zip64: {len(entries)}')
+        os.makedirs(os.path.dirname(os.path.abspath(self.output)), exist_ok=True)
+        tmp = self.output + '.tmp'
+        old = open(self.output, 'rb') if reusable and os.path.exists(self.output) else None
+        try:
+            with open(tmp, 'wb') as f:
+                out = _HashWriter(f)
+                central = []
+                for rel in sorted(entries):
+                    entry = entries[rel]
+                    name = rel.encode('utf-8')
+                    header_offset = out.pos
+                    if header_offset >= 0xffffffff or entry['size'] >= 0xffffffff:
+                        raise ValueError('Resource pack too large for zip without zip64')
+                    out.write(_LOCAL.pack(
+                        0x04034b50, 20, _UTF8_FLAG, entry['method'], _DOS_TIME, _DOS_DATE,
+                        entry['crc'], entry['csize'], entry['size'], len(name), 0,
+                    ) + name)
+                    data_offset = out.pos
+                    data = new_data.get(rel)
+                    if data is not None:
+                        out.write(data)
+                    else:
+                        # 从旧 zip 复制压缩好的数据
+                        old.seek(entry['offset'])
+                        remaining = entry['csize']
+                        while remaining:
+                            chunk = old.read(min(COPY_CHUNK, remaining))
+                            if not chunk:
+                                raise EOFError(f'Old resource pack is truncated at {rel}')
+                            out.write(chunk)
+                            remaining -= len(chunk)
+                    entry['offset'] = data_offset
+                    central.append(_CENTRAL.pack(
+                        0x02014b50, 20, 20, _UTF8_FLAG, entry['method'], _DOS_TIME, _DOS_DATE,
+                        entry['crc'], entry['csize'], entry['size'], len(name), 0, 0, 0, 0, 0,
+                        header_offset,
+                    ) + name)
+                central_offset = out.pos
+                for record in central:
+                    out.write(record)
+                out.write(_END.pack(
+                    0x06054b50, 0, 0, len(central), len(central), out.pos - central_offset, central_offset, 0,
+                ))
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if old is not None:
+                old.close()
+        os.replace(tmp, self.output)
+        return out.sha1.hexdigest(), out.pos
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.resourcepack
+    import random
+    import asyncio
+    import zipfile
+    import tempfile
+
+    async def main():
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'base')
+            uploads = os.path.join(tmp, 'uploads')
+            rng = random.Random(0)
+            for i in range(2000):
+                path = os.path.join(base, 'assets', 'minecraft', 'textures', f'block_{i}.png')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    # 一半可压缩，一半不可压缩
+                    f.write(rng.randbytes(20000) if i % 2 else bytes(20000))
+            with open(os.path.join(base, 'pack.mcmeta'), 'w') as f:
+                f.write('{"pack": {"pack_format": 15, "description": "test"}}')
+            os.makedirs(uploads)
+            with open(os.path.join(uploads, 'pack.mcmeta'), 'w') as f:
+                f.write('{"pack": {"pack_format": 15, "description": "merged"}}')
+
+            output = os.path.join(tmp, 'out', 'pack.zip')
+            builder = PackBuilder([base, uploads], output)
+            first = await builder.build()
+            print(first)
+            assert first.compressed == 2001 and first.version == 1
+            assert hashlib.sha1(open(output, 'rb').read()).hexdigest() == first.sha1
+            with zipfile.ZipFile(output) as z:
+                assert z.testzip() is None
+                assert b'merged' in z.read('pack.mcmeta')
+
+            # 没有变化
+            second = await builder.build()
+            print(second)
+            assert second.compressed == 0 and second.sha1 == first.sha1 and second.version == 1
+
+            # 只修改时间变化
+            os.utime(os.path.join(base, 'pack.mcmeta'))
+            third = await builder.build()
+            assert third.compressed == 0 and third.sha1 == first.sha1
+
+            # 修改一张贴图，删除一张
+            with open(os.path.join(base, 'assets/minecraft/textures/block_7.png'), 'wb') as f:
+                f.write(b'changed' * 1000)
+            os.remove(os.path.join(base, 'assets/minecraft/textures/block_8.png'))
+            fourth = await builder.build()
+            print(fourth)
+            assert fourth.compressed == 1 and fourth.removed == 1 and fourth.version == 2
+            assert hashlib.sha1(open(output, 'rb').read()).hexdigest() == fourth.sha1
+            with zipfile.ZipFile(output) as z:
+                assert z.testzip() is None
+                assert z.read('assets/minecraft/textures/block_7.png') == b'changed' * 1000
+                assert 'assets/minecraft/textures/block_8.png' not in z.namelist()
+
+            # 与完整重新打包的结果相同
+            full = await builder.build(force=True)
+            assert full.sha1 == fourth.sha1 and full.version == fourth.version
+            # 输出文件丢失时重新打包，内容相同版本不变
+            os.remove(output)
+            rebuilt = await builder.build()
+            assert rebuilt.compressed == 2000 and rebuilt.sha1 == fourth.sha1 and rebuilt.version == fourth.version
+            builder.close()
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -0,0 +1,291 @@
+"""
+启动性能分析，记录每个模块的导入和 start() 开销
+
+设计目标:
+    - 找出 core.start 的时间花在哪里
+    - 找出在 start() 中同步阻塞事件循环的模块
+
+记录内容:
+    - 导入耗时(墙钟时间)和导入期间的内存增量
+    - 嵌套导入树，类似 `python -X importtime`，区分自身耗时和累计耗时
+    - start() 总耗时、同步执行的总时间、最长的一次同步执行及内存增量
+
+实现方式:
+    - 在 sys.meta_path 最前面插入一个查找器，包装其它查找器返回的 loader，
+      在 exec_module 前后计时，借助调用栈得到嵌套关系
+    - 把 start() 协程包装成逐步驱动的 awaitable，每一步 send 都是一段不让出事件循环的同步执行，
+      对每一步计时和统计内存，因此即使多个模块并发启动也能准确归属
+    - 内存使用 tracemalloc 统计，只在分析期间开启
+
+输出:
+    - 按开销排序的文本报告
+    - Chrome trace 格式的 json，可以在 chrome://tracing 或 Perfetto 中打开
+
+使用示例:
+    ```python
+    asyncio.run(core.start(profile=True))
+    ```
+"""
+
+import sys
+import os
+import json
+import logging
+import tracemalloc
+from time import perf_counter_ns
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+
+logger = logging.getLogger(__name__)
+
+
+class ImportNode:
+    """导入树中的一个节点"""
+    def __init__(self, name: str, start: int):
+        self.name = name
+        self.start = start
+        self.end = start
+        self.children: list[ImportNode] = []
+
+    @property
+    def cumulative(self) -> int:
+        return self.end - self.start
+
+    @property
+    def self_time(self) -> int:
+        return self.cumulative - sum(child.cumulative for child in self.children)
+
+
+class ModuleRecord:
+    """单个模块的启动记录，时间单位为纳秒"""
+    def __init__(self, module_path: str):
+        self.module_path = module_path
+        self.import_start = 0
+        self.import_time = 0
+        self.import_memory = 0
+        self.imports: list[ImportNode] = []
+        self.start_begin = 0
+        self.start_time: int | None = None  # None 表示 start() 还没有结束
+        self.busy_time = 0
+        self.max_step = 0
+        self.start_memory = 0
+        # (开始时间, 耗时)
+        self.steps: list[tuple[int, int]] = []
+
+    @property
+    def cost(self) -> int:
+        return self.import_time + self.busy_time
+
+
+class _TimedLoader:
+    """包装 loader，在执行模块代码前后记录导入树"""
+    def __init__(self, loader, profiler: 'StartupProfiler'):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        profiler = self._profiler
+        if not profiler.active:
+            return self._loader.exec_module(module)
+        node = ImportNode(module.__name__, perf_counter_ns())
+        parent = profiler._stack[-1] if profiler._stack else None
+        (parent.children if parent else profiler._roots).append(node)
+        profiler._stack.append(node)
+        try:
+            return self._loader.exec_module(module)
+        finally:
+            node.end = perf_counter_ns()
+            profiler._stack.pop()
+
+
+class _ImportTimer(MetaPathFinder):
+    def __init__(self, profiler: 'StartupProfiler'):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self.profiler)
+        return spec
+
+
+class _TimedStart:
+    """逐步驱动 start() 协程，对每一段同步执行计时"""
+    def __init__(self, profiler: 'StartupProfiler', record: ModuleRecord, coro):
+        self.profiler = profiler
+        self.record = record
+        self.coro = coro
+
+    def __await__(self):
+        profiler, record, coro = self.profiler, self.record, self.coro
+        value, error = None, None
+        while True:
+            measuring = profiler.active
+            if measuring:
+                begin = perf_counter_ns()
+                memory = tracemalloc.get_traced_memory()[0]
+            try:
+                if error is None:
+                    yielded = coro.send(value)
+                else:
+                    yielded = coro.throw(error)
+            except StopIteration as e:
+                record.start_time = perf_counter_ns() - record.start_begin
+                return e.value
+            except BaseException:
+                record.start_time = perf_counter_ns() - record.start_begin
+                raise
+            finally:
+                if measuring:
+                    step = perf_counter_ns() - begin
+                    record.steps.append((begin, step))
+                    record.busy_time += step
+                    record.max_step = max(record.max_step, step)
+                    record.start_memory += tracemalloc.get_traced_memory()[0] - memory
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class StartupProfiler:
+    def __init__(self, block_threshold: float = 0.05, window: float = 10):
+        """
+        Args:
+            block_threshold: start() 单次同步执行超过该时间(秒)视为阻塞事件循环
+            window: 写报告前最多等待 start() 完成的时间(秒)，适配器的 start 通常不会结束
+        """
+        self.block_threshold = int(block_threshold * 1e9)
+        self.window = window
+        self.records: dict[str, ModuleRecord] = {}
+        self.active = False
+        self.origin = 0
+        self._finder = _ImportTimer(self)
+        self._roots: list[ImportNode] = []
+        self._stack: list[ImportNode] = []
+        self._started_tracemalloc = False
+
+    def install(self):
+        """开始记录"""
+        self.origin = perf_counter_ns()
+        sys.meta_path.insert(0, self._finder)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.active = True
+
+    def uninstall(self):
+        """停止记录，已经被包装的 loader 和 start 之后不再计时"""
+        self.active = False
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _record(self, module_path: str) -> ModuleRecord:
+        return self.records.setdefault(module_path, ModuleRecord(module_path))
+
+    @contextmanager
+    def importing(self, module_path: str):
+        """包围 import_module，记录导入耗时、内存和嵌套导入"""
+        record = self._record(module_path)
+        roots = len(self._roots)
+        memory = tracemalloc.get_traced_memory()[0]
+        record.import_start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            record.import_time = perf_counter_ns() - record.import_start
+            record.import_memory = tracemalloc.get_traced_memory()[0] - memory
+            record.imports = self._roots[roots:]
+
+    def starting(self, module_path: str, coro):
+        """包装 start() 协程，返回一个 awaitable"""
+        record = self._record(module_path)
+        record.start_begin = perf_counter_ns()
+        return _TimedStart(self, record, coro)
+
+    def warn_blocking(self):
+        for record in self.records.values():
+            if record.max_step >= self.block_threshold:
+                logger.warning(
+                    f"Module {record.module_path} blocked the event loop for "
+                    f"{record.max_step / 1e6:.1f}ms during start()")
+
+    def report(self) -> str:
+        """生成按开销排序的文本报告"""
+        lines = [
+            f"{'module':<32} {'import':>9} {'imp mem':>9} {'start':>9} {'busy':>9} {'max step':>9} {'start mem':>10}",
+        ]
+        ms = lambda ns: f"{ns / 1e6:.1f}ms"
+        kib = lambda b: f"{b / 1024:.0f}KiB"
+        records = sorted(self.records.values(), key=lambda r: r.cost, reverse=True)
+        for r in records:
+            start = 'running' if r.start_time is None else ms(r.start_time)
+            flag = ' !' if r.max_step >= self.block_threshold else ''
+            lines.append(
+                f"{r.module_path:<32} {ms(r.import_time):>9} {kib(r.import_memory):>9} {start:>9} "
+                f"{ms(r.busy_time):>9} {ms(r.max_step):>9} {kib(r.start_memory):>10}{flag}")
+
+        lines.append('')
+        lines.append('import time: self [us] | cumulative [us] | module')
+        def walk(node: ImportNode, depth: int):
+            lines.append(f"{node.self_time // 1000:>10} | {node.cumulative // 1000:>10} | {'  ' * depth}{node.name}")
+            for child in node.children:
+                walk(child, depth + 1)
+        for r in records:
+            for node in r.imports:
+                walk(node, 0)
+        return '\n'.join(lines)
+
+    def chrome_trace(self) -> dict:
+        """生成 Chrome trace 格式的数据"""
+        us = lambda ns: (ns - self.origin) / 1000
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 1, 'args': {'name': 'import'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 2, 'args': {'name': 'event loop (start steps)'}},
+        ]
+        def walk(node: ImportNode):
+            events.append({'name': node.name, 'cat': 'import', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': us(node.start), 'dur': node.cumulative / 1000})
+            for child in node.children:
+                walk(child)
+        for tid, r in enumerate(self.records.values(), start=3):
+            for node in r.imports:
+                walk(node)
+            for begin, step in r.steps:
+                events.append({'name': r.module_path, 'cat': 'start', 'ph': 'X', 'pid': 1, 'tid': 2,
+                               'ts': us(begin), 'dur': step / 1000})
+            if r.start_begin:
+                end = r.start_begin + r.start_time if r.start_time is not None else perf_counter_ns()
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                               'args': {'name': r.module_path}})
+                events.append({'name': f"{r.module_path}.start", 'cat': 'start', 'ph': 'X', 'pid': 1, 'tid': tid,
+                               'ts': us(r.start_begin), 'dur': (end - r.start_begin) / 1000,
+                               'args': {'busy_ms': r.busy_time / 1e6, 'max_step_ms': r.max_step / 1e6}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, dir_path: str = 'logs'):
+        """写出文本报告和 trace 文件"""
+        os.makedirs(dir_path, exist_ok=True)
+        report_file = os.path.join(dir_path, 'startup_profile.txt')
+        trace_file = os.path.join(dir_path, 'startup_trace.json')
+        with open(report_file, 'w', encoding='utf-8') as f:
+            f.write(self.report() + '\n')
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        logger.info(f"Startup profile written to {report_file} and {trace_file}")
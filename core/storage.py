@@ -0,0 +1,425 @@
+"""
+基于 sqlite3 的存储引擎，用于数据量大或需要查询的插件数据
+
+设计目标：
+1. 每秒数千次持久化写入，不阻塞事件循环
+2. 插件之间的数据互相隔离
+3. 只依赖标准库
+
+实现方式：
+- 数据库使用 WAL 模式，读写互不阻塞
+- 一个专用写线程持有唯一的写连接，从队列中取出所有协程提交的写操作，
+  每一轮(tick)合并为一个事务提交，提交后才通知等待的协程，因此返回即已持久化
+- 每个写操作包在 SAVEPOINT 中，单个操作失败只回滚它自己，不影响同一事务中的其它操作
+- 读操作在线程池中执行，每个读线程持有自己的只读连接
+- 每个插件通过 namespace 获得独立的键值存储和带前缀的表
+
+使用示例：
+    ```python
+    from core.storage import database
+
+    counters = database.namespace('counter')
+    await counters.incr(f'user/{user_id}')
+
+    rules = counters.table('rules', 'id INTEGER PRIMARY KEY, pattern TEXT, reply TEXT', indexes=['pattern'])
+    await rules.create()
+    await rules.insert({'pattern': 'hi', 'reply': 'hello'})
+    rows = await rules.select('pattern = ?', ('hi',))
+    ```
+"""
+
+import os
+import re
+import json
+import sqlite3
+import atexit
+import logging
+import threading
+from queue import Queue, Empty
+from time import monotonic
+from typing import Any, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from asyncio import Future, get_running_loop
+
+logger = logging.getLogger(__name__)
+
+_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _check_name(name: str) -> str:
+    if not _NAME.fullmatch(name):
+        raise ValueError(f"Invalid name: {name!r}")
+    return name
+
+
+class Result:
+    """写操作的结果"""
+    def __init__(self, rows: list[tuple] | None, lastrowid: int | None, rowcount: int):
+        self.rows = rows
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+    def __repr__(self):
+        return f'Result(rows={self.rows}, lastrowid={self.lastrowid}, rowcount={self.rowcount})'
+
+
+class _Write:
+    """一个等待写线程执行的操作，可以包含多条语句"""
+    def __init__(self, statements: list[tuple[str, Any, bool]], future: Future):
+        # (sql, 参数, 是否 executemany)
+        self.statements = statements
+        self.future = future
+
+
+class Database:
+    def __init__(self, path: str, readers: int = 4, tick: float = 0.005, max_batch: int = 1000):
+        """
+        Args:
+            path: 数据库文件
+            readers: 读线程数量
+            tick: 写线程收到第一个操作后，最多再等待多久收集同一批的操作(秒)
+            max_batch: 单个事务最多包含的操作数
+        """
+        self.path = path
+        self.readers = readers
+        self.tick = tick
+        self.max_batch = max_batch
+        self._queue: Queue[_Write | None] = Queue()
+        self._writer: threading.Thread | None = None
+        self._read_pool: ThreadPoolExecutor | None = None
+        self._local = threading.local()
+        self._start_lock = threading.Lock()
+        self._read_connections: list[sqlite3.Connection] = []
+        self.commits = 0
+        self.writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA busy_timeout=5000')
+        return connection
+
+    def _ensure_started(self):
+        if self._writer is not None:
+            return
+        with self._start_lock:
+            if self._writer is not None:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = self._connect()
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS kv ('
+                'ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT, '
+                'PRIMARY KEY (ns, key)) WITHOUT ROWID')
+            self._read_pool = ThreadPoolExecutor(self.readers, thread_name_prefix='db-reader')
+            self._writer = threading.Thread(target=self._write_loop, args=(connection,), name='db-writer', daemon=True)
+            self._writer.start()
+
+    # 写
+
+    def _write_loop(self, connection: sqlite3.Connection):
+        queue = self._queue
+        while True:
+            first = queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = monotonic() + self.tick
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - monotonic()
+                try:
+                    op = queue.get(timeout=timeout) if timeout > 0 else queue.get_nowait()
+                except Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+            self._commit(connection, batch)
+            if stop:
+                break
+        connection.close()
+
+    def _commit(self, connection: sqlite3.Connection, batch: list[_Write]):
+        results = []
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for op in batch:
+                connection.execute('SAVEPOINT op')
+                try:
+                    result = None
+                    for sql, params, many in op.statements:
+                        cursor = connection.executemany(sql, params) if many else connection.execute(sql, params)
+                        rows = cursor.fetchall() if cursor.description else None
+                        result = Result(rows, cursor.lastrowid, cursor.rowcount)
+                    connection.execute('RELEASE op')
+                    results.append((op, result, None))
+                except Exception as e:
+                    connection.execute('ROLLBACK TO op')
+                    connection.execute('RELEASE op')
+                    results.append((op, None, e))
+            connection.execute('COMMIT')
+            self.commits += 1
+            self.writes += len(batch)
+        except Exception as e:
+            logger.error(f"Failed to commit {len(batch)} writes: {e}")
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            results = [(op, None, e) for op in batch]
+        for op, result, error in results:
+            try:
+                op.future.get_loop().call_soon_threadsafe(_resolve, op.future, result, error)
+            except RuntimeError:
+                # 事件循环已经关闭，没有人在等待结果
+                pass
+
+    def _submit(self, statements: list[tuple[str, Any, bool]]) -> Future:
+        self._ensure_started()
+        future = get_running_loop().create_future()
+        self._queue.put(_Write(statements, future))
+        return future
+
+    async def execute(self, sql: str, params: Iterable = ()) -> Result:
+        """执行一条写语句，等待所在事务提交后返回"""
+        return await self._submit([(sql, params, False)])
+
+    async def executemany(self, sql: str, seq: Iterable[Iterable]) -> Result:
+        return await self._submit([(sql, list(seq), True)])
+
+    async def transaction(self, statements: list[tuple[str, Iterable]]) -> Result:
+        """原子地执行多条写语句，返回最后一条的结果"""
+        return await self._submit([(sql, params, False) for sql, params in statements])
+
+    # 读
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            connection.execute('PRAGMA query_only=ON')
+            self._read_connections.append(connection)
+        return connection
+
+    def _read(self, sql: str, params: Iterable, mode: str):
+        cursor = self._reader().execute(sql, params)
+        if mode == 'one':
+            return cursor.fetchone()
+        rows = cursor.fetchall()
+        if mode == 'dicts':
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in rows]
+        return rows
+
+    async def _run_read(self, sql: str, params: Iterable, mode: str):
+        self._ensure_started()
+        return await get_running_loop().run_in_executor(self._read_pool, self._read, sql, tuple(params), mode)
+
+    async def fetchall(self, sql: str, params: Iterable = ()) -> list[tuple]:
+        return await self._run_read(sql, params, 'all')
+
+    async def fetchone(self, sql: str, params: Iterable = ()) -> tuple | None:
+        return await self._run_read(sql, params, 'one')
+
+    async def fetchdicts(self, sql: str, params: Iterable = ()) -> list[dict]:
+        """查询并以 {列名: 值} 的列表返回"""
+        return await self._run_read(sql, params, 'dicts')
+
+    def namespace(self, name: str) -> 'Namespace':
+        return Namespace(self, _check_name(name))
+
+    def close(self):
+        """等待写线程提交剩余的操作并关闭所有连接"""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._read_pool.shutdown(wait=True)
+        for connection in self._read_connections:
+            connection.close()
+        self._read_connections.clear()
+
+
+def _resolve(future: Future, result, error):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+class Namespace:
+    """插件独立的键值存储，值以 json 保存"""
+    def __init__(self, database: Database, name: str):
+        self.database = database
+        self.name = name
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        row = await self.database.fetchone('SELECT value FROM kv WHERE ns = ? AND key = ?', (self.name, key))
+        return default if row is None else json.loads(row[0])
+
+    async def set(self, key: str, value: Any):
+        await self.database.execute(
+            'INSERT INTO kv (ns, key, value) VALUES (?, ?, ?) '
+            'ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value',
+            (self.name, key, json.dumps(value, ensure_ascii=False)))
+
+    async def delete(self, key: str) -> bool:
+        result = await self.database.execute('DELETE FROM kv WHERE ns = ? AND key = ?', (self.name, key))
+        return result.rowcount > 0
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        """原子地增加一个整数值，返回增加后的值"""
+        result = await self.database.execute(
+            'INSERT INTO kv (ns, key, value) VALUES (?, ?, ?) '
+            'ON CONFLICT (ns, key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value '
+            'RETURNING value',
+            (self.name, key, amount))
+        return int(result.rows[0][0])
+
+    async def items(self, prefix: str = '') -> list[tuple[str, Any]]:
+        """按 key 排序返回以 prefix 开头的所有键值"""
+        rows = await self.database.fetchall(
+            'SELECT key, value FROM kv WHERE ns = ? AND key >= ? AND key < ? ORDER BY key',
+            (self.name, prefix, prefix + '\U0010ffff'))
+        return [(key, json.loads(value)) for key, value in rows]
+
+    async def keys(self, prefix: str = '') -> list[str]:
+        return [key for key, _ in await self.items(prefix)]
+
+    def table(self, name: str, columns: str, indexes: Iterable[str] = ()) -> 'Table':
+        return Table(self, _check_name(name), columns, list(indexes))
+
+
+class Table:
+    """
+    插件独立的表，实际表名为 `<命名空间>__<表名>`
+    where 子句和列定义由插件提供，列名会被校验
+    """
+    def __init__(self, namespace: Namespace, name: str, columns: str, indexes: list[str]):
+        self.database = namespace.database
+        self.name = f'{namespace.name}__{name}'
+        self.columns = columns
+        self.indexes = [_check_name(column) for column in indexes]
+
+    async def create(self):
+        statements = [(f'CREATE TABLE IF NOT EXISTS {self.name} ({self.columns})', ())]
+        for column in self.indexes:
+            statements.append((f'CREATE INDEX IF NOT EXISTS {self.name}__{column} ON {self.name} ({column})', ()))
+        await self.database.transaction(statements)
+
+    async def insert(self, row: dict) -> int:
+        columns = ', '.join(_check_name(column) for column in row)
+        marks = ', '.join('?' * len(row))
+        result = await self.database.execute(
+            f'INSERT INTO {self.name} ({columns}) VALUES ({marks})', tuple(row.values()))
+        return result.lastrowid
+
+    async def insert_many(self, rows: list[dict]):
+        if not rows:
+            return
+        keys = list(rows[0])
+        columns = ', '.join(_check_name(column) for column in keys)
+        marks = ', '.join('?' * len(keys))
+        await self.database.executemany(
+            f'INSERT INTO {self.name} ({columns}) VALUES ({marks})',
+            [tuple(row[key] for key in keys) for row in rows])
+
+    async def update(self, values: dict, where: str, params: Iterable = ()) -> int:
+        assignments = ', '.join(f'{_check_name(column)} = ?' for column in values)
+        result = await self.database.execute(
+            f'UPDATE {self.name} SET {assignments} WHERE {where}', (*values.values(), *params))
+        return result.rowcount
+
+    async def delete(self, where: str, params: Iterable = ()) -> int:
+        result = await self.database.execute(f'DELETE FROM {self.name} WHERE {where}', tuple(params))
+        return result.rowcount
+
+    async def select(self, where: str = '1', params: Iterable = (), columns: str = '*', suffix: str = '') -> list[dict]:
+        """
+        查询并以字典列表返回
+        suffix 用于 ORDER BY / LIMIT 等子句
+        """
+        return await self.database.fetchdicts(
+            f'SELECT {columns} FROM {self.name} WHERE {where} {suffix}', params)
+
+
+database = Database('data/bot.db')
+atexit.register(database.close)
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.storage
+    import asyncio
+    import tempfile
+
+    async def main(path: str):
+        db = Database(path, readers=4)
+        counters = db.namespace('counter')
+        items = counters.table('items', 'id INTEGER PRIMARY KEY, name TEXT', indexes=['name'])
+        await items.create()
+
+        # 同时提交的写操作合并到少数几个事务中
+        commits = db.commits
+        ids = await asyncio.gather(*(items.insert({'name': f'item {i}'}) for i in range(200)))
+        assert sorted(ids) == list(range(1, 201))
+        assert db.commits - commits < 200 / 10, db.commits - commits
+
+        # 同一批中失败的写操作只回滚它自己
+        results = await asyncio.gather(
+            items.insert({'id': 1000, 'name': 'first'}),
+            items.insert({'id': 1000, 'name': 'duplicate'}),
+            items.insert({'id': 1001, 'name': 'second'}),
+            return_exceptions=True)
+        assert results[0] == 1000 and results[2] == 1001
+        assert isinstance(results[1], sqlite3.IntegrityError), results[1]
+        rows = await items.select('id >= ?', (1000,), suffix='ORDER BY id')
+        assert rows == [{'id': 1000, 'name': 'first'}, {'id': 1001, 'name': 'second'}], rows
+
+        # 事务中的语句一起失败
+        try:
+            await db.transaction([
+                (f'INSERT INTO {items.name} (id, name) VALUES (?, ?)', (2000, 'partial')),
+                (f'INSERT INTO {items.name} (id, name) VALUES (?, ?)', (1000, 'conflict')),
+            ])
+        except sqlite3.IntegrityError:
+            pass
+        else:
+            raise AssertionError('transaction should fail')
+        assert await db.fetchone(f'SELECT 1 FROM {items.name} WHERE id = 2000') is None
+
+        # 原子计数和键值
+        values = await asyncio.gather(*(counters.incr('hits') for _ in range(50)))
+        assert sorted(values) == list(range(1, 51))
+        assert await counters.incr('hits', 10) == 60
+        await counters.set('config', {'enabled': True, 'name': '测试'})
+        assert await counters.get('config') == {'enabled': True, 'name': '测试'}
+        assert await counters.keys() == ['config', 'hits']
+        assert await db.namespace('other').get('hits', 0) == 0
+        assert await counters.delete('config') and not await counters.delete('config')
+
+        # 读操作在多个读线程中并发执行，各自使用只读连接
+        slow = ('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 200000) '
+                'SELECT count(*) FROM c')
+        counts = await asyncio.gather(*(db.fetchall(slow) for _ in range(8)))
+        assert counts == [[(200000,)]] * 8
+        assert 1 < len(db._read_connections) <= 4, len(db._read_connections)
+        try:
+            await db.fetchall(f'DELETE FROM {items.name}')
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError('reader should be read-only')
+        assert (await db.fetchone(f'SELECT count(*) FROM {items.name}'))[0] == 202
+
+        db.close()
+        assert db._writer is None and not db._read_connections
+
+    with tempfile.TemporaryDirectory() as root:
+        asyncio.run(main(os.path.join(root, 'test.db')))
+    print("所有测试通过！")
@@ -0,0 +1,264 @@
+"""
+事件循环卡顿监控，找出阻塞事件循环的处理器
+
+设计目标：
+1. 同步处理器阻塞事件循环时，所有会话都会卡住，需要在日志和指标中直接看到是谁
+2. 正常运行时开销可以忽略
+3. 可选地把反复阻塞的同步处理器自动放到线程池中执行
+
+实现方式：
+- 事件循环中用 call_later 定时心跳，心跳的实际时间与预期时间之差就是循环延迟
+- 监控线程检查最近一次心跳，超过半个阈值仍未到来时说明循环可能正在被阻塞，
+  此时读取事件循环线程的栈，从内向外按代码对象找到正在执行的 EventHandler(见 profiler.handler_codes)
+- 心跳恢复后得到这次阻塞的实际时长，计入对应处理器的统计
+- 每次阻塞只抓取一次栈，监控线程不访问帧的局部变量
+- 监控线程同样需要 GIL，被 C 扩展长时间占用 GIL 的阻塞无法抓到栈，记为未知
+- memoize 包装的同步处理器在包装器中调用，包装器带有 offload 属性，同样可以被放到线程池
+
+使用示例：
+    ```python
+    watchdog = LoopWatchdog(threshold=0.1, demote_after=3)
+    watchdog.start()
+    ...
+    for line in watchdog.summary():
+        print(line)
+    watchdog.stop()
+    ```
+"""
+
+import sys
+import logging
+import threading
+import traceback
+from time import monotonic
+from weakref import WeakKeyDictionary
+from asyncio import get_running_loop, AbstractEventLoop, TimerHandle
+
+from .event import EventHandler
+from .metrics import registry
+from .profiler import handler_codes
+
+logger = logging.getLogger(__name__)
+
+_lag = registry.histogram('event_loop_lag_seconds', '事件循环心跳延迟').labels()
+_stalls = registry.counter('event_loop_stalls_total', '事件循环被阻塞的次数', ['handler'])
+
+
+class BlockStats:
+    """一个处理器阻塞事件循环的统计"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = ''
+
+    def add(self, seconds: float, stack: str):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if stack:
+            self.stack = stack
+
+
+def find_handler(frame) -> tuple[EventHandler | None, bool]:
+    """
+    在栈中从内向外找到第一个属于处理器的帧
+    返回 (处理器, 是否是过滤函数)，不在处理器中时返回 (None, False)
+    """
+    codes = handler_codes()
+    while frame is not None:
+        found = codes.get(frame.f_code)
+        if found is not None:
+            return found
+        frame = frame.f_back
+    return None, False
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, demote_after: int = 0, stack_limit: int = 20):
+        """
+        Args:
+            threshold: 心跳延迟超过此秒数视为阻塞
+            interval: 心跳间隔
+            demote_after: 同步处理器阻塞达到此次数后改为在线程池中执行，0 表示不自动处理
+            stack_limit: 记录的栈帧数
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.demote_after = demote_after
+        self.stack_limit = stack_limit
+        self.stats: WeakKeyDictionary[EventHandler, BlockStats] = WeakKeyDictionary()
+        # 不在处理器中(或无法抓到栈)的阻塞
+        self.unattributed = BlockStats()
+        self.loop: AbstractEventLoop | None = None
+        self.loop_thread: int | None = None
+        self.expected = 0.0
+        self.handle: TimerHandle | None = None
+        # 监控线程抓到的栈：(阻塞开始前预期的心跳时间, 处理器, 是否是过滤函数, 栈文本)
+        self.capture: tuple[float, EventHandler | None, bool, str] | None = None
+        self.stopping = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        """在事件循环中调用"""
+        if self.thread is not None:
+            return
+        self.loop = get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.expected = monotonic() + self.interval
+        self.handle = self.loop.call_later(self.interval, self._beat)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """等待监控线程退出，之后可以立即重新 start"""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.stopping.set()
+        thread, self.thread = self.thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _beat(self):
+        now = monotonic()
+        expected = self.expected
+        lag = max(0.0, now - expected)
+        self.expected = now + self.interval
+        self.handle = self.loop.call_later(self.interval, self._beat)
+        _lag.observe(lag)
+        if lag >= self.threshold:
+            capture = self.capture
+            self.capture = None
+            if capture is not None and capture[0] == expected:
+                _, handler, is_filter, stack = capture
+            else:
+                handler, is_filter, stack = None, False, ''
+            self._record(handler, is_filter, lag, stack)
+
+    def _monitor(self):
+        # 每 1/4 阈值检查一次，保证超过阈值的阻塞至少被检查到一次
+        while not self.stopping.wait(self.threshold / 4):
+            expected = self.expected
+            if monotonic() - expected < self.threshold / 2:
+                continue
+            if self.capture is not None and self.capture[0] == expected:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            handler, is_filter = find_handler(frame)
+            stack = ''.join(traceback.format_list(traceback.extract_stack(frame, self.stack_limit)))
+            del frame
+            self.capture = (expected, handler, is_filter, stack)
+
+    def _record(self, handler: EventHandler | None, is_filter: bool, seconds: float, stack: str):
+        name = f'{handler}{" filter" if is_filter else ""}' if handler is not None else 'unknown'
+        logger.warning(f'事件循环被阻塞 {seconds * 1000:.0f}ms: {name}\n{stack}'.rstrip())
+        _stalls.labels(name).inc()
+        if handler is None:
+            self.unattributed.add(seconds, stack)
+            return
+        stats = self.stats.get(handler)
+        if stats is None:
+            stats = self.stats[handler] = BlockStats()
+        stats.add(seconds, stack)
+        # 异步处理器只有在包装了同步函数(带有 offload 属性，例如 memoize)时才能放到线程池
+        if (self.demote_after and not is_filter and stats.count >= self.demote_after
+                and not handler._offload and (not handler._async or hasattr(handler.func, 'offload'))):
+            handler.offload()
+            logger.warning(f'{handler} 已阻塞 {stats.count} 次，之后将在线程池中执行')
+
+    def summary(self, n: int = 10) -> list[str]:
+        """按总阻塞时间排序的处理器"""
+        rows = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)[:n]
+        lines = [
+            f'{handler} n={s.count} total={s.total * 1000:.0f}ms max={s.max * 1000:.0f}ms'
+            f'{" (线程池)" if handler._offload else ""}'
+            for handler, s in rows
+        ]
+        if self.unattributed.count:
+            s = self.unattributed
+            lines.append(f'unknown n={s.count} total={s.total * 1000:.0f}ms max={s.max * 1000:.0f}ms')
+        return lines
+
+
+if __name__ == '__main__':
+    # 运行方式: python -m core.watchdog
+    import asyncio
+    from time import sleep as block
+    from itertools import count
+    from .event import Event, on, emit
+    from .cache import memoize
+
+    class SlowEvent(Event):
+        pass
+
+    class FilteredEvent(Event):
+        pass
+
+    class MemoEvent(Event):
+        pass
+
+    calls = []
+    memo_calls = []
+
+    @on(SlowEvent)
+    def slow_handler(ctx):
+        calls.append(threading.get_ident())
+        block(0.2)
+
+    @on(FilteredEvent).filter(lambda ctx: block(0.15) or True)
+    async def slow_filter(ctx):
+        pass
+
+    # 每次都是新的 key，原函数在缓存的加载任务中执行，栈中没有 run_handlers
+    keys = count()
+
+    @on(MemoEvent)
+    @memoize(key=lambda ctx: next(keys))
+    def slow_handler(ctx):
+        memo_calls.append(threading.get_ident())
+        block(0.2)
+
+    async def main():
+        watchdog = LoopWatchdog(threshold=0.1, interval=0.02, demote_after=2)
+        watchdog.start()
+        loop_thread = threading.get_ident()
+        for _ in range(3):
+            await emit(SlowEvent())
+            await asyncio.sleep(0.05)
+            await emit(FilteredEvent())
+            await asyncio.sleep(0.05)
+            await emit(MemoEvent())
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.1)
+        watchdog.stop()
+        print('\n'.join(watchdog.summary()))
+
+        stats = {str(h): s for h, s in watchdog.stats.items()}
+        slow = stats['EventHandler(SlowEvent)(slow_handler)']
+        # 前两次阻塞了事件循环，之后被放到线程池
+        assert slow.count == 2, slow.count
+        assert 'block(0.2)' in slow.stack
+        assert calls[:2] == [loop_thread] * 2 and calls[2] != loop_thread
+        # 过滤函数阻塞也能被找到，但不会被放到线程池
+        assert stats['EventHandler(FilteredEvent)(slow_filter)'].count == 3
+        # 同名的 memoize 处理器按原函数找到，包装了同步函数的处理器同样可以放到线程池
+        memo = stats['EventHandler(MemoEvent)(slow_handler)']
+        assert memo.count == 2, memo.count
+        assert memo_calls[:2] == [loop_thread] * 2 and memo_calls[2] != loop_thread
+        assert _lag.count > 0
+
+        # stop 后立即 start 不会留下两个监控线程
+        for _ in range(5):
+            watchdog.start()
+            watchdog.stop()
+        watchdog.start()
+        assert [t.name for t in threading.enumerate()].count('loop-watchdog') == 1
+        watchdog.stop()
+        assert 'loop-watchdog' not in [t.name for t in threading.enumerate()]
+
+    asyncio.run(main())
+    print("所有测试通过！")
@@ -1,6 +1,10 @@
 import asyncio
+import sys
 import core
 import core.logs
 
 
-asyncio.run(core.start())
+asyncio.run(core.start(
+    hot_reload='--hot-reload' in sys.argv,
+    profile='--profile-startup' in sys.argv,
+))
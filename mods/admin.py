@@ -0,0 +1,110 @@
+"""
+管理插件，提供运行时指标的查看和导出
+
+配置保存在 data/store/admin.yaml：
+    admins: 管理员的用户 id
+    metrics: 指标导出的 host 和 port，port 为 0 时不启动
+    profile: 采样频率和最长采样时间
+    memory: tracemalloc 记录的栈深度和最长诊断时间
+    watchdog: 事件循环阻塞的阈值(秒，0 为不启动)，以及同步处理器阻塞多少次后放到线程池(0 为不处理)
+
+用法：
+    /metrics [前缀]   查看指标摘要，可以只显示名称以前缀开头的指标
+    /profile [秒数]   采样事件循环(默认 10 秒)，回复占用最多的插件和处理器，完整的折叠栈写入 logs/
+    /stalls           查看阻塞事件循环最久的处理器
+    /mem [秒数]       开启 tracemalloc 一段时间(默认 30 秒)，回复内存增长最多的插件和代码行
+    /mem objects      统计存活的处理器、上下文、事件和 Future，以及与上次统计相比的变化
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from time import strftime
+
+from core.event import Context
+from core.message import MessageEvent
+from core.command import on_command, parse_command
+from core.data import store
+from core.metrics import registry, serve
+from core.profiler import SamplingProfiler
+from core.watchdog import LoopWatchdog
+from core.memdiag import MemoryDiagnostics
+
+config = store.get('admin', {
+    'admins': [],
+    'metrics': {'host': '127.0.0.1', 'port': 9108},
+    'profile': {'rate': 100, 'max_seconds': 60},
+    'watchdog': {'threshold': 0.1, 'demote_after': 0},
+    'memory': {'frames': 16, 'max_seconds': 300},
+})
+
+server = None
+profiler = SamplingProfiler(config.profile.rate)
+watchdog = LoopWatchdog(config.watchdog.threshold, demote_after=config.watchdog.demote_after)
+memory = MemoryDiagnostics(config.memory.frames)
+
+
+def is_admin(context: Context) -> bool:
+    return context.event.get('user_id') in config.admins
+
+@on_command('metrics')
+def metrics(context: Context[MessageEvent]):
+    if not is_admin(context):
+        return
+    _, args = parse_command(context.event)
+    lines = [line for line in registry.summary() if not args or line.startswith(args[0])]
+    return '\n'.join(lines) or '没有指标'
+
+@on_command('profile')
+async def profile(context: Context[MessageEvent]):
+    if not is_admin(context):
+        return
+    _, args = parse_command(context.event)
+    try:
+        seconds = min(float(args[0]) if args else 10, config.profile.max_seconds)
+    except ValueError:
+        return '用法: /profile [秒数]'
+    if profiler.running:
+        return '已有正在进行的采样'
+    await context.send(f'开始采样 {seconds:g} 秒')
+    result = await profiler.profile(seconds)
+    path = f'logs/profile-{strftime("%Y%m%d-%H%M%S")}.folded'
+    result.write_folded(path)
+    logger.info(f'Profile written to {path}')
+    return f'{result.top(5)}\n折叠栈: {path}'
+
+@on_command('stalls')
+def stalls(context: Context[MessageEvent]):
+    if not is_admin(context):
+        return
+    return '\n'.join(watchdog.summary()) or '没有记录到阻塞'
+
+@on_command('mem')
+async def mem(context: Context[MessageEvent]):
+    if not is_admin(context):
+        return
+    _, args = parse_command(context.event)
+    if args and args[0] == 'objects':
+        return '\n'.join(f'{count} ({diff:+d}) {name}' for name, count, diff in memory.count_objects())
+    try:
+        seconds = min(float(args[0]) if args else 30, config.memory.max_seconds)
+    except ValueError:
+        return '用法: /mem [秒数|objects]'
+    if memory.running:
+        return '已有正在进行的诊断'
+    await context.send(f'开始记录 {seconds:g} 秒内的内存分配')
+    report = await memory.diff(seconds)
+    return report.format(8)
+
+
+async def start():
+    global server
+    if config.metrics.port:
+        server = await serve(registry, config.metrics.host, config.metrics.port)
+    if config.watchdog.threshold:
+        watchdog.start()
+
+def unload():
+    if server is not None:
+        server.close()
+    watchdog.stop()
@@ -0,0 +1,26 @@
+"""
+连续消息合并插件，为监听 MergedMessageEvent 的处理器提供合并后的消息流
+
+配置保存在 data/store/coalesce.yaml：
+    window: 最后一条消息之后等待的秒数
+    max_wait: 从第一条消息开始最多等待的秒数
+    max_messages: 合并的最多消息数
+"""
+
+from core.data import store
+from core.coalesce import Coalescer
+
+config = store.get('coalesce', {
+    'window': 1.0,
+    'max_wait': 3.0,
+    'max_messages': 20,
+})
+
+coalescer = Coalescer(config.window, config.max_wait, config.max_messages)
+
+
+async def start():
+    coalescer.install()
+
+def unload():
+    coalescer.uninstall()
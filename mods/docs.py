@@ -0,0 +1,106 @@
+"""
+文档系统插件
+
+用法：
+    /doc ls [目录]              列出目录
+    /doc get <路径>             查看文档
+    /doc add <路径> <内容>      新建文本文档
+    /doc edit <路径> <内容>     修改文本文档
+    /doc rm <路径>              删除文档
+    /doc tag <路径> [标签...]   设置文档标签
+    /doc find <标签> [标签...]  查找同时带有这些标签的文档
+"""
+
+__manifest__ = {
+    'commands': ['doc'],
+}
+
+from time import strftime, localtime
+import logging
+logger = logging.getLogger(__name__)
+
+from core.event import Context
+from core.message import MessageEvent, MessageNode
+from core.command import on_command, parse_command
+from core.cache import memoize
+from core.document import DocumentStore
+
+docs = DocumentStore('data/docs')
+
+USAGE = __doc__.split('用法：', 1)[1].strip('\n')
+
+
+def _describe(doc) -> str:
+    return (f"{doc.path} [{doc.kind}] {' '.join('#' + tag for tag in sorted(doc.tags))}\n"
+            f"修改于 {strftime('%Y-%m-%d %H:%M', localtime(doc.modified))} by {doc.modifier}")
+
+def _read_key(context: Context[MessageEvent]):
+    """只读的子命令按参数缓存，修改文档的子命令不缓存"""
+    _, args = parse_command(context.event)
+    if args and args[0] in ('ls', 'find', 'get'):
+        return tuple(args)
+    return None
+
+@on_command('doc')
+@memoize(ttl=600, key=_read_key)
+async def doc_command(context: Context[MessageEvent]):
+    _, args = parse_command(context.event)
+    if not args:
+        return USAGE
+    sub, args = args[0], args[1:]
+    user_id = context.event.get('user_id')
+
+    if sub == 'ls':
+        listing = docs.list_dir(args[0] if args else '')
+        if listing is None:
+            return '目录不存在'
+        dirs, files = listing
+        return '\n'.join([f'{d}/' for d in dirs] + [doc.name for doc in files]) or '(空)'
+
+    if sub == 'find':
+        found = docs.by_tags(*args)
+        return '\n'.join(doc.path for doc in found[:20]) or '没有找到文档'
+
+    if not args:
+        return USAGE
+    path, rest = args[0], args[1:]
+    doc = docs.find(path)
+
+    if sub == 'add':
+        if doc is not None:
+            return '文档已存在'
+        try:
+            doc = await docs.add(path, text=' '.join(rest), user_id=user_id)
+        except FileExistsError:
+            return '文档已存在'
+        doc_command.cache.clear()
+        return f'已创建 {doc.path}'
+    if doc is None:
+        return '文档不存在'
+    if sub == 'get':
+        if doc.kind == 'text':
+            return f'{_describe(doc)}\n{await docs.read_text(doc)}'
+        if doc.kind == 'image':
+            return [MessageNode({'type': 'image', 'data': {'file': 'file://' + docs.blob_path(doc)}})]
+        return _describe(doc)
+    if sub == 'edit':
+        await docs.update(doc, text=' '.join(rest), user_id=user_id)
+        doc_command.cache.clear()
+        return f'已修改 {doc.path}'
+    if sub == 'rm':
+        await docs.remove(doc)
+        doc_command.cache.clear()
+        return f'已删除 {doc.path}'
+    if sub == 'tag':
+        await docs.set_tags(doc, rest, user_id=user_id)
+        doc_command.cache.clear()
+        return _describe(doc)
+    return USAGE
+
+
+async def start():
+    await docs.load()
+    logger.info(f'文档系统已加载 {len(docs.docs)} 个文档')
+
+def unload():
+    pass
@@ -0,0 +1,20 @@
+"""
+事件日志插件，把所有事件按日期和区域记录到 data/eventlog
+"""
+
+from asyncio import create_task
+import logging
+logger = logging.getLogger(__name__)
+
+from core.eventlog import EventLog
+
+event_log = EventLog('data/eventlog')
+
+
+async def start():
+    event_log.install()
+    create_task(event_log.run())
+    logger.info('事件日志已启动')
+
+def unload():
+    event_log.close()
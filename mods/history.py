@@ -0,0 +1,48 @@
+"""
+消息历史插件，索引所有消息，并提供 /find 命令检索当前群的历史消息
+
+用法：
+    /find 关键词 [关键词...]
+"""
+
+from asyncio import create_task
+from time import strftime, localtime
+import logging
+logger = logging.getLogger(__name__)
+
+from core.event import on, Order, Context
+from core.message import MessageEvent
+from core.command import on_command, parse_command
+from core.history import MessageHistory
+
+history = MessageHistory('data/history')
+
+
+@on(MessageEvent).order(Order.RESULT).force()
+def index_message(context: Context[MessageEvent]):
+    history.add(context.event)
+
+@on_command('find')
+async def find(context: Context[MessageEvent]):
+    _, args = parse_command(context.event)
+    if not args:
+        return '用法: /find 关键词 [关键词...]'
+    event = context.event
+    if event.get('group_id') is not None:
+        results = await history.search(' '.join(args), group_id=event.group_id, limit=10)
+    else:
+        results = await history.search(' '.join(args), user_id=event.user_id, limit=10)
+    if not results:
+        return '没有找到相关消息'
+    return '\n'.join(
+        f"[{strftime('%m-%d %H:%M', localtime(doc['time']))}] {doc['user_id']}: {doc['text']}"
+        for doc in results
+    )
+
+
+async def start():
+    create_task(history.run())
+    logger.info('消息历史已启动')
+
+def unload():
+    history.close()
@@ -0,0 +1,50 @@
+"""
+物理机监控插件
+
+用法：
+    /status           查看 CPU、内存、硬盘和网络的当前状态和最近的平均值
+"""
+
+from asyncio import create_task
+import logging
+logger = logging.getLogger(__name__)
+
+from core.event import Context
+from core.message import MessageEvent
+from core.command import on_command
+from core.cache import memoize
+from core.hostmetrics import HostSampler, SECOND, MINUTE
+
+sampler = HostSampler()
+
+
+def _size(n: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f'{n:.1f}{unit}'
+        n /= 1024
+    return f'{n:.1f}TB'
+
+@on_command('status')
+@memoize(ttl=2)
+def status(context: Context[MessageEvent]):
+    now = sampler.latest()
+    if not now:
+        return '还没有采样数据'
+    cpu_min = sampler.summary('cpu', SECOND, 60)
+    cpu_hour = sampler.summary('cpu', MINUTE, 60)
+    lines = [
+        f"CPU {now['cpu']:.1f}%  1分钟 {cpu_min[0]:.1f}%(峰值 {cpu_min[1]:.1f}%)"
+        + (f"  1小时 {cpu_hour[0]:.1f}%" if cpu_hour else ''),
+        f"内存 {now['mem']:.1f}% ({_size(now['mem_used'])})  机器人 {_size(now['rss'])}",
+        f"硬盘 {now['disk']:.1f}%  读 {_size(now['disk_read'])}/s  写 {_size(now['disk_write'])}/s",
+        f"网络 收 {_size(now['net_rx'])}/s  发 {_size(now['net_tx'])}/s",
+    ]
+    return '\n'.join(lines)
+
+
+async def start():
+    create_task(sampler.run())
+
+def unload():
+    sampler.close()
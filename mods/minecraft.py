@@ -0,0 +1,48 @@
+"""
+Minecraft 服务器插件，监控服务器日志并把聊天转发到群
+
+配置保存在 data/store/minecraft.yaml：
+    log: 服务器 latest.log 的路径
+    server: 服务器名
+    groups: 转发到的群号列表
+    context: 用于发送消息的适配器上下文，例如 adapters.onebot.OneBotContext
+    window: 合并转发的时间窗口(秒)
+
+日志监控需要在启动时开始，因此本模块不声明 __manifest__；/mc 命令在 mods/rcon.py 中，按需加载
+"""
+
+import importlib
+from asyncio import create_task
+import logging
+logger = logging.getLogger(__name__)
+
+from core.data import store
+from core.minecraft import LogTailer, ChatForwarder
+
+config = store.get('minecraft', {
+    'log': 'server/logs/latest.log',
+    'server': 'mc',
+    'groups': [],
+    'context': '',
+    'window': 2.0,
+})
+
+tailer = LogTailer(config.log, config.server)
+forwarder: ChatForwarder | None = None
+
+
+async def start():
+    global forwarder
+    create_task(tailer.run())
+    if config.groups and config.context:
+        module, _, name = config.context.rpartition('.')
+        context_type = getattr(importlib.import_module(module), name)
+        forwarder = ChatForwarder(context_type, list(config.groups), config.window)
+        forwarder.install()
+        create_task(forwarder.run())
+    logger.info(f'正在监控 {config.log}')
+
+def unload():
+    tailer.stop()
+    if forwarder is not None:
+        forwarder.stop()
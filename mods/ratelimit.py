@@ -0,0 +1,47 @@
+"""
+刷屏限流插件
+
+配置保存在 data/store/ratelimit.yaml：
+    action: 超限时的动作，drop 丢弃，delay 延迟，warn 丢弃并提醒一次
+    user / group: [条数, 秒数]，每个用户/每个群的限制，为空时不限制
+    command: [条数, 秒数]，每个用户每个命令的默认限制
+    commands: {命令名: [条数, 秒数]}，单独限制某些命令
+    max_delay: delay 动作最多等待的秒数
+    exempt: 不受限制的用户 id
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from core.data import store
+from core.ratelimit import RateLimiter, RateLimit
+
+config = store.get('ratelimit', {
+    'action': 'warn',
+    'user': [20, 60],
+    'group': [60, 60],
+    'command': [10, 60],
+    'commands': {},
+    'max_delay': 5,
+    'exempt': [],
+})
+
+
+def _rule(value) -> RateLimit | None:
+    return RateLimit(*value) if value else None
+
+limiter = RateLimiter(
+    user=_rule(config.user),
+    group=_rule(config.group),
+    command={None: _rule(config.command), **{name: _rule(value) for name, value in config.commands.items()}},
+    action=config.action,
+    max_delay=config.max_delay,
+    exempt=lambda context: context.event.get('user_id') in config.exempt,
+)
+
+
+async def start():
+    limiter.install()
+
+def unload():
+    limiter.uninstall()
@@ -0,0 +1,61 @@
+"""
+Minecraft RCON 插件，在群里执行服务器命令
+
+配置保存在 data/store/rcon.yaml：
+    host / port / password: RCON 连接信息，password 为空时不启用
+    admins: 可以使用 /mc 的用户
+    pipeline: 一次性写出所有命令，原版服务器会丢包，只在服务器能解析连续的包时开启
+
+用法：
+    /mc 命令          执行一条命令
+    /mc               之后的每一行是一条命令，一次性发送，可以直接粘贴 .mcfunction 的内容
+"""
+
+__manifest__ = {
+    'commands': ['mc'],
+}
+
+import logging
+logger = logging.getLogger(__name__)
+
+from core.event import Context
+from core.message import MessageEvent, message_text
+from core.command import on_command
+from core.data import store
+from core.rcon import RconClient, RconError, function_commands
+
+config = store.get('rcon', {
+    'host': '127.0.0.1',
+    'port': 25575,
+    'password': '',
+    'admins': [],
+    'pipeline': False,
+})
+
+rcon = RconClient(config.host, config.port, config.password, pipeline=config.pipeline)
+
+
+@on_command('mc')
+async def mc(context: Context[MessageEvent]):
+    if context.event.get('user_id') not in config.admins:
+        return
+    if not config.password:
+        return '没有配置 RCON'
+    parts = message_text(context.event.message).split(None, 1)
+    commands = function_commands(parts[1]) if len(parts) > 1 else []
+    if not commands:
+        return '用法: /mc 命令'
+    try:
+        results = await rcon.batch(commands)
+    except (ConnectionError, TimeoutError, RconError) as e:
+        return f'RCON 连接失败: {e}'
+    if len(results) == 1:
+        return results[0] or '(无输出)'
+    return f'已执行 {len(results)} 条命令\n' + '\n'.join(r for r in results[-5:] if r)
+
+
+async def start():
+    pass
+
+def unload():
+    rcon.close()
@@ -0,0 +1,51 @@
+"""
+资源包插件，增量打包资源包
+
+配置保存在 data/store/resourcepack.yaml：
+    sources: 源目录列表，后面的覆盖前面的
+    output: 输出的 zip 路径
+    admins: 可以使用 /pack 的用户
+
+用法：
+    /pack             增量打包
+    /pack full        重新压缩所有文件
+"""
+
+__manifest__ = {
+    'commands': ['pack'],
+}
+
+import logging
+logger = logging.getLogger(__name__)
+
+from core.event import Context
+from core.message import MessageEvent
+from core.command import on_command, parse_command
+from core.data import store
+from core.resourcepack import PackBuilder
+
+config = store.get('resourcepack', {
+    'sources': ['data/pack/src'],
+    'output': 'data/pack/pack.zip',
+    'admins': [],
+})
+
+builder = PackBuilder(list(config.sources), config.output)
+
+
+@on_command('pack')
+async def pack(context: Context[MessageEvent]):
+    if context.event.get('user_id') not in config.admins:
+        return
+    _, args = parse_command(context.event)
+    result = await builder.build(force=args[:1] == ['full'])
+    return (f'资源包 v{result.version} 打包完成，用时 {result.seconds:.1f}s\n'
+            f'文件 {result.files}，重新压缩 {result.compressed}，删除 {result.removed}\n'
+            f'大小 {result.size / 1024 / 1024:.1f}MB\nSHA-1 {result.sha1}')
+
+
+async def start():
+    pass
+
+def unload():
+    builder.close()